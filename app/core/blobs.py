@@ -0,0 +1,121 @@
+import asyncio
+import os
+try:
+    from compression import zstd # Python 3.14+
+except ImportError:
+    try:
+        from backports import zstd # backports.zstd on older Pythons
+    except ImportError:
+        zstd = None
+from app.core.database import get_shards
+
+MEDIA_COMPRESSION = os.getenv("MEDIA_COMPRESSION", "none").lower() # "zstd" compresses new writes with the active dictionary
+MEDIA_COMPRESSION_LEVEL = int(os.getenv("MEDIA_COMPRESSION_LEVEL", 3))
+ZSTD_DICT_REFRESH = float(os.getenv("ZSTD_DICT_REFRESH", 60)) # Seconds between checks for a newly rolled out dictionary
+
+# First byte of a stored mediafile: value. A serialized proto can never start with 0x00-0x07 (that's field number 0)
+# so those mark the other formats, anything else is a plain OmnistreamProtoSummary.
+# 0x01: 4 byte little endian dictionary id then a zstd frame compressed with that dictionary.
+# The id is in front (and left out of the frame) so reads don't have to parse the frame header to find it.
+BLOB_ZSTD_DICT = 0x01
+
+# Rolled out dictionaries live on every shard, {dict id: dictionary} and the id new writes should use
+ZSTD_DICTS_KEY = "zstd:dicts"
+ZSTD_ACTIVE_DICT_KEY = "zstd:dicts:active"
+
+dictionaries = {} # dict id -> zstd.ZstdDict
+active_dictionary = None
+compressor = None
+
+class MissingDictionary(Exception):
+    """
+    A blob was compressed with a dictionary this worker hasn't loaded.
+    """
+
+def compression_available() -> bool:
+    return zstd is not None
+
+def set_active_dictionary(zstd_dict):
+    """
+    Dictionary new writes get compressed with, None stores them as plain protos.
+    """
+    global active_dictionary, compressor
+    active_dictionary = zstd_dict
+    compressor = MediaCompressor(zstd_dict) if zstd_dict is not None and MEDIA_COMPRESSION == "zstd" else None
+
+class MediaCompressor:
+    """
+    Reusable BLOB_ZSTD_DICT writer for one dictionary, the dictionary is digested once up front.
+    """
+
+    def __init__(self, zstd_dict, level: int = MEDIA_COMPRESSION_LEVEL):
+        options = {zstd.CompressionParameter.compression_level: level, zstd.CompressionParameter.dict_id_flag: 0}
+        self.compressor = zstd.ZstdCompressor(options=options, zstd_dict=zstd_dict.as_digested_dict)
+        self.header = bytes((BLOB_ZSTD_DICT,)) + zstd_dict.dict_id.to_bytes(4, "little")
+
+    def pack(self, data: bytes) -> bytes:
+        return self.header + self.compressor.compress(data, mode=zstd.ZstdCompressor.FLUSH_FRAME)
+
+def pack_media_blob(data: bytes, media_compressor=None) -> bytes:
+    """
+    Serialized proto -> what gets stored, compressed when there's an active dictionary and MEDIA_COMPRESSION is zstd.
+    """
+    media_compressor = media_compressor or compressor
+    if media_compressor is None or not data:
+        return data
+    return media_compressor.pack(data)
+
+def unpack_media_blob(blob: bytes) -> bytes:
+    """
+    Stored value -> serialized proto, whichever format it was written in.
+    """
+    if not blob or blob[0] != BLOB_ZSTD_DICT:
+        return blob
+    if zstd is None:
+        raise RuntimeError("Found a zstd compressed media but zstd isn't available, install backports.zstd or use Python 3.14+.")
+    dict_id = int.from_bytes(blob[1:5], "little")
+    zstd_dict = dictionaries.get(dict_id)
+    if zstd_dict is None:
+        raise MissingDictionary(f"No zstd dictionary {dict_id} loaded.")
+    return zstd.decompress(memoryview(blob)[5:], zstd_dict=zstd_dict)
+
+async def unpack_media_blobs(blobs: list) -> list:
+    """
+    unpack_media_blob over a list (Nones stay None), loads dictionaries rolled out since startup when it meets one.
+    """
+    try:
+        return [unpack_media_blob(blob) if blob else blob for blob in blobs]
+    except MissingDictionary:
+        await load_dictionaries()
+        return [unpack_media_blob(blob) if blob else blob for blob in blobs]
+
+async def load_dictionaries(redis_client=None):
+    """
+    Loads every rolled out dictionary and switches writes over to the active one.
+    """
+    if zstd is None:
+        return
+    redis_client = redis_client or get_shards()[0]
+    stored, active_id = await asyncio.gather(redis_client.hgetall(ZSTD_DICTS_KEY), redis_client.get(ZSTD_ACTIVE_DICT_KEY))
+
+    for dict_id, dict_content in stored.items():
+        if int(dict_id) not in dictionaries:
+            dictionaries[int(dict_id)] = zstd.ZstdDict(dict_content)
+
+    active = dictionaries.get(int(active_id)) if active_id else None
+    if active is not active_dictionary:
+        print(f"Media compression: {'dictionary ' + str(active.dict_id) if active else 'off'} ({MEDIA_COMPRESSION})")
+        set_active_dictionary(active)
+
+async def refresh_dictionaries():
+    """
+    Background task that picks up dictionary rollouts every ZSTD_DICT_REFRESH seconds.
+    """
+    while True:
+        try:
+            await load_dictionaries()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Dictionary refresh error: {e}")
+        await asyncio.sleep(ZSTD_DICT_REFRESH)
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from app.core import metrics
+from app.core.database import get_shards, has_replicas
+
+MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", 10000)) # 0 turns the cache off
+MEDIA_CACHE_TTL = float(os.getenv("MEDIA_CACHE_TTL", 0)) # Seconds, 0 means entries only leave on eviction/invalidation
+MEDIA_CACHE_CHANNEL = os.getenv("MEDIA_CACHE_CHANNEL", "omnistream:invalidate")
+LOOKUP_COALESCE = os.getenv("LOOKUP_COALESCE", "true").lower() in ("1", "true", "yes") # Identical lookups running at the same time share one fetch
+# A miss filled from a lagging replica can put back what an invalidation just dropped,
+# so with replicas configured entries never live longer than this
+REPLICA_CACHE_TTL = float(os.getenv("REPLICA_CACHE_TTL", 30))
+
+class LRUCache:
+    """
+    Size bounded LRU with an optional TTL, not thread safe (only touched from the event loop).
+
+    Anything read from redis before a key's invalidation can't be put back after it, callers grab
+    `version` before fetching and hand it to set() which drops the value if that key got invalidated since.
+    Invalidated keys are remembered (up to maxsize of them) with the version they were dropped at,
+    once one is forgotten every version before it is refused, like clear() does for all of them.
+    """
+
+    def __init__(self, maxsize: int, ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0 # Goes up on every invalidation
+        self.invalidated = OrderedDict() # key -> version it was last invalidated at, oldest first
+        self.floor = 0 # Versions older than this are refused for every key
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, tag=None):
+        """
+        tag only gets the value if it was set with the same tag (e.g. a digest of what it was made from).
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires, entry_tag = entry
+        if expires and expires < time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        if tag is not None and tag != entry_tag:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, version: int, tag=None):
+        if self.maxsize <= 0 or version < self.floor or self.invalidated.get(key, 0) > version:
+            return
+        self.entries[key] = (value, time.monotonic() + self.ttl if self.ttl else 0, tag)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys):
+        self.version += 1
+        for key in keys:
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+            if self.maxsize > 0:
+                self.invalidated[key] = self.version
+                self.invalidated.move_to_end(key)
+        while len(self.invalidated) > self.maxsize:
+            _, version = self.invalidated.popitem(last=False)
+            self.floor = max(self.floor, version)
+
+    def clear(self):
+        self.version += 1
+        self.floor = self.version
+        self.invalidated.clear()
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+media_cache_ttl = MEDIA_CACHE_TTL
+if has_replicas() and REPLICA_CACHE_TTL:
+    media_cache_ttl = min(MEDIA_CACHE_TTL or REPLICA_CACHE_TTL, REPLICA_CACHE_TTL)
+
+# unique_id -> OmnistreamMetadata
+media_cache = LRUCache(MEDIA_CACHE_SIZE, media_cache_ttl)
+
+@metrics.register_collector
+def cache_metrics() -> list:
+    stats = media_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    lines = []
+    for name in ("hits", "misses", "evictions", "invalidations"):
+        lines += metrics.render_samples(f"omnistream_media_cache_{name}_total", "counter", f"Media cache {name}.", [({}, stats[name])])
+    lines += metrics.render_samples("omnistream_media_cache_size", "gauge", "Media currently cached.", [({}, stats["size"])])
+    lines += metrics.render_samples("omnistream_media_cache_hit_ratio", "gauge", "Hits over lookups since start.", [({}, stats["hits"] / lookups if lookups else 0)])
+    return lines
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, whoever asks while one is running waits on it and gets
+    its result or its exception instead of running their own. Not thread safe (only touched from the event loop).
+
+    The call runs as its own task (in the context of whoever started it), so a caller that gets cancelled
+    only stops waiting, the call is cancelled once nobody waits on it anymore.
+    """
+
+    def __init__(self):
+        self.flights = {} # key -> [task, callers waiting on it]
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, func, *args):
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = [asyncio.ensure_future(func(*args)), 0]
+            flight[0].add_done_callback(lambda task: self.land(key, flight))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0])
+        finally:
+            flight[1] -= 1
+            if not flight[1] and not flight[0].done():
+                self.land(key, flight)
+                flight[0].cancel()
+
+    def land(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self.flights)}
+
+# Lookups in flight, keyed by what they look up (see services.coalesce_lookups)
+lookup_flights = SingleFlight()
+
+@metrics.register_collector
+def flight_metrics() -> list:
+    stats = lookup_flights.stats()
+    lookups = stats["calls"] + stats["coalesced"]
+    lines = metrics.render_samples("omnistream_lookup_fetches_total", "counter", "Lookups that ran their own fetch.", [({}, stats["calls"])])
+    lines += metrics.render_samples("omnistream_lookup_coalesced_total", "counter", "Lookups that shared the fetch of an identical one in flight.", [({}, stats["coalesced"])])
+    lines += metrics.render_samples("omnistream_lookup_in_flight", "gauge", "Distinct lookups currently in flight.", [({}, stats["in_flight"])])
+    lines += metrics.render_samples("omnistream_lookup_collapse_ratio", "gauge", "Coalesced over lookups since start.", [({}, stats["coalesced"] / lookups if lookups else 0)])
+    return lines
+
+def queue_media_invalidation(pipe, *unique_ids) -> int:
+    """
+    Drops unique_ids from this worker's cache and queues a publish onto pipe so the other workers drop them too,
+    one invalidation and one message however many there are. Gives back how many commands were queued.
+    Queue it after the writes, the other workers (and this one) invalidate again once it comes around
+    so nothing read between now and the writes landing stays cached.
+    """
+    unique_ids = [unique_id for unique_id in unique_ids if unique_id]
+    if not unique_ids:
+        return 0
+    media_cache.invalidate(*unique_ids)
+    pipe.publish(MEDIA_CACHE_CHANNEL, " ".join(unique_ids))
+    return 1
+
+async def listen_for_invalidations():
+    """
+    Background task that applies invalidations published by other workers.
+    Writes publish on the shard they went to, so every shard gets its own subscription.
+    """
+    await asyncio.gather(*[listen_on_shard(redis_client) for redis_client in get_shards()])
+
+async def listen_on_shard(redis_client):
+    """
+    Anything could have been missed while disconnected so the whole cache is dropped on every (re)subscribe.
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(MEDIA_CACHE_CHANNEL)
+            media_cache.clear()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                media_cache.invalidate(*message["data"].decode("utf-8").split(" "))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Cache invalidation listener error: {e}")
+            media_cache.clear()
+            await asyncio.sleep(2)
+        finally:
+            await pubsub.aclose()
@@ -1,12 +1,305 @@
 import redis.asyncio as redis
+import asyncio
+import hashlib
+import itertools
 import os
+import time
+from bisect import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from redis.asyncio.client import Pipeline
+
+from app.core import metrics
 
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+# Comma separated host:port list to spread media over several nodes, REDIS_HOST/REDIS_PORT is the only shard if not set.
+# Shards are placed on the ring by their address, so adding one only moves about 1/N of the media.
+REDIS_SHARDS = [address.strip() for address in os.getenv("REDIS_SHARDS", "").split(",") if address.strip()]
+RING_VNODES = int(os.getenv("RING_VNODES", 160))
+# Read replicas, a comma separated host:port list per shard with shards separated by ";" in REDIS_SHARDS order.
+# Lookups go to a healthy replica, writes and deletes always go to the shard's primary.
+REDIS_REPLICAS = [
+    [address.strip() for address in shard.split(",") if address.strip()]
+    for shard in os.getenv("REDIS_REPLICAS", "").split(";")
+]
+REPLICA_STRATEGY = os.getenv("REPLICA_STRATEGY", "round_robin").lower() # "round_robin" or "least_loaded"
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))
+REPLICA_CHECK_TIMEOUT = float(os.getenv("REPLICA_CHECK_TIMEOUT", 1))
+
+class CountingConnectionPool(redis.ConnectionPool):
+    """
+    Connection pool that keeps count of the connections currently running a command, what least_loaded goes by.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.busy = 0
+
+    async def get_connection(self, *args, **kwargs):
+        connection = await super().get_connection(*args, **kwargs)
+        self.busy += 1
+        return connection
+
+    async def release(self, connection):
+        self.busy -= 1
+        await super().release(connection)
+
+class InstrumentedPipeline(Pipeline):
+    """
+    Pipeline timed as one round trip, PIPELINE or MULTI for a transaction.
+    """
+
+    async def execute(self, raise_on_error: bool = True):
+        if not metrics.METRICS_ENABLED or not self.command_stack:
+            return await super().execute(raise_on_error)
+        command = "MULTI" if self.is_transaction else "PIPELINE"
+        start = time.perf_counter()
+        try:
+            result = await super().execute(raise_on_error)
+        except Exception:
+            metrics.observe_redis(command, time.perf_counter() - start, failed=True)
+            raise
+        metrics.observe_redis(command, time.perf_counter() - start)
+        return result
+
+class InstrumentedRedis(redis.Redis):
+    """
+    Client that times every command into omnistream_redis_command_seconds by its name.
+    """
+
+    async def execute_command(self, *args, **options):
+        if not metrics.METRICS_ENABLED:
+            return await super().execute_command(*args, **options)
+        start = time.perf_counter()
+        try:
+            result = await super().execute_command(*args, **options)
+        except Exception:
+            metrics.observe_redis(args[0], time.perf_counter() - start, failed=True)
+            raise
+        metrics.observe_redis(args[0], time.perf_counter() - start)
+        return result
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+def create_client(host: str, port: int) -> redis.Redis:
+    return InstrumentedRedis(connection_pool=CountingConnectionPool(
+        host=host,
+        port=port,
+        db=0,
+        decode_responses=False
+    ))
+
+def parse_address(address: str) -> tuple:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+def get_address(client: redis.Redis) -> str:
+    connection_kwargs = client.connection_pool.connection_kwargs
+    return f"{connection_kwargs.get('host')}:{connection_kwargs.get('port')}"
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HashRing:
+    """
+    Consistent hash ring, maps a key to the index of a node.
+    Every node gets RING_VNODES points on the ring so keys spread evenly.
+    """
+
+    def __init__(self, names: list, vnodes: int = RING_VNODES):
+        points = sorted((hash_key(f"{name}#{vnode}"), node) for node, name in enumerate(names) for vnode in range(vnodes))
+        self.size = len(names)
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def get_node(self, key: str) -> int:
+        if self.size == 1:
+            return 0
+        return self.nodes[bisect(self.hashes, hash_key(key)) % len(self.hashes)]
+
+shard_clients = []
+shard_ring = None
+shard_replicas = [] # Replica clients of each shard
+replica_turns = [] # Round robin counter of each shard
+down_replicas = set() # Replicas that failed their last health check or a read
+redis_client = None # First shard, for anything that isn't media (health checks and such)
+
+# Set for the rest of a request/task to keep its reads on the primaries (read-your-writes)
+read_primary = ContextVar("read_primary", default=False)
+
+def set_shards(clients: list, names: list = None, replicas: list = None):
+    """
+    Swaps the shard clients, names are what place them on the ring (defaults to their position).
+    replicas is a list of replica clients for each shard, in the same order.
+    Lets tests and benchmarks run on several local servers or in-process fakes.
+    """
+    global shard_clients, shard_ring, shard_replicas, replica_turns, redis_client
+    shard_clients = list(clients)
+    shard_ring = HashRing(names or [str(i) for i in range(len(clients))])
+    shard_replicas = [list(shard) for shard in (replicas or [])[:len(shard_clients)]]
+    shard_replicas += [[] for _ in range(len(shard_clients) - len(shard_replicas))]
+    replica_turns = [itertools.count() for _ in shard_clients]
+    down_replicas.clear()
+    redis_client = shard_clients[0]
+
+def get_shards() -> list:
+    return shard_clients
+
+def get_shard_index(unique_id) -> int:
+    """
+    The shard a unique_id lives on, its mediafile and its thash/imdb index entries all go there.
+    """
+    if type(unique_id) == bytes:
+        unique_id = unique_id.decode("utf-8")
+    return shard_ring.get_node(unique_id)
+
+def get_shard(unique_id) -> redis.Redis:
+    return shard_clients[get_shard_index(unique_id)]
+
+def has_replicas() -> bool:
+    return any(shard_replicas)
+
+def get_replicas() -> list:
+    return [replica for replicas in shard_replicas for replica in replicas]
+
+def get_read_client(shard: int) -> redis.Redis:
+    """
+    Client to read from a shard with, one of its healthy replicas picked by REPLICA_STRATEGY.
+    Falls back to the primary when there are none or the current request has to read its own writes.
+    """
+    if read_primary.get():
+        return shard_clients[shard]
+    replicas = [replica for replica in shard_replicas[shard] if replica not in down_replicas]
+    if not replicas:
+        return shard_clients[shard]
+    if len(replicas) == 1:
+        return replicas[0]
+    if REPLICA_STRATEGY == "least_loaded":
+        return min(replicas, key=lambda replica: getattr(replica.connection_pool, "busy", 0))
+    return replicas[next(replica_turns[shard]) % len(replicas)]
+
+def get_read_node(shard: int) -> int:
+    """
+    Same pick as get_read_client but as a node number of the shard, 0 is the primary and n its nth replica.
+    """
+    client = get_read_client(shard)
+    if client is shard_clients[shard]:
+        return 0
+    return shard_replicas[shard].index(client) + 1
+
+def get_node_client(shard: int, node: int) -> redis.Redis | None:
+    """
+    Client of a node from get_read_node, None if that replica is down or not configured anymore.
+    For reads that have to stay on one node, like an SSCAN whose cursor only means something where it came from.
+    """
+    if node == 0:
+        return shard_clients[shard]
+    if node > len(shard_replicas[shard]):
+        return None
+    replica = shard_replicas[shard][node - 1]
+    return None if replica in down_replicas else replica
+
+def mark_replica_down(client: redis.Redis, error: Exception):
+    print(f"Replica read failed, using the primary: {error}")
+    down_replicas.add(client)
+
+async def run_read(shard: int, func):
+    """
+    Awaits func(client) with a read client of the shard.
+    A replica that can't be reached is marked down and the read is retried on the primary.
+    """
+    client = get_read_client(shard)
+    if client is shard_clients[shard]:
+        return await func(client)
+    try:
+        return await func(client)
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        mark_replica_down(client, e)
+        return await func(shard_clients[shard])
+
+@contextmanager
+def primary_reads():
+    """
+    Reads inside the block go to the primaries, for code that has to see what was just written.
+    """
+    token = read_primary.set(True)
+    try:
+        yield
+    finally:
+        read_primary.reset(token)
+
+async def check_replica(replica: redis.Redis) -> bool:
+    """
+    Up when it answers within REPLICA_CHECK_TIMEOUT and its link to the primary isn't down.
+    """
+    try:
+        await asyncio.wait_for(replica.ping(), REPLICA_CHECK_TIMEOUT)
+        info = await asyncio.wait_for(replica.info("replication"), REPLICA_CHECK_TIMEOUT)
+    except redis.ResponseError:
+        return True # Answers but doesn't do INFO replication, nothing more to check
+    except Exception:
+        return False
+    return info.get("master_link_status", "up") == "up"
+
+async def check_replicas():
+    """
+    Background task that health checks every replica each REPLICA_CHECK_INTERVAL seconds,
+    down replicas stop getting reads until they pass again.
+    """
+    while True:
+        replicas = get_replicas()
+        results = await asyncio.gather(*[check_replica(replica) for replica in replicas])
+        for replica, healthy in zip(replicas, results):
+            if healthy and replica in down_replicas:
+                print(f"Replica {get_address(replica)} is back up")
+                down_replicas.discard(replica)
+            elif not healthy and replica not in down_replicas:
+                print(f"Replica {get_address(replica)} is down, reading from the primary")
+                down_replicas.add(replica)
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+
+def group_by_shard(unique_ids) -> dict:
+    """
+    {shard index: [unique ids on it]}, keeps the order within each shard.
+    """
+    groups = {}
+    for unique_id in unique_ids:
+        groups.setdefault(get_shard_index(unique_id), []).append(unique_id)
+    return groups
+
+@metrics.register_collector
+def pool_metrics() -> list:
+    """
+    Connection pool stats of every shard primary and replica.
+    """
+    clients = [(str(shard), "primary", client) for shard, client in enumerate(shard_clients)]
+    clients += [(str(shard), "replica", replica) for shard, replicas in enumerate(shard_replicas) for replica in replicas]
+    in_use, idle, limits = [], [], []
+    for shard, role, client in clients:
+        labels = {"shard": shard, "role": role, "address": get_address(client)}
+        pool = client.connection_pool
+        in_use.append((labels, len(getattr(pool, "_in_use_connections", ()))))
+        idle.append((labels, len(getattr(pool, "_available_connections", ()))))
+        limits.append((labels, getattr(pool, "max_connections", 0)))
+    down = [({"shard": shard, "address": get_address(client)}, int(client in down_replicas)) for shard, role, client in clients if role == "replica"]
+    return (
+        metrics.render_samples("omnistream_redis_pool_in_use_connections", "gauge", "Connections checked out of the pool.", in_use)
+        + metrics.render_samples("omnistream_redis_pool_idle_connections", "gauge", "Open connections waiting in the pool.", idle)
+        + metrics.render_samples("omnistream_redis_pool_max_connections", "gauge", "Connection limit of the pool.", limits)
+        + metrics.render_samples("omnistream_redis_replica_down", "gauge", "1 while a replica is marked down and skipped for reads.", down)
+    )
 
-redis_client = redis.Redis(
-    host=REDIS_HOST, 
-    port=REDIS_PORT, 
-    db=0,
-    decode_responses=False
-)
\ No newline at end of file
+if REDIS_SHARDS:
+    set_shards(
+        [create_client(*parse_address(address)) for address in REDIS_SHARDS],
+        REDIS_SHARDS,
+        [[create_client(*parse_address(address)) for address in shard] for shard in REDIS_REPLICAS]
+    )
+else:
+    set_shards(
+        [create_client(REDIS_HOST, REDIS_PORT)],
+        [f"{REDIS_HOST}:{REDIS_PORT}"],
+        [[create_client(*parse_address(address)) for address in shard] for shard in REDIS_REPLICAS]
+    )
@@ -0,0 +1,139 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.core import metrics, profiler
+
+# "process", "thread" or "auto" (threads when the GIL is off, processes otherwise)
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "auto").lower()
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", os.cpu_count() or 1))
+PARSE_QUEUE_DEPTH = int(os.getenv("PARSE_QUEUE_DEPTH", PARSE_WORKERS * 4))
+PARSE_QUEUE_WAIT = float(os.getenv("PARSE_QUEUE_WAIT", 10))
+PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT", 30))
+PARSE_START_METHOD = os.getenv("PARSE_START_METHOD", "spawn")
+
+parse_executor: Executor | None = None
+parse_slots: asyncio.Semaphore | None = None
+parse_slots_in_use = 0 # Slots of parse_slots taken right now, only touched on the event loop
+
+class ParseQueueFull(Exception):
+    """
+    Every parse slot was taken for longer than PARSE_QUEUE_WAIT.
+    """
+
+class ParseTimeout(Exception):
+    """
+    A parse task took longer than PARSE_TIMEOUT.
+    """
+
+def gil_enabled() -> bool:
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled() if is_gil_enabled else True
+
+def start_parse_executor() -> Executor:
+    """
+    Creates the parsing pool, safe to call more than once.
+    Process workers are spawned fresh so they don't inherit the event loop or redis connections.
+    """
+    global parse_executor, parse_slots
+    if parse_executor is not None:
+        return parse_executor
+
+    kind = PARSE_EXECUTOR
+    if kind == "auto":
+        kind = "process" if gil_enabled() else "thread"
+
+    if kind == "thread":
+        parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+    else:
+        parse_executor = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context(PARSE_START_METHOD)
+        )
+    parse_slots = asyncio.Semaphore(PARSE_QUEUE_DEPTH)
+    print(f"Parse executor: {kind} x{PARSE_WORKERS}, queue depth {PARSE_QUEUE_DEPTH}")
+    return parse_executor
+
+def shutdown_parse_executor():
+    global parse_executor, parse_slots, parse_slots_in_use
+    if parse_executor is not None:
+        parse_executor.shutdown(wait=False, cancel_futures=True)
+    parse_executor = None
+    parse_slots = None
+    parse_slots_in_use = 0
+
+def free_slot(slots: asyncio.Semaphore):
+    """
+    Gives a slot back, slots from before a restart of the executor don't count against the new one.
+    """
+    global parse_slots_in_use
+    if slots is parse_slots:
+        parse_slots_in_use -= 1
+    slots.release()
+
+def release_slot(loop: asyncio.AbstractEventLoop, slots: asyncio.Semaphore):
+    try:
+        loop.call_soon_threadsafe(free_slot, slots)
+    except RuntimeError:
+        pass # Loop is already closed, nothing left to wake up
+
+async def run_parser(func, *args):
+    """
+    Runs func(*args) on the parsing pool without blocking the event loop.
+    func and args have to be picklable when it's a process pool.
+
+    At most PARSE_QUEUE_DEPTH tasks are queued or running at once, callers past that wait up to
+    PARSE_QUEUE_WAIT for a slot and then get ParseQueueFull. A task that runs past PARSE_TIMEOUT
+    raises ParseTimeout, its slot only frees up once the worker is actually done with it.
+    """
+    global parse_slots_in_use
+    start_parse_executor()
+    slots = parse_slots
+    loop = asyncio.get_running_loop()
+
+    with metrics.stage("parse_queue"):
+        try:
+            await asyncio.wait_for(slots.acquire(), PARSE_QUEUE_WAIT)
+        except asyncio.TimeoutError:
+            raise ParseQueueFull(f"Parse queue is full ({PARSE_QUEUE_DEPTH} tasks), try again later.")
+        parse_slots_in_use += 1
+
+    # A request that's being profiled gets the worker sampled too
+    profile = profiler.active_profile.get()
+    if profile is not None:
+        func, args = profiler.profile_call, (func, *args)
+
+    try:
+        if metrics.METRICS_ENABLED:
+            future = parse_executor.submit(metrics.collect_stages, func, *args)
+        else:
+            future = parse_executor.submit(func, *args)
+    except BaseException:
+        free_slot(slots)
+        raise
+    future.add_done_callback(lambda _: release_slot(loop, slots))
+
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future), PARSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        future.cancel()
+        raise ParseTimeout(f"Parsing took longer than {PARSE_TIMEOUT:g}s.")
+
+    if metrics.METRICS_ENABLED:
+        # Stages timed on the worker come back with the result, whatever else the task took was handing it over
+        result, stages, seconds = result
+        for name, stage_seconds in stages:
+            metrics.observe_stage(name, stage_seconds)
+        metrics.observe_stage("executor_overhead", max(0.0, time.perf_counter() - start - seconds))
+    if profile is not None:
+        result, stacks = result
+        profile.add_worker_stacks(stacks)
+    return result
+
+@metrics.register_collector
+def executor_metrics() -> list:
+    return metrics.render_samples("omnistream_parse_slots_in_use", "gauge", "Parse tasks queued or running, out of PARSE_QUEUE_DEPTH.", [({}, parse_slots_in_use)])
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+# Seconds, the upper bound of each histogram bucket (+Inf is added on render)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """
+    Prometheus histogram with one series per combination of label values.
+    Observing is a bisect and two additions, everything else happens on scrape.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {} # label values -> [counts per bucket (not cumulative, last one is +Inf), sum]
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, amount: float = 1, *label_values):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+def render_samples(name: str, kind: str, help: str, samples: list) -> list:
+    """
+    Lines of a gauge/counter read on scrape, samples is a list of ({label: value}, value).
+    """
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+REQUEST_SECONDS = Histogram("omnistream_http_request_seconds", "HTTP requests by route, method and status.", ("route", "method", "status"))
+STAGE_SECONDS = Histogram("omnistream_stage_seconds", "Time spent in each internal stage of a request.", ("stage",))
+REDIS_SECONDS = Histogram("omnistream_redis_command_seconds", "Redis round trips by command, PIPELINE for a whole pipeline.", ("command",))
+REDIS_ERRORS = Counter("omnistream_redis_errors_total", "Redis round trips that raised, by command.", ("command",))
+PARSE_CACHE = Counter("omnistream_parse_cache_total", "MediaInfo reports looked up in the parse cache, by result (hit/miss).", ("result",))
+MEDIA_JSON_LOOKUPS = Counter("omnistream_media_json_total", "Media looked up as pre-rendered JSON, by where it came from (memory/stored/rendered).", ("source",))
+
+metrics = [REQUEST_SECONDS, STAGE_SECONDS, REDIS_SECONDS, REDIS_ERRORS, PARSE_CACHE, MEDIA_JSON_LOOKUPS]
+collectors = [] # Functions giving back lines of metrics that are only worth reading on scrape (cache, pool stats...)
+
+# Stages timed on a parse executor thread or process are handed back with the result instead of recorded there
+stage_collector = threading.local()
+
+def observe_stage(name: str, seconds: float):
+    collected = getattr(stage_collector, "stages", None)
+    if collected is not None:
+        collected.append((name, seconds))
+    else:
+        STAGE_SECONDS.observe(seconds, name)
+
+class stage:
+    """
+    Times the block into omnistream_stage_seconds{stage=name}.
+
+        with stage("decode"):
+            ...
+    """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if METRICS_ENABLED:
+            observe_stage(self.name, time.perf_counter() - self.start)
+
+def collect_stages(func, *args) -> tuple:
+    """
+    Runs func(*args) on a parse executor worker, gives back (result, [(stage, seconds)...], seconds func took)
+    so run_parser can record the stages on the event loop's side.
+    """
+    stage_collector.stages = []
+    start = time.perf_counter()
+    try:
+        return func(*args), stage_collector.stages, time.perf_counter() - start
+    finally:
+        stage_collector.stages = None
+
+def observe_redis(command, seconds: float, failed: bool = False):
+    if not METRICS_ENABLED:
+        return
+    if isinstance(command, bytes):
+        command = command.decode("utf-8", "replace")
+    command = command.upper()
+    REDIS_SECONDS.observe(seconds, command)
+    if failed:
+        REDIS_ERRORS.inc(1, command)
+
+def register_collector(func):
+    collectors.append(func)
+    return func
+
+def render() -> str:
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collector in collectors:
+        try:
+            lines.extend(collector())
+        except Exception as e:
+            print(f"Metrics collector error: {e}")
+    return "\n".join(lines) + "\n"
+
+def route_label(scope) -> str:
+    """
+    Path of the route a request matched with its path params put back as {name}, so ids don't blow up the labels.
+    """
+    if scope.get("route") is None:
+        return "unmatched"
+    path = scope["path"]
+    for name, value in scope.get("path_params", {}).items():
+        path = path.replace(f"/{value}", "/{" + name + "}", 1)
+    return path
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by the route it matched (see route_label).
+    Streamed responses count until their last chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        status = 500
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route_label(scope), scope["method"], status)
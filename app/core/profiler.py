@@ -0,0 +1,262 @@
+import asyncio
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from app.core.metrics import route_label
+
+# Admin secret, a request sent with X-Profile-Token: <it> gets profiled and the /admin/profiles routes open up. Unset turns both off
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0)) # Fraction of requests profiled without being asked to
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005)) # Seconds between stack samples
+PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", 4)) # Sampled profiles running at once, header ones don't count against it
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50)) # Finished profiles kept in memory for /admin/profiles
+PROFILE_DIR = os.getenv("PROFILE_DIR", "") # Also writes every finished profile there as <name>.folded + <name>.json
+PROFILE_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+PROFILE_HEADER = "x-profile-token"
+# Never profiled, so looking at profiles doesn't make more of them
+SKIP_PATHS = ("/admin/", "/metrics", "/docs", "/openapi.json", "/redoc")
+# Stands in for the samples taken while the request was waiting on something (redis, the parse executor, other requests)
+AWAITING = "[awaiting]"
+
+# Profile of the request the current task belongs to, child tasks inherit it
+active_profile = ContextVar("active_profile", default=None)
+profiles = deque(maxlen=PROFILE_KEEP)
+
+def frame_name(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+
+def collapse(frame) -> tuple:
+    """
+    (frames innermost first, "outer;...;inner" stack in the collapsed format).
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames, ";".join(frame_name(frame) for frame in reversed(frames))
+
+class Profile:
+    """
+    Collapsed stacks of one request (the format flamegraph.pl, speedscope and friends read) and what it was.
+    Samples of the event loop only count when the request's own task is the one running, see Sampler.
+    """
+
+    def __init__(self, scope, reason: str, root):
+        self.id = uuid.uuid4().hex[:16]
+        self.reason = reason
+        self.root = root
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.route = "unmatched"
+        self.status = None
+        self.started = time.time()
+        self.seconds = 0.0
+        self.tags = {}
+        self.stacks = Counter()
+        headers = dict(scope.get("headers") or [])
+        for name in (b"x-request-id", b"x-client-id"):
+            if name in headers:
+                self.tags[name.decode("latin-1")] = headers[name].decode("latin-1")
+        if scope.get("client"):
+            self.tags["client"] = scope["client"][0]
+
+    def add_worker_stacks(self, stacks: Counter):
+        for stack, count in stacks.items():
+            self.stacks[f"[parse worker];{stack}"] += count
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "reason": self.reason,
+            "route": self.route,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started": self.started,
+            "seconds": round(self.seconds, 6),
+            "samples": sum(self.stacks.values()),
+            "tags": self.tags,
+        }
+
+    def file_name(self) -> str:
+        route = re.sub(r"[^A-Za-z0-9]+", "_", self.route).strip("_") or "root"
+        return f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.started))}_{self.method}_{route}_{self.id}"
+
+class Sampler:
+    """
+    Thread that samples another thread's stack every PROFILE_INTERVAL while any profile is attached to it.
+    Sampling an event loop, a request's profile only gets the stacks of its own tasks and AWAITING while another
+    task (or nothing) runs. Worker profiles (root None) take every stack.
+    """
+
+    def __init__(self, thread_id: int, loop=None, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.loop = loop
+        self.interval = interval
+        self.profiles = set()
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def attach(self, profile):
+        with self.lock:
+            self.profiles.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def detach(self, profile):
+        with self.lock:
+            self.profiles.discard(profile)
+
+    def run(self):
+        while True:
+            if not self.profiles:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            # Held while recording so nothing lands in a profile after detach()
+            with self.lock:
+                self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        frames, stack = collapse(frame)
+        if frames[0].f_globals is globals():
+            return # Caught attaching/detaching, that's the profiler's own overhead
+        # The running task's context says which request it belongs to (tasks a request spawned included) on 3.12+,
+        # older Pythons only recognize the request's own task by its middleware frame being on the stack
+        task = asyncio.current_task(self.loop) if self.loop is not None else None
+        get_context = getattr(task, "get_context", None)
+        owner = get_context().get(active_profile) if get_context is not None else None
+        for profile in self.profiles:
+            if profile.root is None or owner is profile or (get_context is None and profile.root in frames):
+                profile.stacks[stack] += 1
+            else:
+                profile.stacks[AWAITING] += 1
+
+# Sampler of each parse executor thread, kept around between tasks
+worker_samplers = {}
+
+class WorkerProfile:
+    """
+    What profile_call samples into, every stack of the worker counts.
+    """
+    root = None
+
+    def __init__(self):
+        self.stacks = Counter()
+
+def profile_call(func, *args) -> tuple:
+    """
+    Runs func(*args) on a parse executor worker while sampling it, gives back (result, Counter of stacks)
+    so run_parser can add what the worker did to the request's profile.
+    """
+    sampler = worker_samplers.get(threading.get_ident())
+    if sampler is None:
+        sampler = worker_samplers[threading.get_ident()] = Sampler(threading.get_ident())
+    profile = WorkerProfile()
+    sampler.attach(profile)
+    try:
+        return func(*args), profile.stacks
+    finally:
+        sampler.detach(profile)
+
+def tag(name: str, value):
+    """
+    Adds an identifier (info hash, unique id...) to the profile of the current request if it's being profiled.
+    """
+    profile = active_profile.get()
+    if profile is not None:
+        profile.tags[name] = str(value)
+
+def token_matches(token: str) -> bool:
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode("utf-8"), PROFILE_TOKEN.encode("utf-8"))
+
+def get_profile(profile_id: str):
+    return next((profile for profile in profiles if profile.id == profile_id), None)
+
+def write_profile(profile: Profile):
+    name = os.path.join(PROFILE_DIR, profile.file_name())
+    with open(f"{name}.folded", "w") as f:
+        f.write(profile.collapsed())
+    with open(f"{name}.json", "w") as f:
+        json.dump(profile.summary(), f)
+
+async def store_profile(profile: Profile):
+    profiles.append(profile)
+    if PROFILE_DIR:
+        try:
+            await asyncio.to_thread(write_profile, profile)
+        except OSError as e:
+            print(f"Could not write profile {profile.id}: {e}")
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware profiling the requests sent with a valid X-Profile-Token and PROFILE_SAMPLE_RATE of the rest.
+    A profiled request gets an X-Profile-Id header, its collapsed stacks are at /admin/profiles/<id> once it's done.
+    Only added to the app when PROFILE_ENABLED, so it costs nothing otherwise.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sampler = None
+        self.sampled = 0
+
+    def should_profile(self, scope):
+        if scope["type"] != "http" or scope["path"].startswith(SKIP_PATHS):
+            return None
+        for name, value in scope.get("headers") or []:
+            if name == PROFILE_HEADER.encode("latin-1"):
+                return "requested" if token_matches(value.decode("latin-1")) else None
+        if PROFILE_SAMPLE_RATE and self.sampled < PROFILE_MAX_ACTIVE and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        reason = self.should_profile(scope)
+        if reason is None:
+            return await self.app(scope, receive, send)
+
+        if self.sampler is None:
+            self.sampler = Sampler(threading.get_ident(), asyncio.get_running_loop())
+        profile = Profile(scope, reason, sys._getframe())
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile.id.encode("latin-1"))]
+            await send(message)
+
+        token = active_profile.set(profile)
+        self.sampled += reason == "sampled"
+        self.sampler.attach(profile)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.sampler.detach(profile)
+            self.sampled -= reason == "sampled"
+            active_profile.reset(token)
+            profile.seconds = time.perf_counter() - start
+            profile.route = route_label(scope)
+            profile.root = None
+            await store_profile(profile)
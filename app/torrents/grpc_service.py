@@ -0,0 +1,72 @@
+import grpc
+import os
+from app.core.proto import media_info_pb2_grpc # type: ignore
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummaryList, IngestResponse # type: ignore
+from . import services
+
+GRPC_ENABLED = os.getenv("GRPC_ENABLED", "true").lower() in ("1", "true", "yes")
+GRPC_PORT = int(os.getenv("GRPC_PORT", 50051))
+
+class OmnistreamServicer(media_info_pb2_grpc.OmnistreamServicer):
+    """
+    gRPC version of the /torrents routes, hands out and takes the stored OmnistreamProtoSummary messages as is.
+    """
+
+    async def GetByUniqueId(self, request, context):
+        if not request.unique_id:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "unique_id is required.")
+
+        summaries = await services.get_media_protos_from_uniqueids([request.unique_id])
+        if not summaries:
+            await context.abort(grpc.StatusCode.NOT_FOUND, f"No media with unique_id {request.unique_id}.")
+        return summaries[0]
+
+    async def GetByTorrentHash(self, request, context):
+        if not request.torrent_hash:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "torrent_hash is required.")
+
+        if request.HasField("index"):
+            unique_id = await services.get_unique_id_from_torrent_index(request.torrent_hash, str(request.index))
+            unique_ids = [unique_id] if unique_id else []
+        else:
+            unique_ids = await services.get_unique_ids_from_torrent_hash(request.torrent_hash)
+
+        return OmnistreamProtoSummaryList(summaries=await services.get_media_protos_from_uniqueids(unique_ids))
+
+    async def GetByImdb(self, request, context):
+        if not request.imdb_id:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "imdb_id is required.")
+
+        unique_ids = await services.get_unique_ids_from_imdb(request.imdb_id)
+        return OmnistreamProtoSummaryList(summaries=await services.get_media_protos_from_uniqueids(unique_ids))
+
+    async def StreamByImdb(self, request, context):
+        if not request.imdb_id:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "imdb_id is required.")
+
+        async for summary in services.iter_media_protos_from_imdb(request.imdb_id):
+            yield summary
+
+    async def Ingest(self, request_iterator, context):
+        response = await services.create_media_summaries_from_protos(request_iterator)
+
+        ingest_response = IngestResponse(total=response.total, failed=response.failed)
+        for result in response.data:
+            ingest_response.results.add(
+                success=result.status == "success",
+                unique_id=result.unique_id,
+                error=result.error or "",
+                change=result.change.value if result.change else ""
+            )
+        return ingest_response
+
+async def start_grpc_server(port: int = GRPC_PORT) -> grpc.aio.Server:
+    """
+    Starts the gRPC server on the running event loop, stop it with `await server.stop(grace)`.
+    """
+    server = grpc.aio.server()
+    media_info_pb2_grpc.add_OmnistreamServicer_to_server(OmnistreamServicer(), server)
+    server.add_insecure_port(f"[::]:{port}")
+    await server.start()
+    print(f"gRPC listening on {port}")
+    return server
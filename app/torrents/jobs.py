@@ -0,0 +1,236 @@
+from . import models
+from .services import create_media_summary_from_mediainfo, create_media_summary_from_tracker, create_media_summaries_from_tracker
+from app.core.database import get_shards
+from typing import Optional
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+INGEST_ASYNC = os.getenv("INGEST_ASYNC", "false").lower() in ("1", "true", "yes") # Queue every upload, not only the ones sent with Prefer: respond-async
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2)) # Jobs run at once by each app process, 0 to only queue them (tools/ingest_worker.py runs them elsewhere)
+INGEST_STREAM = os.getenv("INGEST_STREAM", "omnistream:ingest")
+INGEST_GROUP = os.getenv("INGEST_GROUP", "omnistream:ingest-workers")
+INGEST_JOB_TTL = int(os.getenv("INGEST_JOB_TTL", 86400)) # Seconds a job's status is kept after it's queued or done
+INGEST_CLAIM_IDLE = int(os.getenv("INGEST_CLAIM_IDLE", 300)) # Seconds before a job taken by a worker that died is handed to another
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", 3)) # Times a job is tried before it's marked failed
+INGEST_CLAIM_INTERVAL = float(os.getenv("INGEST_CLAIM_INTERVAL", 30)) # Seconds between a worker's checks for abandoned jobs
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", 1024 * 1024)) # Bytes per stored piece of a queued upload's body
+INGEST_MAX_PAYLOAD = int(os.getenv("INGEST_MAX_PAYLOAD", 256 * 1024 * 1024)) # Biggest body that can be queued, bigger ones get a 413
+INGEST_BLOCK = 5000 # Milliseconds a worker waits on the stream at a time
+
+JOB_KINDS = ("mediainfo", "tracker", "tracker_bulk")
+
+# The queue and job statuses aren't media, they live on the first shard like the other non media keys
+def get_queue_client():
+    return get_shards()[0]
+
+def get_job_key(job_id: str) -> str:
+    return f"ingestjob:{job_id}"
+
+def get_payload_key(job_id: str) -> str:
+    return f"ingestjob:{job_id}:payload"
+
+class PayloadTooLarge(Exception):
+    pass
+
+def wants_async(prefer: str) -> bool:
+    """
+    Whether an upload should be queued, Prefer: respond-async asks for it (RFC 7240) and INGEST_ASYNC makes it the default.
+    """
+    return INGEST_ASYNC or "respond-async" in prefer.lower()
+
+def job_response(job_id: str, job: dict) -> models.IngestJobResponse:
+    """
+    IngestJobResponse of a job hash as read from redis (bytes keys and values).
+    """
+    job = {key.decode("utf-8"): value.decode("utf-8") for key, value in job.items()}
+    result = None
+    if job.get("result"):
+        result_model = models.BulkCreateMediaResponse if job["kind"] == "tracker_bulk" else models.CreateMediaResponse
+        result = result_model.model_validate_json(job["result"])
+    return models.IngestJobResponse(
+        status=job["status"],
+        job_id=job_id,
+        kind=job["kind"],
+        total=int(job.get("total", 0)),
+        failed=int(job.get("failed", 0)),
+        created=float(job["created"]) if job.get("created") else None,
+        started=float(job["started"]) if job.get("started") else None,
+        finished=float(job["finished"]) if job.get("finished") else None,
+        result=result,
+        error=job.get("error") or None
+    )
+
+async def enqueue_ingest_job(kind: str, body) -> models.IngestJobResponse:
+    """
+    Queues a raw upload body (an async iterable of bytes, like request.stream()) for the ingest workers,
+    the job's status is written along with it so it can be polled right away.
+    The body is stored INGEST_CHUNK_SIZE at a time in a list next to the job instead of in the stream entry,
+    so it never sits in memory whole and no single redis value gets huge. PayloadTooLarge past INGEST_MAX_PAYLOAD.
+    """
+    job_id = uuid.uuid4().hex
+    job = {"status": models.JobStatus.PENDING.value, "kind": kind, "created": time.time()}
+    redis_client = get_queue_client()
+    payload_key = get_payload_key(job_id)
+
+    chunks = 0
+    size = 0
+    buffer = bytearray()
+
+    async def store(chunk: bytes):
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.rpush(payload_key, chunk)
+        pipe.expire(payload_key, INGEST_JOB_TTL)
+        await pipe.execute()
+
+    try:
+        async for data in body:
+            size += len(data)
+            if size > INGEST_MAX_PAYLOAD:
+                raise PayloadTooLarge(f"Uploads over {INGEST_MAX_PAYLOAD} bytes can't be queued.")
+            buffer += data
+            while len(buffer) >= INGEST_CHUNK_SIZE:
+                await store(bytes(buffer[:INGEST_CHUNK_SIZE]))
+                del buffer[:INGEST_CHUNK_SIZE]
+                chunks += 1
+        if buffer or not chunks:
+            await store(bytes(buffer))
+            chunks += 1
+    except Exception:
+        await redis_client.delete(payload_key)
+        raise
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(get_job_key(job_id), mapping=job)
+    pipe.expire(get_job_key(job_id), INGEST_JOB_TTL)
+    pipe.xadd(INGEST_STREAM, {"job": job_id, "kind": kind, "chunks": chunks})
+    await pipe.execute()
+
+    return models.IngestJobResponse(status=models.JobStatus.PENDING, job_id=job_id, kind=kind, created=job["created"])
+
+async def get_ingest_job(job_id: str) -> Optional[models.IngestJobResponse]:
+    job = await get_queue_client().hgetall(get_job_key(job_id))
+    return job_response(job_id, job) if job else None
+
+async def iter_payload(job_id: str, fields: dict):
+    """
+    The queued body of a job a chunk at a time, entries queued before the body was chunked still have it in their payload field.
+    """
+    if b"payload" in fields:
+        yield fields[b"payload"]
+        return
+    redis_client = get_queue_client()
+    for index in range(int(fields[b"chunks"])):
+        chunk = await redis_client.lindex(get_payload_key(job_id), index)
+        if chunk is None:
+            raise ValueError("The upload's body expired before the job ran.")
+        yield chunk
+
+async def run_ingest_job(job_id: str, kind: str, payload):
+    """
+    Does what the upload would have done in the request, gives back its response.
+    payload is the body from iter_payload, bulk uploads are parsed as it comes in like the http upload.
+    """
+    if kind == "mediainfo":
+        body = b"".join([chunk async for chunk in payload])
+        return await create_media_summary_from_mediainfo(models.MediaInfoExport.model_validate_json(body))
+    if kind == "tracker":
+        body = b"".join([chunk async for chunk in payload])
+        return await create_media_summary_from_tracker(models.Unit3dTorrent.model_validate_json(body))
+
+    async def progress(results):
+        failed = sum(1 for result in results if result.status == models.JobStatus.FAILED)
+        await get_queue_client().hset(get_job_key(job_id), mapping={"total": len(results), "failed": failed})
+
+    return await create_media_summaries_from_tracker(payload, progress)
+
+async def process_message(consumer: str, message_id: bytes, fields: dict):
+    """
+    Runs one queued job and records how it went, the status update and the ack go out together.
+    A job that raises is left unacked, it's retried once it has been idle INGEST_CLAIM_IDLE, up to INGEST_MAX_ATTEMPTS times.
+    """
+    redis_client = get_queue_client()
+    job_id = fields[b"job"].decode("utf-8")
+    kind = fields[b"kind"].decode("utf-8")
+    job_key = get_job_key(job_id)
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hincrby(job_key, "attempts", 1)
+    pipe.hset(job_key, mapping={"status": models.JobStatus.PROCESSING.value, "started": time.time(), "worker": consumer})
+    attempts, _ = await pipe.execute()
+
+    update = {"finished": time.time()}
+    if attempts > INGEST_MAX_ATTEMPTS:
+        update.update(status=models.JobStatus.FAILED.value, error=f"Gave up after {INGEST_MAX_ATTEMPTS} attempts.")
+    elif kind not in JOB_KINDS:
+        update.update(status=models.JobStatus.FAILED.value, error=f"Unknown job kind {kind}.")
+    else:
+        try:
+            result = await run_ingest_job(job_id, kind, iter_payload(job_id, fields))
+        except asyncio.CancelledError:
+            raise
+        except ValueError as e: # Payload doesn't validate, retrying won't help
+            result = None
+            update.update(status=models.JobStatus.FAILED.value, error=str(e))
+        except Exception as e:
+            print(f"Ingest job {job_id} failed (attempt {attempts}): {e}")
+            await redis_client.hset(job_key, mapping={"status": models.JobStatus.PENDING.value, "error": str(e)})
+            return
+        if result is not None:
+            update.update(status=result.status.value, result=result.model_dump_json(), finished=time.time())
+            if kind == "tracker_bulk":
+                update.update(total=result.total, failed=result.failed, error="")
+            else:
+                update.update(total=1, failed=int(result.status == models.JobStatus.FAILED), error=result.error or "")
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(job_key, mapping=update)
+    pipe.expire(job_key, INGEST_JOB_TTL)
+    pipe.xack(INGEST_STREAM, INGEST_GROUP, message_id)
+    pipe.xdel(INGEST_STREAM, message_id)
+    pipe.delete(get_payload_key(job_id))
+    await pipe.execute()
+
+async def create_ingest_group():
+    try:
+        await get_queue_client().xgroup_create(INGEST_STREAM, INGEST_GROUP, id="0", mkstream=True)
+    except Exception as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def ingest_worker(consumer: str):
+    """
+    Takes jobs off the stream one at a time. Every INGEST_CLAIM_INTERVAL it first claims a job left unacked
+    by a worker that died, and keeps at it while there are more, so they get picked up even when the stream is busy.
+    """
+    redis_client = get_queue_client()
+    next_claim = 0
+    while True:
+        try:
+            messages = []
+            if time.monotonic() >= next_claim:
+                _, messages, *_ = await redis_client.xautoclaim(INGEST_STREAM, INGEST_GROUP, consumer, INGEST_CLAIM_IDLE * 1000, count=1)
+                next_claim = 0 if messages else time.monotonic() + INGEST_CLAIM_INTERVAL
+            if not messages:
+                reply = await redis_client.xreadgroup(INGEST_GROUP, consumer, {INGEST_STREAM: ">"}, count=1, block=INGEST_BLOCK)
+                messages = reply[0][1] if reply else []
+            for message_id, fields in messages:
+                if fields:
+                    await process_message(consumer, message_id, fields)
+                else: # Deleted from the stream while it was pending
+                    await redis_client.xack(INGEST_STREAM, INGEST_GROUP, message_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ingest worker {consumer} error: {e}")
+            await asyncio.sleep(2)
+
+async def run_ingest_workers(count: int = INGEST_WORKERS):
+    """
+    Background task running count ingest workers, each one a consumer of the group named after the host and process.
+    """
+    await create_ingest_group()
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    await asyncio.gather(*[ingest_worker(f"{name}-{i}") for i in range(count)])
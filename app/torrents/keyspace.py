@@ -0,0 +1,554 @@
+from app.core.database import get_shards, hash_key
+from . import utils
+from typing import List
+import asyncio
+import os
+
+KEYSPACE_BUCKETS = int(os.getenv("KEYSPACE_BUCKETS", 65536)) # Hashes per record type of a buckets layout that wasn't sized yet (tools.migrate_keyspace size)
+KEYSPACE_BUCKETS_KEY = "keyspace:buckets" # Bucket count the buckets layout was filled with, on every shard since it can't change afterwards
+KEYSPACE_BUCKET_ENTRIES = 128 # Entries a bucket has to stay under for the small hash encoding (redis' default hash-max-listpack-entries)
+# hash-max-listpack-value the buckets layout needs, 0 skips the check. Media blobs and refs are a few hundred bytes, with redis' default
+# of 64 their buckets fall back to the plain hashtable encoding and take more memory than the keys layout.
+# It's server config: set it there (or with tools.migrate_keyspace size), the app only warns at startup when it's lower
+KEYSPACE_LISTPACK_VALUE = int(os.getenv("KEYSPACE_LISTPACK_VALUE", 1024))
+
+def buckets_for(records: int) -> int:
+    """
+    Bucket count for a shard of about records media: records / 64 (half of KEYSPACE_BUCKET_ENTRIES, room to grow)
+    rounded up to a power of two, at least 1024.
+    """
+    return max(1024, 1 << max(0, -(-records // 64) - 1).bit_length())
+
+def encode_id(value: str) -> bytes:
+    """
+    Binary form of a unique id or torrent hash. Lowercase even length hex (nearly all of them) becomes 0x00 + the raw bytes,
+    anything else stays utf-8 text, which never starts with 0x00.
+    """
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        raw = None
+    if raw is not None and raw.hex() == value:
+        return b"\x00" + raw
+    return value.encode("utf-8")
+
+def decode_id(value: bytes) -> str:
+    """
+    Reverse of encode_id, plain utf-8 ids (the keys layout) come back as they are.
+    """
+    if value[:1] == b"\x00":
+        return value[1:].hex()
+    return value.decode("utf-8")
+
+def get_unique_id(unique_id) -> str:
+    if type(unique_id) == bytes:
+        unique_id = decode_id(unique_id)
+    return unique_id
+
+def get_unique_key(unique_id):
+    return f"mediafile:{get_unique_id(unique_id)}"
+
+def get_media_ref_key(unique_id):
+    return f"mediaref:{get_unique_id(unique_id)}"
+
+def get_imdb_key(imdb_id: str):
+    return f"imdb:{imdb_id}"
+
+def get_torrent_hash_key(hash_id: str): #, index: int = None
+    return f"thash:{hash_id}" #{':'+str(index) if index else ''}
+
+def get_search_index_key(attribute: str, value: str):
+    return f"idx:{attribute}:{utils.normalize_index_value(value)}"
+
+def get_media_json_key(unique_id, version: str):
+    return f"mediajson:{version}:{get_unique_id(unique_id)}"
+
+def get_search_index_values(summary_proto) -> list:
+    """
+    (attribute, value) of every search index set a summary belongs in, sorted so the same summary always gives the same list.
+    """
+    return sorted(
+        (attribute, value)
+        for attribute, values in utils.media_index_values(summary_proto).items()
+        for value in values
+    )
+
+def pack_ref(*parts: bytes) -> bytes:
+    """
+    Length prefixed ("<len>:<bytes>" each) so binary parts can't be confused, unpacked by unpack_ref in the lua scripts.
+    """
+    return b"".join(b"%d:%s" % (len(part), part) for part in parts)
+
+# Writes one media summary and its index entries in a single round trip, atomically.
+# mediaref:<unique_id> remembers which thash/index/imdb entries and idx: search sets (KEYS[5] on) point at the media
+# so they get cleaned up when it moves, nothing is written when the blob and the entries are already the same.
+# The old entries aren't known up front so Dragonfly needs allow-undeclared-keys (it's only a comment to redis).
+WRITE_MEDIA_LUA = """--!df flags=allow-undeclared-keys
+local media_key, ref_key, thash_key, imdb_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local data, unique_id, index = ARGV[1], ARGV[2], ARGV[3]
+local tags = table.concat(KEYS, '\\n', 5)
+
+local current = redis.call('GET', media_key)
+local ref = redis.call('HMGET', ref_key, 'thash', 'index', 'imdb', 'tags')
+local old_thash, old_index, old_imdb, old_tags = ref[1], ref[2], ref[3], ref[4]
+
+if current == data and old_thash == thash_key and old_index == index and old_imdb == imdb_key and old_tags == tags
+        and redis.call('HGET', thash_key, index) == unique_id then
+    return 'unchanged'
+end
+
+if old_thash and (old_thash ~= thash_key or old_index ~= index) and redis.call('HGET', old_thash, old_index) == unique_id then
+    redis.call('HDEL', old_thash, old_index)
+end
+if old_imdb and old_imdb ~= imdb_key then
+    redis.call('SREM', old_imdb, unique_id)
+end
+if old_tags then
+    local new_tags = {}
+    for i = 5, #KEYS do
+        new_tags[KEYS[i]] = true
+    end
+    for tag in string.gmatch(old_tags, '[^\\n]+') do
+        if not new_tags[tag] then
+            redis.call('SREM', tag, unique_id)
+        end
+    end
+end
+
+redis.call('SET', media_key, data)
+redis.call('HSET', thash_key, index, unique_id)
+redis.call('SADD', imdb_key, unique_id)
+for i = 5, #KEYS do
+    redis.call('SADD', KEYS[i], unique_id)
+end
+redis.call('HSET', ref_key, 'thash', thash_key, 'index', index, 'imdb', imdb_key, 'tags', tags)
+
+if current then
+    return 'updated'
+end
+return 'created'
+"""
+
+# Drops a media and every index entry its mediaref points at.
+# Media written before there were refs fall back to the thash/index/imdb entries they're passed.
+REMOVE_MEDIA_LUA = """--!df flags=allow-undeclared-keys
+local media_key, ref_key, thash_key, imdb_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local unique_id, index = ARGV[1], ARGV[2]
+
+local ref = redis.call('HMGET', ref_key, 'thash', 'index', 'imdb', 'tags')
+local old_thash, old_index, old_imdb = ref[1] or thash_key, ref[2] or index, ref[3] or imdb_key
+
+if redis.call('HGET', old_thash, old_index) == unique_id then
+    redis.call('HDEL', old_thash, old_index)
+end
+redis.call('SREM', old_imdb, unique_id)
+if ref[4] then
+    for tag in string.gmatch(ref[4], '[^\\n]+') do
+        redis.call('SREM', tag, unique_id)
+    end
+end
+
+return redis.call('DEL', media_key, ref_key)
+"""
+
+UNPACK_REF_LUA = """
+local function unpack_ref(packed)
+    local parts, pos = {}, 1
+    while pos <= #packed do
+        local colon = string.find(packed, ':', pos, true)
+        local size = tonumber(string.sub(packed, pos, colon - 1))
+        parts[#parts + 1] = string.sub(packed, colon + 1, colon + size)
+        pos = colon + size + 1
+    end
+    return parts
+end
+"""
+
+# Same as WRITE_MEDIA_LUA for the buckets layout, every entry is a field/member named by the binary unique id.
+# The ref is pack_ref(torrent bucket, torrent field, imdb key, search keys...), compared whole to spot unchanged writes.
+WRITE_BUCKETED_MEDIA_LUA = """--!df flags=allow-undeclared-keys
+local media_key, ref_key, torrent_key, imdb_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local data, member, torrent_field, ref = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+""" + UNPACK_REF_LUA + """
+local current = redis.call('HGET', media_key, member)
+local old_ref = redis.call('HGET', ref_key, member)
+
+if current == data and old_ref == ref and redis.call('HGET', torrent_key, torrent_field) == member then
+    return 'unchanged'
+end
+
+if old_ref then
+    local old = unpack_ref(old_ref)
+    if (old[1] ~= torrent_key or old[2] ~= torrent_field) and redis.call('HGET', old[1], old[2]) == member then
+        redis.call('HDEL', old[1], old[2])
+    end
+    if old[3] ~= imdb_key then
+        redis.call('SREM', old[3], member)
+    end
+    local new_tags = {}
+    for i = 5, #KEYS do
+        new_tags[KEYS[i]] = true
+    end
+    for i = 4, #old do
+        if not new_tags[old[i]] then
+            redis.call('SREM', old[i], member)
+        end
+    end
+end
+
+redis.call('HSET', media_key, member, data)
+redis.call('HSET', torrent_key, torrent_field, member)
+redis.call('SADD', imdb_key, member)
+for i = 5, #KEYS do
+    redis.call('SADD', KEYS[i], member)
+end
+redis.call('HSET', ref_key, member, ref)
+
+if current then
+    return 'updated'
+end
+return 'created'
+"""
+
+REMOVE_BUCKETED_MEDIA_LUA = """--!df flags=allow-undeclared-keys
+local media_key, ref_key, torrent_key, imdb_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local member, torrent_field = ARGV[1], ARGV[2]
+""" + UNPACK_REF_LUA + """
+local ref = redis.call('HGET', ref_key, member)
+local old = ref and unpack_ref(ref) or {torrent_key, torrent_field, imdb_key}
+
+if redis.call('HGET', old[1], old[2]) == member then
+    redis.call('HDEL', old[1], old[2])
+end
+for i = 3, #old do
+    redis.call('SREM', old[i], member)
+end
+
+redis.call('HDEL', ref_key, member)
+return redis.call('HDEL', media_key, member)
+"""
+
+# Torrent file entries live on their media's shard, so when a file gets a media that's on another shard the old entry
+# would stay behind on the first one. Runs on every other shard after a write, drops the file's entry there unless it's the media's.
+RELEASE_TORRENT_FILE_LUA = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current and current ~= ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# {index: unique id} of one torrent out of its bucket, HGETALL shaped
+TORRENT_FILES_LUA = """
+local prefix = ARGV[1]
+local files = {}
+local entries = redis.call('HGETALL', KEYS[1])
+for i = 1, #entries, 2 do
+    if string.sub(entries[i], 1, #prefix) == prefix then
+        files[#files + 1] = string.sub(entries[i], #prefix + 1)
+        files[#files + 1] = entries[i + 1]
+    end
+end
+return files
+"""
+
+# Stores the pre-rendered JSON of a media only while the media is still the blob it was rendered from,
+# so a read racing a write (or two writes racing each other) can't leave the JSON of what was just overwritten behind.
+# ARGV[2] is the media's field in a buckets layout hash, empty for the keys layout.
+STORE_MEDIA_JSON_LUA = """
+local current
+if ARGV[2] == '' then
+    current = redis.call('GET', KEYS[1])
+else
+    current = redis.call('HGET', KEYS[1], ARGV[2])
+end
+if current ~= ARGV[1] then
+    return 0
+end
+if ARGV[4] == '0' then
+    redis.call('SET', KEYS[2], ARGV[3])
+else
+    redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[4])
+end
+return 1
+"""
+
+# Scripts are always called with client= set to the media's shard (or a pipeline on it)
+write_media_script = get_shards()[0].register_script(WRITE_MEDIA_LUA)
+remove_media_script = get_shards()[0].register_script(REMOVE_MEDIA_LUA)
+write_bucketed_media_script = get_shards()[0].register_script(WRITE_BUCKETED_MEDIA_LUA)
+remove_bucketed_media_script = get_shards()[0].register_script(REMOVE_BUCKETED_MEDIA_LUA)
+torrent_files_script = get_shards()[0].register_script(TORRENT_FILES_LUA)
+release_torrent_file_script = get_shards()[0].register_script(RELEASE_TORRENT_FILE_LUA)
+store_media_json_script = get_shards()[0].register_script(STORE_MEDIA_JSON_LUA)
+
+async def queue_media_json_store(pipe, layout, unique_id: str, blob: bytes, json_key: str, media_json: bytes, ttl: int):
+    """
+    Queues STORE_MEDIA_JSON_LUA for a media stored in layout, blob is the stored (packed) blob the JSON was rendered from.
+    """
+    media_key, member = layout.media_location(unique_id)
+    return await store_media_json_script(keys=[media_key, json_key], args=[blob, member or b"", media_json, ttl], client=pipe)
+
+class KeysLayout:
+    """
+    Every record is its own key: mediafile:<id> blob, mediaref:<id> hash, thash:<hash> {index: id},
+    imdb:<imdb> and idx:<attribute>:<value> sets of ids. Ids are stored as text.
+    """
+    name = "keys"
+    media_match = "mediafile:*"
+
+    def media_location(self, unique_id: str) -> tuple:
+        return get_unique_key(unique_id), None
+
+    def imdb_key(self, imdb_id: str) -> str:
+        return get_imdb_key(imdb_id)
+
+    def search_key(self, attribute: str, value: str) -> str:
+        return get_search_index_key(attribute, value)
+
+    def member(self, unique_id: str):
+        return unique_id
+
+    async def read_media(self, client, unique_ids: List) -> list:
+        return await client.mget([get_unique_key(unique_id) for unique_id in unique_ids])
+
+    async def queue_torrent_read(self, pipe, thash: str, index: str = None):
+        if index is None:
+            pipe.hgetall(get_torrent_hash_key(thash))
+        else:
+            pipe.hget(get_torrent_hash_key(thash), index)
+
+    def torrent_reply(self, reply, index: str = None):
+        """
+        {index: unique id} of a whole torrent read, the unique id (or None) of a single file read.
+        """
+        if index is None:
+            return {get_unique_id(file_index): get_unique_id(unique_id) for file_index, unique_id in reply.items()}
+        return get_unique_id(reply) if reply else None
+
+    async def read_torrent(self, client, thash: str, index: str = None):
+        if index is None:
+            return self.torrent_reply(await client.hgetall(get_torrent_hash_key(thash)))
+        return self.torrent_reply(await client.hget(get_torrent_hash_key(thash), index), index)
+
+    async def queue_write(self, pipe, summary_proto, blob: bytes):
+        unique_id = summary_proto.unique_id
+        keys = [
+            get_unique_key(unique_id),
+            get_media_ref_key(unique_id),
+            get_torrent_hash_key(summary_proto.torrent_hash),
+            get_imdb_key(summary_proto.imdb_id), # might not be able to do always
+            *[self.search_key(attribute, value) for attribute, value in get_search_index_values(summary_proto)]
+        ]
+        args = [blob, unique_id, str(summary_proto.torrent_file_index)]
+        return await write_media_script(keys=keys, args=args, client=pipe)
+
+    async def queue_torrent_release(self, pipe, thash: str, index: int, unique_id: str):
+        return await release_torrent_file_script(keys=[get_torrent_hash_key(thash)], args=[str(index), unique_id], client=pipe)
+
+    async def queue_removal(self, pipe, unique_id: str, thash: str, index: int, imdb_id: str):
+        keys = [get_unique_key(unique_id), get_media_ref_key(unique_id), get_torrent_hash_key(thash), get_imdb_key(imdb_id)]
+        return await remove_media_script(keys=keys, args=[unique_id, str(index)], client=pipe)
+
+    def queue_torrent_removal(self, pipe, thash: str):
+        pipe.delete(get_torrent_hash_key(thash))
+
+    async def prepare(self, clients: list):
+        pass
+
+    async def count_media(self, client) -> int:
+        count = 0
+        async for _ in client.scan_iter(match=self.media_match, count=1000):
+            count += 1
+        return count
+
+    async def scan_media(self, client, batch_size: int):
+        """
+        Every media stored on the shard as lists of (unique id, blob), about batch_size at a time.
+        """
+        unique_ids = []
+        async for key in client.scan_iter(match=self.media_match, count=batch_size):
+            unique_ids.append(get_unique_id(key)[len("mediafile:"):])
+            if len(unique_ids) >= batch_size:
+                yield list(zip(unique_ids, await self.read_media(client, unique_ids)))
+                unique_ids = []
+        if unique_ids:
+            yield list(zip(unique_ids, await self.read_media(client, unique_ids)))
+
+class BucketsLayout:
+    """
+    Records are grouped into hashes by a hash of their id so the server's small hash encoding applies,
+    ids are stored binary (encode_id): m:<bucket> {id: blob}, r:<bucket> {id: ref}, t:<bucket of the torrent hash>
+    {torrent hash + index: id}, i:<imdb> and x:<attribute>:<value> sets of ids.
+    """
+    name = "buckets"
+    media_match = "m:*"
+
+    def __init__(self, buckets: int = KEYSPACE_BUCKETS):
+        self.buckets = buckets # Until prepare reads the count the shards were filled with
+
+    def bucket(self, value: str) -> str:
+        return format(hash_key(value) % self.buckets, "x")
+
+    def media_location(self, unique_id: str) -> tuple:
+        return f"m:{self.bucket(unique_id)}", encode_id(unique_id)
+
+    def ref_key(self, unique_id: str) -> str:
+        return f"r:{self.bucket(unique_id)}"
+
+    def torrent_location(self, thash: str, index=None) -> tuple:
+        """
+        (bucket key, field) of a torrent file, the field is just the prefix every file of the torrent shares when index is None.
+        The hash is length prefixed so one torrent's prefix can't match another's files.
+        """
+        prefix = pack_ref(encode_id(thash))
+        return f"t:{self.bucket(thash)}", prefix if index is None else prefix + str(index).encode("ascii")
+
+    def imdb_key(self, imdb_id: str) -> str:
+        return f"i:{imdb_id}"
+
+    def search_key(self, attribute: str, value: str) -> str:
+        return f"x:{attribute}:{utils.normalize_index_value(value)}"
+
+    def member(self, unique_id: str):
+        return encode_id(unique_id)
+
+    async def read_media(self, client, unique_ids: List) -> list:
+        """
+        One HMGET per bucket, all in one pipeline.
+        """
+        buckets = {}
+        for position, unique_id in enumerate(unique_ids):
+            key, field = self.media_location(unique_id)
+            positions, fields = buckets.setdefault(key, ([], []))
+            positions.append(position)
+            fields.append(field)
+
+        pipe = client.pipeline(transaction=False)
+        for key, (_, fields) in buckets.items():
+            pipe.hmget(key, fields)
+
+        blobs = [None] * len(unique_ids)
+        for (positions, _), reply in zip(buckets.values(), await pipe.execute()):
+            for position, blob in zip(positions, reply):
+                blobs[position] = blob
+        return blobs
+
+    async def queue_torrent_read(self, pipe, thash: str, index: str = None):
+        key, field = self.torrent_location(thash, index)
+        if index is None:
+            await torrent_files_script(keys=[key], args=[field], client=pipe)
+        else:
+            pipe.hget(key, field)
+
+    def torrent_reply(self, reply, index: str = None):
+        if index is None:
+            return {get_unique_id(reply[i]): get_unique_id(reply[i + 1]) for i in range(0, len(reply), 2)}
+        return get_unique_id(reply) if reply else None
+
+    async def read_torrent(self, client, thash: str, index: str = None):
+        key, field = self.torrent_location(thash, index)
+        if index is None:
+            return self.torrent_reply(await torrent_files_script(keys=[key], args=[field], client=client))
+        return self.torrent_reply(await client.hget(key, field), index)
+
+    async def queue_write(self, pipe, summary_proto, blob: bytes):
+        unique_id = summary_proto.unique_id
+        media_key, member = self.media_location(unique_id)
+        torrent_key, torrent_field = self.torrent_location(summary_proto.torrent_hash, summary_proto.torrent_file_index)
+        imdb_key = self.imdb_key(summary_proto.imdb_id)
+        search_keys = [self.search_key(attribute, value) for attribute, value in get_search_index_values(summary_proto)]
+
+        ref = pack_ref(torrent_key.encode("utf-8"), torrent_field, imdb_key.encode("utf-8"), *[key.encode("utf-8") for key in search_keys])
+        keys = [media_key, self.ref_key(unique_id), torrent_key, imdb_key, *search_keys]
+        args = [blob, member, torrent_field, ref]
+        return await write_bucketed_media_script(keys=keys, args=args, client=pipe)
+
+    async def queue_torrent_release(self, pipe, thash: str, index: int, unique_id: str):
+        torrent_key, torrent_field = self.torrent_location(thash, index)
+        return await release_torrent_file_script(keys=[torrent_key], args=[torrent_field, encode_id(unique_id)], client=pipe)
+
+    async def queue_removal(self, pipe, unique_id: str, thash: str, index: int, imdb_id: str):
+        media_key, member = self.media_location(unique_id)
+        torrent_key, torrent_field = self.torrent_location(thash, index)
+        keys = [media_key, self.ref_key(unique_id), torrent_key, self.imdb_key(imdb_id)]
+        return await remove_bucketed_media_script(keys=keys, args=[member, torrent_field], client=pipe)
+
+    def queue_torrent_removal(self, pipe, thash: str):
+        pass # Every file's entry goes with its media
+
+    async def prepare(self, clients: list):
+        """
+        Takes the bucket count the shards were filled with (KEYSPACE_BUCKETS_KEY), shards that have none get ours.
+        Has to run before anything is read or written. Raises if the shards don't agree, every id would land in
+        the wrong bucket on some of them. Then warns about anything that keeps buckets from the small hash
+        encoding, that's fixed on the server or by a migration, not from here.
+        """
+        stored = {int(buckets) for buckets in await asyncio.gather(*[client.get(KEYSPACE_BUCKETS_KEY) for client in clients]) if buckets}
+        if len(stored) > 1:
+            raise RuntimeError(f"Shards were filled with different bucket counts ({', '.join(map(str, sorted(stored)))}), fix {KEYSPACE_BUCKETS_KEY} on them.")
+        if stored and stored != {self.buckets}:
+            buckets, = stored
+            print(f"Using the {buckets} buckets the shards were filled with, not {self.buckets} (KEYSPACE_BUCKETS)")
+            self.buckets = buckets
+        await asyncio.gather(*[client.set(KEYSPACE_BUCKETS_KEY, self.buckets, nx=True) for client in clients])
+        await asyncio.gather(*[self.check(shard, client) for shard, client in enumerate(clients)])
+
+    async def check(self, shard: int, client):
+        """
+        Prints if the shard's hash-max-listpack-value is under KEYSPACE_LISTPACK_VALUE
+        or a sample of its media buckets is already past KEYSPACE_BUCKET_ENTRIES.
+        """
+        if KEYSPACE_LISTPACK_VALUE:
+            try:
+                config = await client.config_get("hash-max-listpack-value")
+                if not config:
+                    print("Server has no hash-max-listpack-value, check media buckets with blobs over 64 bytes still get a small encoding")
+                elif int(next(iter(config.values()))) < KEYSPACE_LISTPACK_VALUE:
+                    print(f"Shard {shard} has hash-max-listpack-value {next(iter(config.values()))}, media buckets need {KEYSPACE_LISTPACK_VALUE} "
+                          "for the small hash encoding, set it in the server config or run python -m tools.migrate_keyspace size")
+            except Exception as e:
+                print(f"Couldn't read hash-max-listpack-value of shard {shard}, check it's at least {KEYSPACE_LISTPACK_VALUE}: {e}")
+
+        pipe = client.pipeline(transaction=False)
+        for bucket in range(0, self.buckets, max(1, self.buckets // 64)):
+            pipe.hlen(f"m:{bucket:x}")
+        largest = max(await pipe.execute())
+        if largest > KEYSPACE_BUCKET_ENTRIES:
+            print(f"Shard {shard} has media buckets of {largest} entries, {self.buckets} buckets are too few and they've lost the small hash encoding. "
+                  "Resize them by migrating to keys and back to buckets, python -m tools.migrate_keyspace size picks the count.")
+
+    async def count_media(self, client) -> int:
+        count = 0
+        async for keys in self.scan_bucket_keys(client, 1000):
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hlen(key)
+            count += sum(await pipe.execute())
+        return count
+
+    async def scan_bucket_keys(self, client, batch_size: int):
+        cursor = None
+        while cursor != 0:
+            cursor, keys = await client.scan(cursor or 0, match=self.media_match, count=batch_size)
+            if keys:
+                yield keys
+
+    async def scan_media(self, client, batch_size: int):
+        """
+        Every media stored on the shard as lists of (unique id, blob), the buckets of a SCAN page at a time.
+        """
+        async for keys in self.scan_bucket_keys(client, batch_size):
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hgetall(key)
+            batch = [(get_unique_id(member), blob) for media in await pipe.execute() for member, blob in media.items()]
+            if batch:
+                yield batch
+
+LAYOUTS = {"keys": KeysLayout, "buckets": BucketsLayout}
+
+def get_layout(name: str):
+    if name not in LAYOUTS:
+        raise ValueError(f"Unknown keyspace layout {name!r}, expected one of {', '.join(LAYOUTS)}.")
+    return LAYOUTS[name]()
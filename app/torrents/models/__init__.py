@@ -2,4 +2,7 @@ from .mediainfoexport import MediaInfoExport, GeneralTrackExport, VideoTrackExpo
 from .OmnistreamMetadata import OmnistreamMetadata
 from .OmnistreamMetadata import OmnistreamVideo, OmnistreamAudio, OmnistreamSubtitle
 from .unit3dtracker import Unit3dTorrent
-from .http import CreateMediaResponse, MediaDataResponse, MediaRequestParams
+from .http import JobStatus, MediaChange, CreateMediaResponse, BulkCreateMediaResponse, MediaDataResponse, MediaRequestParams
+from .http import IngestJobResponse
+from .http import TorrentLookup, BatchMediaRequestParams, BatchMediaResult, BatchMediaDataResponse
+from .http import MediaSearchParams, MediaSearchResponse
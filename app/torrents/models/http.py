@@ -1,14 +1,48 @@
 from typing import Optional, Dict, Any, List
 from enum import Enum
-from pydantic import BaseModel, Field, model_validator, ConfigDict
+import base64
+import binascii
+import os
+from pydantic import BaseModel, Field, model_validator, field_validator, ConfigDict
 from .OmnistreamMetadata import OmnistreamMetadata
 
+BATCH_LOOKUP_LIMIT = int(os.getenv("BATCH_LOOKUP_LIMIT", 1000))
+MEDIA_PAGE_SIZE = int(os.getenv("MEDIA_PAGE_SIZE", 100)) # Page size of an imdb lookup that passes a cursor but no page_size
+
+def encode_media_cursor(shard: int, scan_cursor: int, node: int = None) -> str:
+    """
+    Opaque page cursor of an imdb lookup, which shard the scan is on, where SSCAN is in it
+    and which node of the shard (see database.get_read_node) is doing the scan, None if it hasn't started there yet.
+    """
+    parts = [shard, scan_cursor] if node is None else [shard, scan_cursor, node]
+    return base64.urlsafe_b64encode(".".join(map(str, parts)).encode("ascii")).decode("ascii").rstrip("=")
+
+def decode_media_cursor(cursor: str) -> tuple:
+    """
+    (shard, scan_cursor, node) of a cursor from encode_media_cursor, ValueError if it isn't one.
+    """
+    try:
+        shard, scan_cursor, *node = map(int, base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii").split("."))
+        if len(node) > 1:
+            raise ValueError
+        node = node[0] if node else None
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor.")
+    if shard < 0 or scan_cursor < 0 or (node is not None and node < 0):
+        raise ValueError("Invalid cursor.")
+    return shard, scan_cursor, node
+
 class JobStatus(str, Enum):
     SUCCESS = "success"
     FAILED = "failed"
     PENDING = "pending"
     PROCESSING = "processing"
 
+class MediaChange(str, Enum):
+    CREATED = "created"
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+
 class CreateMediaResponse(BaseModel):
     """
     Standard response model for media identification.
@@ -23,6 +57,45 @@ class CreateMediaResponse(BaseModel):
     imdb_id: Optional[str] = Field(None, description="IMDb ID (e.g. 'tt1234567'). Optional if unknown.")
     torrent_hash: Optional[str] = Field(None, description="SHA256 Info Hash of the torrent")
     index: Optional[int] = Field(None, description="File index within the torrent structure")
+    change: Optional[MediaChange] = Field(None, description="What the write did to the stored media")
+
+    # Optional error message if status is failed
+    error: Optional[str] = Field(None, description="Error details if any")
+
+class BulkCreateMediaResponse(BaseModel):
+    """
+    Response for a bulk upload.
+    Holds one CreateMediaResponse per uploaded item, in the same order they were sent.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    status: JobStatus = Field(..., description="API Status")
+    total: int = Field(0, description="Number of items read from the upload")
+    failed: int = Field(0, description="Number of items that could not be stored")
+
+    data: List[CreateMediaResponse] = Field(
+        default_factory=list,
+        description="Per item results."
+    )
+
+class IngestJobResponse(BaseModel):
+    """
+    State of an upload queued as an ingest job, result is the response the upload would have gotten once it's done.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    status: JobStatus = Field(..., description="pending until a worker picks it up, processing while it runs, then success or failed")
+    job_id: str = Field(..., description="Id to poll GET /torrents/jobs/{job_id} with")
+    kind: str = Field(..., description="What was uploaded: mediainfo, tracker or tracker_bulk")
+    total: int = Field(0, description="Items processed so far")
+    failed: int = Field(0, description="Items processed so far that could not be stored")
+    created: Optional[float] = Field(None, description="Unix time the job was queued")
+    started: Optional[float] = Field(None, description="Unix time a worker (last) picked it up")
+    finished: Optional[float] = Field(None, description="Unix time it was done")
+    result: Optional[CreateMediaResponse | BulkCreateMediaResponse] = Field(None, description="Final response, once done")
+
+    # Optional error message if status is failed
+    error: Optional[str] = Field(None, description="Error details if any")
 
 class MediaDataResponse(BaseModel):
     """
@@ -37,6 +110,7 @@ class MediaDataResponse(BaseModel):
         None, 
         description="A list of media summaries. Can be multiple items."
     )
+    next_cursor: Optional[str] = Field(None, description="Cursor of the next page of a paginated lookup, null on the last page")
     
     # Optional error message if status is failed
     error: Optional[str] = Field(None, description="Error details if any")
@@ -52,12 +126,24 @@ class MediaRequestParams(BaseModel):
     torrent_hash: Optional[str] = Field(None, description="SHA256 Info Hash of the torrent")
     index: Optional[int] = Field(None, description="File index within the torrent")
 
+    # --- Pagination (imdb lookups) ---
+    cursor: Optional[str] = Field(None, description="next_cursor of the previous page, leave out for the first page")
+    page_size: Optional[int] = Field(None, ge=1, le=BATCH_LOOKUP_LIMIT, description="About how many media per page")
+
+    @field_validator("cursor")
+    @classmethod
+    def validate_cursor(cls, cursor):
+        if cursor is not None:
+            decode_media_cursor(cursor)
+        return cursor
+
     @model_validator(mode='after')
     def validate_identifiers(self):
         """
         Enforce logical requirements:
         1. 'index' cannot be provided without 'torrent_hash'.
         2. At least one identification method (Unique ID, IMDb, or Torrent Hash) must be present.
+        3. Only imdb lookups can be paginated.
         """
         
         # Rule 1: Orphaned Index Check
@@ -77,4 +163,117 @@ class MediaRequestParams(BaseModel):
                 "1. 'unique_id', 2. 'imdb_id', or 3. 'torrent_hash'."
             )
 
-        return self
\ No newline at end of file
+        # Rule 3: Pagination Check
+        if (self.cursor is not None or self.page_size is not None) and (has_unique or not has_imdb):
+            raise ValueError("'cursor' and 'page_size' only work with an 'imdb_id' lookup.")
+
+        return self
+
+    @property
+    def paginated(self) -> bool:
+        return self.cursor is not None or self.page_size is not None
+
+class TorrentLookup(BaseModel):
+    """
+    One torrent in a batch lookup, the whole torrent or just the file at index.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    torrent_hash: str = Field(..., description="SHA256 Info Hash of the torrent")
+    index: Optional[int] = Field(None, description="File index within the torrent")
+
+class BatchMediaRequestParams(BaseModel):
+    """
+    Input parameters for looking up many medias at once.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    unique_ids: List[str] = Field(default_factory=list, description="MediaInfo UniqueIDs")
+    torrents: List[TorrentLookup] = Field(default_factory=list, description="Torrents, optionally narrowed to one file")
+    imdb_ids: List[str] = Field(default_factory=list, description="IMDb IDs (e.g., tt1234567)")
+
+    @model_validator(mode='after')
+    def validate_identifiers(self):
+        """
+        Needs at least one identifier and no more than BATCH_LOOKUP_LIMIT in total.
+        """
+        total = len(self.unique_ids) + len(self.torrents) + len(self.imdb_ids)
+
+        if total == 0:
+            raise ValueError("No identifiers found. Provide at least one of 'unique_ids', 'torrents' or 'imdb_ids'.")
+        if total > BATCH_LOOKUP_LIMIT:
+            raise ValueError(f"Too many identifiers ({total}), the limit is {BATCH_LOOKUP_LIMIT}.")
+
+        return self
+
+class BatchMediaResult(BaseModel):
+    """
+    The medias for one requested identifier, echoes back whichever identifier it answers.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    unique_id: Optional[str] = Field(None, description="The requested UniqueID")
+    imdb_id: Optional[str] = Field(None, description="The requested IMDb ID")
+    torrent_hash: Optional[str] = Field(None, description="The requested torrent hash")
+    index: Optional[int] = Field(None, description="The requested file index")
+
+    found: bool = Field(..., description="False when nothing is stored for the identifier")
+    data: List[OmnistreamMetadata] = Field(default_factory=list, description="Media summaries for the identifier")
+
+class BatchMediaDataResponse(BaseModel):
+    """
+    Response for a batch lookup, results are in the same order as the request lists.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    status: JobStatus = Field(..., description="API Status")
+
+    unique_ids: List[BatchMediaResult] = Field(default_factory=list)
+    torrents: List[BatchMediaResult] = Field(default_factory=list)
+    imdb_ids: List[BatchMediaResult] = Field(default_factory=list)
+
+    # Optional error message if status is failed
+    error: Optional[str] = Field(None, description="Error details if any")
+
+class MediaSearchParams(BaseModel):
+    """
+    Filters for searching media by technical attributes, a media has to match every one that's set.
+    Matching is case insensitive, track filters match if any track of the media has the value.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    imdb_id: Optional[str] = Field(None, description="IMDb ID (e.g., tt1234567)")
+    resolution: Optional[str] = Field(None, description='"2160p", "1080p", "720p", "576p" or "480p"')
+    hdr: List[str] = Field(default_factory=list, description='HDR features, e.g. ["DV", "HDR10"]')
+    audio_formats: List[str] = Field(default_factory=list, description='Audio format tags, e.g. ["Atmos"]')
+    audio_channels: List[str] = Field(default_factory=list, description='Audio channel tags, e.g. ["7.1"]')
+    subtitle_languages: List[str] = Field(default_factory=list, description='Subtitle languages, e.g. ["English"]')
+    quality: Optional[str] = Field(None, description='e.g., "BluRay REMUX", "WEB-DL"')
+    container: Optional[str] = Field(None, description='e.g., "mkv", "mp4"')
+
+    limit: int = Field(100, ge=1, le=BATCH_LOOKUP_LIMIT, description="Most media to return")
+
+    @model_validator(mode='after')
+    def validate_filters(self):
+        """
+        An imdb_id on its own is just a lookup, at least one attribute filter is needed.
+        """
+        if not any([self.resolution, self.hdr, self.audio_formats, self.audio_channels,
+                    self.subtitle_languages, self.quality, self.container]):
+            raise ValueError("No filters found. Provide at least one attribute to search by.")
+
+        return self
+
+class MediaSearchResponse(BaseModel):
+    """
+    Response for a search, total counts every match even when data was cut off at the limit.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    status: JobStatus = Field(..., description="API Status")
+    total: int = Field(0, description="Number of media matching the filters")
+
+    data: List[OmnistreamMetadata] = Field(default_factory=list, description="Matching media summaries")
+
+    # Optional error message if status is failed
+    error: Optional[str] = Field(None, description="Error details if any")
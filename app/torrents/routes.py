@@ -1,37 +1,233 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import os
+import time
+from app.core import metrics, profiler
+from app.core.cache import LRUCache
+from app.core.database import read_primary
 from .models import *
 from .services import *
+from . import jobs
+
+# Seconds a client's lookups stay on the primaries after it uploads, so it sees its own writes before replicas catch up. 0 turns it off
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 0))
+LOOKUP_ETAGS = os.getenv("LOOKUP_ETAGS", "true").lower() in ("1", "true", "yes") # ETags on GET /torrents/media, If-None-Match gets a 304 without decoding anything
+# Cache-Control of GET /torrents/media, e.g. "public, max-age=30, stale-while-revalidate=60" lets a CDN or reverse proxy answer repeats.
+# The default has them revalidate every time, which is cheap with ETags and keeps read-your-writes working behind them. Empty leaves it out
+LOOKUP_CACHE_CONTROL = os.getenv("LOOKUP_CACHE_CONTROL", "public, no-cache")
 
 router = APIRouter(prefix="/torrents")
 
-@router.post("/upload", response_model=CreateMediaResponse)
-async def create_mediainfo_json(json_media: MediaInfoExport):
+# Lookups sent with Accept: application/x-protobuf get the protos/media_info.proto response message instead of JSON
+PROTOBUF_MEDIA_TYPE = "application/x-protobuf"
+PROTOBUF_RESPONSE = {"description": "The same response as a serialized protobuf message", "content": {PROTOBUF_MEDIA_TYPE: {}}}
+NOT_MODIFIED_RESPONSE = {"description": "Nothing changed since the ETag sent in If-None-Match"}
+
+# Client id -> True for clients that wrote within the window, per worker
+recent_writers = LRUCache(10000, READ_YOUR_WRITES_WINDOW)
+
+def get_client_id(request: Request) -> str:
+    """
+    X-Client-Id header if the client sends one (needed behind proxies/NAT), its address otherwise.
+    """
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "")
+
+async def track_writes(request: Request):
+    """
+    Dependency of the upload routes, (re)starts the client's read-your-writes window
+    when the upload comes in and again once it's done so slow bulk uploads are covered too.
+    """
+    if READ_YOUR_WRITES_WINDOW:
+        recent_writers.set(get_client_id(request), True, recent_writers.version)
+    yield
+    if READ_YOUR_WRITES_WINDOW:
+        recent_writers.set(get_client_id(request), True, recent_writers.version)
+
+async def read_your_writes(request: Request):
+    """
+    Dependency of the lookup routes, sends the request's reads to the primaries while its client is in its window.
+    """
+    if READ_YOUR_WRITES_WINDOW and recent_writers.get(get_client_id(request)):
+        read_primary.set(True)
+
+async def start_validation(request: Request):
+    """
+    Dependency of the routes with a big body, FastAPI validates the body right after the dependencies
+    so from here until the endpoint runs is pydantic validating it, the endpoint closes it with validated().
+    """
+    request.state.validation_start = time.perf_counter()
+
+def validated(request: Request):
+    if metrics.METRICS_ENABLED:
+        metrics.observe_stage("validate", time.perf_counter() - request.state.validation_start)
+
+def wants_protobuf(request: Request) -> bool:
+    return PROTOBUF_MEDIA_TYPE in request.headers.get("accept", "")
+
+def model_response(model: BaseModel) -> Response:
+    """
+    Serializes the model straight to JSON, returning a Response skips FastAPI validating it against response_model again.
+    """
+    with metrics.stage("serialize"):
+        content = model.model_dump_json()
+    return Response(content=content, media_type="application/json")
+
+async def queue_upload(request: Request, kind: str) -> Response:
+    """
+    Queues the upload's body as an ingest job and answers 202 with the job right away, Location is where to poll it.
+    Bodies over INGEST_MAX_PAYLOAD get a 413.
+    """
+    try:
+        job = await jobs.enqueue_ingest_job(kind, request.stream())
+    except jobs.PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    location = str(request.url_for("get_ingest_job_status", job_id=job.job_id))
+    return Response(content=job.model_dump_json(), status_code=202, media_type="application/json", headers={"Location": location})
+
+def lookup_headers(etag: str = None) -> dict:
+    """
+    Caching headers of a GET lookup, the JSON and protobuf responses of a url differ so caches have to key on Accept too.
+    """
+    headers = {"Vary": "Accept"}
+    if etag:
+        headers["ETag"] = etag
+    if LOOKUP_CACHE_CONTROL:
+        headers["Cache-Control"] = LOOKUP_CACHE_CONTROL
+    return headers
+
+async def lookup_response(request: Request, params: MediaRequestParams, conditional: bool = False) -> Response:
+    """
+    Streams the lookup as NDJSON (one media per line) when the client sends Accept: application/x-ndjson.
+    Everything gets sent there, a cursor or page_size with it is a 400 rather than quietly sending the whole set again.
+    Accept: application/x-protobuf gets a MediaLookupResponse message made out of the stored messages.
+    With MEDIA_JSON on, the JSON response is put together out of the medias' pre-rendered JSON.
+    conditional (GET) responses get an ETag (LOOKUP_ETAGS) and LOOKUP_CACHE_CONTROL, a matching If-None-Match gets a 304.
+    """
+    representation = "protobuf" if wants_protobuf(request) else "json"
+    media_type = PROTOBUF_MEDIA_TYPE if representation == "protobuf" else "application/json"
+    headers = lookup_headers() if conditional else None
+    if representation == "json" and "application/x-ndjson" in request.headers.get("accept", ""):
+        if params.paginated:
+            raise HTTPException(status_code=400, detail="'cursor' and 'page_size' don't work with NDJSON lookups, the whole set is streamed.")
+        return StreamingResponse(iter_lookup_ndjson(params), media_type="application/x-ndjson", headers=headers)
+
+    if conditional and LOOKUP_ETAGS:
+        etag, content = await process_conditional_lookup(params, representation, request.headers.get("if-none-match", ""))
+        headers = lookup_headers(etag)
+        if content is None:
+            return Response(status_code=304, headers=headers)
+        return Response(content=content, media_type=media_type, headers=headers)
+
+    if representation == "protobuf" or MEDIA_JSON != "off":
+        _, content = await process_conditional_lookup(params, representation)
+        return Response(content=content, media_type=media_type, headers=headers)
+    response = model_response(await process_lookup(params))
+    response.headers.update(headers or {})
+    return response
+
+@router.post(
+    "/upload",
+    response_model=CreateMediaResponse,
+    dependencies=[Depends(track_writes), Depends(start_validation)],
+    responses={202: {"model": IngestJobResponse, "description": "Queued as an ingest job (Prefer: respond-async)"}}
+)
+async def create_mediainfo_json(request: Request, json_media: MediaInfoExport):
     """
     Endpoint to create a new media.
+    With Prefer: respond-async it's queued and the job is returned instead.
     """
+    validated(request)
+    if jobs.wants_async(request.headers.get("prefer", "")):
+        return await queue_upload(request, "mediainfo")
     response = await create_media_summary_from_mediainfo(json_media)
+    profiler.tag("unique_id", response.unique_id)
     return response
 
-@router.post("/upload/tracker", response_model=CreateMediaResponse)
-async def create_mediainfo_text(json_media: Unit3dTorrent):
+@router.post(
+    "/upload/tracker",
+    response_model=CreateMediaResponse,
+    dependencies=[Depends(track_writes), Depends(start_validation)],
+    responses={202: {"model": IngestJobResponse, "description": "Queued as an ingest job (Prefer: respond-async)"}}
+)
+async def create_mediainfo_text(request: Request, json_media: Unit3dTorrent):
     """
     Endpoint to create a new media with tracker data.
+    With Prefer: respond-async it's queued and the job is returned instead.
     """
+    validated(request)
+    profiler.tag("info_hash", json_media.attributes.info_hash)
+    if jobs.wants_async(request.headers.get("prefer", "")):
+        return await queue_upload(request, "tracker")
     response = await create_media_summary_from_tracker(json_media)
+    profiler.tag("unique_id", response.unique_id)
     return response
 
-@router.post("/media", response_model=MediaDataResponse)
-async def get_mediainfo_json(params: MediaRequestParams):
+@router.post(
+    "/upload/tracker/bulk",
+    response_model=BulkCreateMediaResponse,
+    dependencies=[Depends(track_writes)],
+    responses={202: {"model": IngestJobResponse, "description": "Queued as an ingest job (Prefer: respond-async)"}},
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/x-ndjson": {"schema": {"type": "string"}},
+        "application/json": {"schema": {"type": "array", "items": {"type": "object"}}},
+    }}}
+)
+async def create_mediainfo_text_bulk(request: Request):
     """
-    Endpoint to get mediainfo.
+    Endpoint to create many medias at once with tracker data.
+    Takes NDJSON (one torrent per line) or a JSON array of torrents.
+    With Prefer: respond-async the body is queued (up to INGEST_MAX_PAYLOAD) and the job is returned instead, its progress counts up as batches get written.
     """
-    response = await process_lookup(params)
+    if jobs.wants_async(request.headers.get("prefer", "")):
+        return await queue_upload(request, "tracker_bulk")
+    response = await create_media_summaries_from_tracker(request.stream())
     return response
 
-@router.get("/media", response_model=MediaDataResponse)
-async def search_mediainfo_json(params: MediaRequestParams = Depends()):
+@router.get("/jobs/{job_id}", response_model=IngestJobResponse)
+async def get_ingest_job_status(job_id: str):
+    """
+    Endpoint to poll a queued upload, result holds the upload's response once status is success or failed.
+    Jobs are forgotten INGEST_JOB_TTL after they're queued or done.
+    """
+    job = await jobs.get_ingest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such job (or it expired).")
+    return model_response(job)
+
+@router.post("/media", response_model=MediaDataResponse, dependencies=[Depends(read_your_writes)], responses={200: PROTOBUF_RESPONSE})
+async def get_mediainfo_json(request: Request, params: MediaRequestParams):
     """
     Endpoint to get mediainfo.
+    imdb lookups can be paged with page_size/cursor or streamed as NDJSON.
     """
-    response = await process_lookup(params)
-    return response
+    return await lookup_response(request, params)
+
+@router.post("/media/batch", response_model=BatchMediaDataResponse, dependencies=[Depends(read_your_writes)], responses={200: PROTOBUF_RESPONSE})
+async def get_mediainfo_json_batch(request: Request, params: BatchMediaRequestParams):
+    """
+    Endpoint to get the mediainfo of many unique ids, torrents and imdb ids at once.
+    Every identifier gets its own result (found=false when there's nothing), in request order.
+    Accept: application/x-protobuf gets a BatchMediaLookupResponse message.
+    """
+    if wants_protobuf(request):
+        return Response(content=await process_batch_lookup_proto(params), media_type=PROTOBUF_MEDIA_TYPE)
+    response = await process_batch_lookup(params)
+    return model_response(response)
+
+@router.post("/search", response_model=MediaSearchResponse, dependencies=[Depends(read_your_writes)])
+async def search_media_json(params: MediaSearchParams):
+    """
+    Endpoint to find media by technical attributes, e.g. every 2160p DV release with Atmos and English subtitles for an imdb id.
+    """
+    response = await process_search(params)
+    return model_response(response)
+
+@router.get("/media", response_model=MediaDataResponse, dependencies=[Depends(read_your_writes)], responses={200: PROTOBUF_RESPONSE, 304: NOT_MODIFIED_RESPONSE})
+async def search_mediainfo_json(request: Request, params: MediaRequestParams = Depends()):
+    """
+    Endpoint to get mediainfo.
+    imdb lookups can be paged with page_size/cursor or streamed as NDJSON.
+    Responses carry an ETag, send it back in If-None-Match to get a 304 while nothing changed.
+    """
+    return await lookup_response(request, params, conditional=True)
@@ -1,80 +1,187 @@
 from . import models, utils
-from app.core.database import redis_client
+from .models.http import MEDIA_PAGE_SIZE, encode_media_cursor, decode_media_cursor
+from app.core.database import get_shards, get_shard, get_shard_index, group_by_shard, get_read_client, run_read, primary_reads, read_primary, get_read_node, get_node_client, mark_replica_down
+from app.core.executor import run_parser, ParseQueueFull, ParseTimeout
+from app.core.cache import media_cache, lookup_flights, queue_media_invalidation, LOOKUP_COALESCE
+from app.core.blobs import pack_media_blob, unpack_media_blobs
+from app.core.metrics import stage, PARSE_CACHE, MEDIA_JSON_LOOKUPS
 from.utils import redischeck
-from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+from .keyspace import get_media_json_key, queue_media_json_store
+from .keyspace import get_layout, get_unique_id
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary, MediaLookupResponse, BatchMediaLookupResult # type: ignore
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 from typing import List
+from functools import wraps
+import asyncio
+import os
 
-def get_unique_key(unique_id):
-    if type(unique_id) == bytes:
-        unique_id = unique_id.decode('utf-8')
-    return f"mediafile:{unique_id}"
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 500))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 200))
+SCAN_COUNT = int(os.getenv("SCAN_COUNT", 1000)) # COUNT hint of keyspace SCANs, keys looked at per round trip
+KEYSPACE_LAYOUT = os.getenv("KEYSPACE_LAYOUT", "keys") # "buckets" groups records into small binary keyed hashes (see keyspace.py)
+KEYSPACE_SHADOW = os.getenv("KEYSPACE_SHADOW", "") # A second layout that gets every write and removal too, for migrating online
+PARSE_CACHE_TTL = int(os.getenv("PARSE_CACHE_TTL", 7 * 86400)) # Seconds a parsed MediaInfo report is kept under its fingerprint so resubmissions skip parsing, 0 turns it off
+PARSE_CACHE_VERSION = 2 # Bump whenever parsing changes, results of the older parser stop being used
+# "lazy" stores a media's rendered JSON the first time it's read, "write" renders it on every write too. /torrents/media lookups
+# then splice it into the response as is instead of decoding, validating and serializing every media. "off" keeps it all in the model path
+MEDIA_JSON = os.getenv("MEDIA_JSON", "off").lower()
+MEDIA_JSON_TTL = int(os.getenv("MEDIA_JSON_TTL", 7 * 86400)) # Seconds rendered JSON is kept (0 for good), JSON of an older response schema lingers this long too
+# Rendered JSON is keyed by the response schema's version so JSON of an older app is never served
+MEDIA_JSON_VERSION = utils.model_schema_version(models.OmnistreamMetadata)
 
-def get_imdb_key(imdb_id: str):
-    return f"imdb:{imdb_id}"
+# Where media and their index entries are stored, reads only ever go to this one
+layout = get_layout(KEYSPACE_LAYOUT)
+write_layouts = [layout] + ([get_layout(KEYSPACE_SHADOW)] if KEYSPACE_SHADOW and KEYSPACE_SHADOW != KEYSPACE_LAYOUT else [])
 
-def get_torrent_hash_key(hash_id: str): #, index: int = None
-    return f"thash:{hash_id}" #{':'+str(index) if index else ''}
+async def prepare_layouts():
+    """
+    Gets the layouts written to ready for the shards, see BucketsLayout.prepare.
+    """
+    await asyncio.gather(*[write_layout.prepare(get_shards()) for write_layout in write_layouts])
+
+# MediaSearchParams field -> search index attribute (see utils.media_index_values)
+SEARCH_FILTERS = {
+    "resolution": "resolution",
+    "hdr": "hdr",
+    "audio_formats": "audio",
+    "audio_channels": "channels",
+    "subtitle_languages": "subtitle",
+    "quality": "quality",
+    "container": "container",
+}
+
+async def fan_out(func) -> list:
+    """
+    Runs func(client) on every shard at once, results come back in shard order.
+    Only for reads, client is a replica whenever the shard has a healthy one.
+    """
+    return await asyncio.gather(*[run_read(shard, func) for shard in range(len(get_shards()))])
 
 @redischeck()
-async def get_children_of_key(key: str): # NEVER USE THIS SHIT FUNCTION AGAIN IM RETARDED
+async def get_children_of_key(key: str, count: int = SCAN_COUNT) -> List:
     """
-    DONT USE TS.
+    Every key starting with key on every shard, SCANs the whole keyspace so it's for tools and maintenance only.
     """
     keys = []
-    cursor = 0
-    while True:
-        cursor, batch = await redis_client.scan(0, match=f"{key}*", count=10)
-        keys.extend(batch)
-        if cursor == 0:
-            break
+    for redis_client in get_shards():
+        async for found in redis_client.scan_iter(match=f"{key}*", count=count):
+            keys.append(found)
     return keys
 
+# Torrent/imdb index entries live on the same shard as the media they point at, so writes only leave that shard to drop
+# a torrent file's old entry from the others (see queue_torrent_releases), but a lookup by torrent hash or imdb has to ask all of them.
+
 @redischeck()
 async def get_unique_ids_from_torrent_hash(thash: str):
-    thash_key = get_torrent_hash_key(thash)
-    thash_map = await redis_client.hgetall(thash_key)
+    thash_map = {}
+    for part in await fan_out(lambda client: layout.read_torrent(client, thash)):
+        thash_map.update(part)
     return list(thash_map.values())
 
+@redischeck()
+async def get_unique_id_from_torrent_index(thash: str, index: str):
+    for unique_id in await fan_out(lambda client: layout.read_torrent(client, thash, index)):
+        if unique_id is not None:
+            return unique_id
+    return None
+
+@redischeck()
+async def get_unique_ids_from_imdb(imdb: str):
+    imdb_key = layout.imdb_key(imdb)
+    unique_ids = []
+    for part in await fan_out(lambda client: client.smembers(imdb_key)):
+        unique_ids.extend(map(get_unique_id, part))
+    return unique_ids
+
+async def mget_by_shard(unique_ids: List, unpack: bool = True) -> dict:
+    """
+    {unique_id: blob} for the given ids, one read per shard all at the same time. Missing ones are left out.
+    unpack=False leaves the blobs the way they're stored (compressed).
+    """
+    async def mget(shard: int, shard_unique_ids: List):
+        blobs = await run_read(shard, lambda client: layout.read_media(client, shard_unique_ids))
+        return shard_unique_ids, await unpack_media_blobs(blobs) if unpack else blobs
+
+    blobs = {}
+    for shard_unique_ids, media_infos in await asyncio.gather(*[mget(shard, ids) for shard, ids in group_by_shard(unique_ids).items()]):
+        for unique_id, media_info in zip(shard_unique_ids, media_infos):
+            if media_info:
+                blobs[unique_id] = media_info
+    return blobs
+
 @redischeck()
 async def get_media_from_uniqueid(unique_id):
     """
     Fetches a single media by uniqueid.
     """
 
-    unique_id_key = get_unique_key(unique_id)
-    media_info = await redis_client.get(unique_id_key)
+    unique_id = get_unique_id(unique_id)
+    cached = media_cache.get(unique_id)
+    if cached is not None:
+        return cached
+
+    version = media_cache.version
+    blobs = await run_read(get_shard_index(unique_id), lambda client: layout.read_media(client, [unique_id]))
+    media_info, = await unpack_media_blobs(blobs)
     
     if media_info:
-        OmnistreamProtoSummaryContext = OmnistreamProtoSummary()
-        OmnistreamProtoSummaryContext.ParseFromString(media_info)
-        return utils.omnistream_proto_summary_to_dict(OmnistreamProtoSummaryContext)
+        with stage("decode"):
+            OmnistreamProtoSummaryContext = OmnistreamProtoSummary()
+            OmnistreamProtoSummaryContext.ParseFromString(media_info)
+            media = utils.omnistream_proto_summary_to_model(OmnistreamProtoSummaryContext)
+        media_cache.set(unique_id, media, version, utils.blob_digest(blobs[0]))
+        return media
     return None
 
 @redischeck()
-async def get_medias_from_uniqueids(unique_ids: List):
+async def get_media_map_from_uniqueids(unique_ids: List) -> dict:
     """
-    Fetches multiple medias by uniqueids.
+    Fetches multiple medias by uniqueids as {unique_id: media}.
+    Cached ones are served from memory and the rest come in one MGET per shard, ids with nothing stored are left out.
     """
 
-    unique_id_keys = [get_unique_key(unique_id) for unique_id in unique_ids]
+    output = {}
+    missing = []
+    for unique_id in dict.fromkeys(map(get_unique_id, unique_ids)):
+        media = media_cache.get(unique_id)
+        if media is not None:
+            output[unique_id] = media
+        else:
+            missing.append(unique_id)
 
-    media_infos = await redis_client.mget(unique_id_keys)
-    
-    if len(media_infos) > 0:
-        output = []
+    if missing:
+        version = media_cache.version
+        blobs = await mget_by_shard(missing, unpack=False)
+        output.update(await decode_media_blobs(blobs, version))
+
+    return output
+
+async def decode_media_blobs(blobs: dict, version: int, digests: dict = None) -> dict:
+    """
+    {unique_id: media} of {unique_id: stored blob}, every media goes in the cache tagged with its blob's digest
+    (see process_conditional_lookup). digests are the ones already worked out, if any.
+    """
+    output = {}
+    media_infos = await unpack_media_blobs(list(blobs.values()))
+    with stage("decode"):
         OmnistreamProtoSummaryContext = OmnistreamProtoSummary()
-        for media_info in media_infos:
+        for (unique_id, blob), media_info in zip(blobs.items(), media_infos):
             OmnistreamProtoSummaryContext.Clear()
             OmnistreamProtoSummaryContext.ParseFromString(media_info)
-            output.append(utils.omnistream_proto_summary_to_dict(OmnistreamProtoSummaryContext))
-        """output = {}
-        MediaInfoSummaryContext = MediaInfoSummary()
-        for media_info,unique_id in zip(media_infos,unique_ids):
-            MediaInfoSummaryContext.Clear()
-            MediaInfoSummaryContext.ParseFromString(media_info)
-            output.update({unique_id:utils.mediainfo_protobuf_to_dict(MediaInfoSummaryContext)})"""
-        return output
-    return None
+            media = utils.omnistream_proto_summary_to_model(OmnistreamProtoSummaryContext)
+            media_cache.set(unique_id, media, version, digests[unique_id] if digests else utils.blob_digest(blob))
+            output[unique_id] = media
+    return output
+
+@redischeck()
+async def get_medias_from_uniqueids(unique_ids: List):
+    """
+    Fetches multiple medias by uniqueids, in the order asked for.
+    """
+
+    unique_ids = [get_unique_id(unique_id) for unique_id in unique_ids]
+    medias = await get_media_map_from_uniqueids(unique_ids)
+    return [medias[unique_id] for unique_id in unique_ids if unique_id in medias]
 
 @redischeck()
 async def get_media_from_torrent_index(thash: str, index: str):
@@ -82,8 +189,9 @@ async def get_media_from_torrent_index(thash: str, index: str):
     Fetches a single media by torrent hash and index.
     """ 
 
-    thash_key = get_torrent_hash_key(thash)
-    unique_id = await redis_client.hget(thash_key, index)
+    unique_id = await get_unique_id_from_torrent_index(thash, index)
+    if unique_id is None:
+        return None
     
     return await get_media_from_uniqueid(unique_id)
 
@@ -109,17 +217,167 @@ async def get_medias_from_imdb(imdb: str):
     Fetches all media by imdb.
     """
 
-    imdb_key = get_imdb_key(imdb)
-    unique_ids = await redis_client.smembers(imdb_key)
+    unique_ids = await get_unique_ids_from_imdb(imdb)
 
     if not unique_ids:
         return []
     
     return await get_medias_from_uniqueids(unique_ids)
 
+@redischeck()
+async def get_media_protos_from_uniqueids(unique_ids: List) -> List[OmnistreamProtoSummary]:
+    """
+    Fetches multiple medias by uniqueids as protos, for callers that want the stored message and not the model (gRPC).
+    Skips the model cache, ids with nothing stored are left out.
+    """
+
+    if not unique_ids:
+        return []
+
+    unique_ids = [get_unique_id(unique_id) for unique_id in unique_ids]
+    media_infos = await mget_by_shard(unique_ids)
+    with stage("decode"):
+        return [OmnistreamProtoSummary.FromString(media_infos[unique_id]) for unique_id in unique_ids if unique_id in media_infos]
+
+@redischeck()
+async def iter_media_protos_from_imdb(imdb: str, batch_size: int = STREAM_BATCH_SIZE):
+    """
+    Yields every media of an imdb as protos, SSCANs the imdb set and reads it batch_size at a time
+    so huge sets never have to be held in memory at once. Goes one shard after the other,
+    sticking to the read client it starts each shard with.
+    SSCAN can hand out a member more than once (the set got rehashed while scanning), the ids already seen
+    are kept so every media is only yielded once.
+    """
+
+    async def fetch(redis_client, unique_ids: List):
+        media_infos = await unpack_media_blobs(await layout.read_media(redis_client, unique_ids))
+        with stage("decode"):
+            return [OmnistreamProtoSummary.FromString(media_info) for media_info in media_infos if media_info]
+
+    seen = set()
+    for shard in range(len(get_shards())):
+        redis_client = get_read_client(shard)
+        unique_ids = []
+        async for unique_id in redis_client.sscan_iter(layout.imdb_key(imdb), count=batch_size):
+            unique_id = get_unique_id(unique_id)
+            if unique_id in seen:
+                continue
+            seen.add(unique_id)
+            unique_ids.append(unique_id)
+            if len(unique_ids) >= batch_size:
+                for summary in await fetch(redis_client, unique_ids):
+                    yield summary
+                unique_ids = []
+
+        if unique_ids:
+            for summary in await fetch(redis_client, unique_ids):
+                yield summary
+
+@redischeck()
+async def get_media_page_from_imdb(imdb: str, cursor: str = None, page_size: int = MEDIA_PAGE_SIZE) -> tuple:
+    """
+    One page of an imdb's media as (medias, next cursor), see get_unique_id_page_from_imdb.
+    """
+
+    unique_ids, next_cursor = await get_unique_id_page_from_imdb(imdb, cursor, page_size)
+    return await get_medias_from_uniqueids(unique_ids), next_cursor
+
+@redischeck()
+async def get_unique_id_page_from_imdb(imdb: str, cursor: str = None, page_size: int = MEDIA_PAGE_SIZE) -> tuple:
+    """
+    The unique ids of one page of an imdb's media as (unique ids, next cursor), next cursor is None on the last page.
+    SSCANs one shard after the other until about page_size ids are in, the cursor says which shard and where in it.
+    Like any SSCAN, media added or removed while paging may or may not show up and a page can be a bit over or under page_size.
+
+    An SSCAN cursor only means something on the node that handed it out, so the scan of a shard stays on the node it
+    started on (which one goes in the cursor). If that replica goes down the shard is scanned again from the start on
+    its primary, ids of earlier pages can show up again but none get skipped.
+    """
+
+    imdb_key = layout.imdb_key(imdb)
+    shard, scan_cursor, node = decode_media_cursor(cursor) if cursor else (0, 0, None)
+    shards = len(get_shards())
+
+    unique_ids = []
+    while shard < shards and len(unique_ids) < page_size:
+        if node is None:
+            node = get_read_node(shard) if scan_cursor == 0 else 0
+        client = get_node_client(shard, node)
+        if client is None:
+            node, scan_cursor = 0, 0
+            client = get_node_client(shard, node)
+
+        count = page_size - len(unique_ids)
+        try:
+            next_scan_cursor, batch = await client.sscan(imdb_key, scan_cursor, count=count)
+        except (RedisConnectionError, RedisTimeoutError) as e:
+            if node == 0:
+                raise
+            mark_replica_down(client, e)
+            node, scan_cursor = 0, 0
+            continue
+
+        scan_cursor = next_scan_cursor
+        unique_ids.extend(map(get_unique_id, batch))
+        if scan_cursor == 0:
+            shard += 1
+            node = None
+
+    next_cursor = encode_media_cursor(shard, scan_cursor, node) if shard < shards else None
+    return unique_ids, next_cursor
+
+def get_lookup_key(params: models.MediaRequestParams) -> tuple:
+    """
+    What a lookup actually asks for, same cases as process_lookup so params that only differ in what it ignores get the same key.
+    """
+    if params.unique_id:
+        return ("unique_id", params.unique_id)
+    if params.imdb_id and params.paginated:
+        return ("imdb_id", params.imdb_id, params.cursor, params.page_size or MEDIA_PAGE_SIZE)
+    if params.imdb_id:
+        return ("imdb_id", params.imdb_id)
+    if params.index:
+        return ("torrent_hash", params.torrent_hash, params.index)
+    return ("torrent_hash", params.torrent_hash)
+
+def coalesce_lookups(func):
+    """
+    Identical lookups running at the same time share one call of func (see LOOKUP_COALESCE), its result is shared too so don't change it.
+    Reads going to the primaries never share with ones that don't, and nothing joins a call started before the latest
+    media cache invalidation, so a lookup sent after a write never gets a fetch that could have begun before it.
+    """
+    @wraps(func)
+    async def wrapper(params: models.MediaRequestParams, *args):
+        if not LOOKUP_COALESCE:
+            return await func(params, *args)
+        key = (func.__name__, get_lookup_key(params), *args, read_primary.get(), media_cache.version)
+        return await lookup_flights.do(key, func, params, *args)
+    return wrapper
+
+async def iter_lookup_ndjson(params: models.MediaRequestParams):
+    """
+    A lookup as NDJSON, one media per line.
+    imdb lookups are read and decoded STREAM_BATCH_SIZE at a time so a huge title never sits in memory all at once.
+    """
+    if params.imdb_id and not params.unique_id:
+        async for summary in iter_media_protos_from_imdb(params.imdb_id):
+            yield utils.omnistream_proto_summary_to_model(summary).model_dump_json() + "\n"
+        return
+
+    response = await process_lookup(params)
+    for media in response.data:
+        if media is not None:
+            yield media.model_dump_json() + "\n"
+
+@coalesce_lookups
 async def process_lookup(params: models.MediaRequestParams) -> models.MediaDataResponse:
+    next_cursor = None
+
     if params.unique_id:
         result = [await get_media_from_uniqueid(params.unique_id)]
+
+    elif params.imdb_id and params.paginated:
+        result, next_cursor = await get_media_page_from_imdb(params.imdb_id, params.cursor, params.page_size or MEDIA_PAGE_SIZE)
         
     elif params.imdb_id:
         result = await get_medias_from_imdb(params.imdb_id)
@@ -132,52 +390,341 @@ async def process_lookup(params: models.MediaRequestParams) -> models.MediaDataR
 
     return models.MediaDataResponse(
         status="success",
-        data=result
+        data=[media for media in result if media is not None],
+        next_cursor=next_cursor
     )
 
 @redischeck()
-async def create_media_summary_from_mediainfo(json_media):
+async def get_media_json_map_from_uniqueids(unique_ids: List) -> dict:
     """
-    Creates a new media summary from mediainfo json in the Redis database.
+    Fetches multiple medias by uniqueids as {unique_id: JSON bytes of its OmnistreamMetadata}, ids with nothing stored are left out.
+    Medias in the model cache are serialized from there, the rest come from their stored JSON (one MGET per shard) and only
+    the ones without any are read, decoded and rendered, their JSON is stored for next time (see STORE_MEDIA_JSON_LUA).
+    """
+
+    output = {}
+    missing = []
+    for unique_id in dict.fromkeys(map(get_unique_id, unique_ids)):
+        media = media_cache.get(unique_id)
+        if media is not None:
+            with stage("serialize"):
+                output[unique_id] = media.model_dump_json().encode("utf-8")
+        else:
+            missing.append(unique_id)
+    MEDIA_JSON_LOOKUPS.inc(len(output), "memory")
+
+    async def read(shard: int, shard_unique_ids: List):
+        keys = [get_media_json_key(unique_id, MEDIA_JSON_VERSION) for unique_id in shard_unique_ids]
+        stored = await run_read(shard, lambda client: client.mget(keys))
+        unrendered = [unique_id for unique_id, media_json in zip(shard_unique_ids, stored) if media_json is None]
+        output.update((unique_id, media_json) for unique_id, media_json in zip(shard_unique_ids, stored) if media_json is not None)
+        MEDIA_JSON_LOOKUPS.inc(len(shard_unique_ids) - len(unrendered), "stored")
+        if unrendered:
+            await render(shard, unrendered)
+
+    async def render(shard: int, shard_unique_ids: List):
+        version = media_cache.version
+        blobs = await run_read(shard, lambda client: layout.read_media(client, shard_unique_ids))
+        media_infos = await unpack_media_blobs(blobs)
+
+        pipe = get_shards()[shard].pipeline(transaction=False)
+        OmnistreamProtoSummaryContext = OmnistreamProtoSummary()
+        for unique_id, blob, media_info in zip(shard_unique_ids, blobs, media_infos):
+            if not media_info:
+                continue
+            with stage("decode"):
+                OmnistreamProtoSummaryContext.Clear()
+                OmnistreamProtoSummaryContext.ParseFromString(media_info)
+                media = utils.omnistream_proto_summary_to_model(OmnistreamProtoSummaryContext)
+            media_cache.set(unique_id, media, version, utils.blob_digest(blob))
+            with stage("serialize"):
+                output[unique_id] = media.model_dump_json().encode("utf-8")
+            json_key = get_media_json_key(unique_id, MEDIA_JSON_VERSION)
+            await queue_media_json_store(pipe, layout, unique_id, blob, json_key, output[unique_id], MEDIA_JSON_TTL)
+        MEDIA_JSON_LOOKUPS.inc(len(pipe), "rendered")
+        if len(pipe):
+            try:
+                await pipe.execute()
+            except Exception as e:
+                print(f"Storing rendered media JSON failed: {e}")
+
+    if missing:
+        await asyncio.gather(*[read(shard, shard_unique_ids) for shard, shard_unique_ids in group_by_shard(missing).items()])
+    return output
+
+def splice_media_response(response, medias: List[bytes]) -> bytes:
+    """
+    JSON of a response model with medias (JSON bytes) spliced in as its data,
+    byte for byte what model_dump_json gives with the models in data.
+    """
+    with stage("serialize"):
+        envelope = response.model_dump_json().encode("utf-8")
+        before, empty, after = envelope.partition(b'"data":[]')
+        return before + b'"data":[' + b",".join(medias) + b"]" + after
+
+async def get_lookup_unique_ids(params: models.MediaRequestParams) -> tuple:
+    """
+    (unique ids, next cursor) a lookup resolves to, same cases as process_lookup. A torrent index that isn't there is None.
+    """
+    next_cursor = None
+
+    if params.unique_id:
+        unique_ids = [get_unique_id(params.unique_id)]
+
+    elif params.imdb_id and params.paginated:
+        unique_ids, next_cursor = await get_unique_id_page_from_imdb(params.imdb_id, params.cursor, params.page_size or MEDIA_PAGE_SIZE)
+
+    elif params.imdb_id:
+        unique_ids = await get_unique_ids_from_imdb(params.imdb_id)
+
+    elif params.index:
+        unique_ids = [await get_unique_id_from_torrent_index(params.torrent_hash, params.index)]
+
+    elif params.torrent_hash:
+        unique_ids = [get_unique_id(unique_id) for unique_id in await get_unique_ids_from_torrent_hash(params.torrent_hash)]
+
+    return unique_ids, next_cursor
+
+@coalesce_lookups
+@redischeck()
+async def process_conditional_lookup(params: models.MediaRequestParams, representation: str = "json", if_none_match: str = "") -> tuple:
+    """
+    A lookup as (ETag, body), representation is "json" or "protobuf" (a serialized MediaLookupResponse).
+    The ETag is a hash of what the body is made of, the stored blobs or with MEDIA_JSON on the medias' JSON,
+    so when if_none_match already has it the body is None and nothing got decoded or serialized.
+    The body is always made out of exactly what got hashed, cached models are only used when they came from the same blob.
+    A unique id or torrent index that isn't there gives an empty data list.
+    """
+    unique_ids, next_cursor = await get_lookup_unique_ids(params)
+    unique_ids = [unique_id for unique_id in unique_ids if unique_id is not None]
+    response = models.MediaDataResponse(status="success", data=[], next_cursor=next_cursor)
+
+    if representation == "json" and MEDIA_JSON != "off":
+        medias = await get_media_json_map_from_uniqueids(unique_ids)
+        data = [medias[unique_id] for unique_id in unique_ids if unique_id in medias]
+        etag = utils.lookup_etag(f"json-{MEDIA_JSON_VERSION}", next_cursor, data)
+        if utils.etag_matches(etag, if_none_match):
+            return etag, None
+        return etag, splice_media_response(response, data)
+
+    version = media_cache.version
+    blobs = await mget_by_shard(unique_ids, unpack=False) if unique_ids else {}
+    unique_ids = [unique_id for unique_id in unique_ids if unique_id in blobs]
+    digests = {unique_id: utils.blob_digest(blob) for unique_id, blob in blobs.items()}
+    etag = utils.lookup_etag(representation if representation == "protobuf" else f"blob-{MEDIA_JSON_VERSION}", next_cursor, [digests[unique_id] for unique_id in unique_ids])
+    if utils.etag_matches(etag, if_none_match):
+        return etag, None
+
+    if representation == "protobuf":
+        media_infos = await unpack_media_blobs([blobs[unique_id] for unique_id in unique_ids])
+        with stage("serialize"):
+            return etag, MediaLookupResponse(next_cursor=next_cursor or "").SerializeToString() + utils.encode_message_fields(1, media_infos)
+
+    # A cached model is only used when it was made from the very blob that got hashed
+    medias = {}
+    for unique_id in dict.fromkeys(unique_ids):
+        media = media_cache.get(unique_id, digests[unique_id])
+        if media is not None:
+            medias[unique_id] = media
+    missing = {unique_id: blob for unique_id, blob in blobs.items() if unique_id not in medias}
+    if missing:
+        medias.update(await decode_media_blobs(missing, version, digests))
+    response.data = [medias[unique_id] for unique_id in unique_ids]
+    with stage("serialize"):
+        return etag, response.model_dump_json().encode("utf-8")
+
+async def get_batch_lookup_unique_ids(params: models.BatchMediaRequestParams) -> tuple:
+    """
+    (unique ids of each torrent, unique ids of each imdb id) of a batch lookup, one pipeline per shard for all of them.
+    """
+
+    torrent_unique_ids = [[] for _ in params.torrents]
+    imdb_unique_ids = [[] for _ in params.imdb_ids]
+
+    async def read_indexes(redis_client):
+        pipe = redis_client.pipeline(transaction=False)
+        for torrent in params.torrents:
+            await layout.queue_torrent_read(pipe, torrent.torrent_hash, None if torrent.index is None else str(torrent.index))
+        for imdb_id in params.imdb_ids:
+            pipe.smembers(layout.imdb_key(imdb_id))
+        return await pipe.execute()
+
+    if params.torrents or params.imdb_ids:
+        for index_replies in await fan_out(read_indexes):
+            for torrent, unique_ids, reply in zip(params.torrents, torrent_unique_ids, index_replies):
+                if torrent.index is None:
+                    unique_ids.extend(layout.torrent_reply(reply).values())
+                elif reply:
+                    unique_ids.append(layout.torrent_reply(reply, str(torrent.index)))
+            for unique_ids, reply in zip(imdb_unique_ids, index_replies[len(params.torrents):]):
+                unique_ids.extend(get_unique_id(unique_id) for unique_id in reply)
+
+    return torrent_unique_ids, imdb_unique_ids
+
+@redischeck()
+async def process_batch_lookup(params: models.BatchMediaRequestParams) -> models.BatchMediaDataResponse:
+    """
+    Resolves every identifier of a batch lookup in at most two round trips,
+    one pipeline for all the torrent/imdb index reads and one for all the blobs (per shard, all shards at once).
+    """
+
+    torrent_unique_ids, imdb_unique_ids = await get_batch_lookup_unique_ids(params)
+    all_unique_ids = list(params.unique_ids)
+    for unique_ids in torrent_unique_ids + imdb_unique_ids:
+        all_unique_ids.extend(unique_ids)
+    medias = await get_media_map_from_uniqueids(all_unique_ids)
+
+    def result(unique_ids: List[str], **identifier) -> models.BatchMediaResult:
+        data = [medias[unique_id] for unique_id in unique_ids if unique_id in medias]
+        return models.BatchMediaResult(found=bool(data), data=data, **identifier)
+
+    return models.BatchMediaDataResponse(
+        status="success",
+        unique_ids=[result([unique_id], unique_id=unique_id) for unique_id in params.unique_ids],
+        torrents=[
+            result(unique_ids, torrent_hash=torrent.torrent_hash, index=torrent.index)
+            for torrent, unique_ids in zip(params.torrents, torrent_unique_ids)
+        ],
+        imdb_ids=[
+            result(unique_ids, imdb_id=imdb_id)
+            for imdb_id, unique_ids in zip(params.imdb_ids, imdb_unique_ids)
+        ]
+    )
+
+@redischeck()
+async def process_batch_lookup_proto(params: models.BatchMediaRequestParams) -> bytes:
+    """
+    process_batch_lookup as a serialized BatchMediaLookupResponse, made out of the stored messages without decoding any of them.
     """
 
-    summary_proto = utils.parse_mediainfo_export_to_proto(json_media)
+    torrent_unique_ids, imdb_unique_ids = await get_batch_lookup_unique_ids(params)
+    all_unique_ids = [get_unique_id(unique_id) for unique_id in params.unique_ids]
+    for unique_ids in torrent_unique_ids + imdb_unique_ids:
+        all_unique_ids.extend(unique_ids)
+    media_infos = await mget_by_shard(list(dict.fromkeys(all_unique_ids))) if all_unique_ids else {}
+
+    def result(unique_ids: List[str], **identifier) -> bytes:
+        data = [media_infos[unique_id] for unique_id in unique_ids if unique_id in media_infos]
+        return BatchMediaLookupResult(found=bool(data), **identifier).SerializeToString() + utils.encode_message_fields(1, data)
+
+    with stage("serialize"):
+        return b"".join([
+            utils.encode_message_fields(1, [result([get_unique_id(unique_id)], unique_id=unique_id) for unique_id in params.unique_ids]),
+            utils.encode_message_fields(2, [
+                result(unique_ids, torrent_hash=torrent.torrent_hash, index=torrent.index)
+                for torrent, unique_ids in zip(params.torrents, torrent_unique_ids)
+            ]),
+            utils.encode_message_fields(3, [
+                result(unique_ids, imdb_id=imdb_id)
+                for imdb_id, unique_ids in zip(params.imdb_ids, imdb_unique_ids)
+            ]),
+        ])
+
+def get_search_keys(params: models.MediaSearchParams) -> List[str]:
+    """
+    Keys of the sets a search has to intersect, the imdb set narrows it down to one title.
+    """
+    keys = [layout.imdb_key(params.imdb_id)] if params.imdb_id else []
+    for field, attribute in SEARCH_FILTERS.items():
+        values = getattr(params, field)
+        if isinstance(values, str):
+            values = [values]
+        keys.extend(layout.search_key(attribute, value) for value in values or [])
+    return keys
+
+async def process_search(params: models.MediaSearchParams) -> models.MediaSearchResponse:
+    """
+    Intersects the search index sets on every shard (a media's entries all live on its own shard) and only fetches the matches.
+    Matches are sorted by unique id so the same search always returns the same ones.
+    """
+    keys = get_search_keys(params)
 
-    unique_id = summary_proto.unique_id
-    imdb_id = summary_proto.imdb_id
-    torrent_hash = summary_proto.torrent_hash
-    torrent_file_index = summary_proto.torrent_file_index
+    unique_ids = []
+    for part in await fan_out(lambda client: client.sinter(keys)):
+        unique_ids.extend(get_unique_id(unique_id) for unique_id in part)
+    unique_ids.sort()
 
-    serialized_data = summary_proto.SerializeToString()
+    return models.MediaSearchResponse(
+        status="success",
+        total=len(unique_ids),
+        data=await get_medias_from_uniqueids(unique_ids[:params.limit])
+    )
 
-    unique_id_key = get_unique_key(unique_id)
-    imdb_key = get_imdb_key(imdb_id)
-    thash_key = get_torrent_hash_key(torrent_hash)
+async def queue_media_write(pipe, summary_proto) -> int:
+    """
+    Queues the write script of every layout written to (see KEYSPACE_SHADOW) and the media's rendered JSON (see MEDIA_JSON)
+    onto a pipeline, gives back how many commands that is. The first reply is the one that counts, the rest are only checked for errors.
+    """
+    blob = pack_media_blob(summary_proto.SerializeToString())
+    for write_layout in write_layouts:
+        await write_layout.queue_write(pipe, summary_proto, blob)
 
-    #pipe = redis_client.pipeline()
-    pipe = redis_client # Dont need a pipeline for now
-    await pipe.set(unique_id_key, serialized_data)
-    await pipe.hset(thash_key, str(torrent_file_index), unique_id)#await pipe.set(thash_key, unique_id)
-    await pipe.sadd(imdb_key, unique_id) # might not be able to do always
-    #pipe.execute()
+    # Rendered JSON is replaced or dropped whatever MEDIA_JSON is, so turning it back on never serves JSON older than the media
+    json_key = get_media_json_key(summary_proto.unique_id, MEDIA_JSON_VERSION)
+    if MEDIA_JSON == "write":
+        with stage("serialize"):
+            media_json = utils.omnistream_proto_summary_to_model(summary_proto).model_dump_json()
+        await queue_media_json_store(pipe, layout, summary_proto.unique_id, blob, json_key, media_json, MEDIA_JSON_TTL)
+    else:
+        pipe.delete(json_key)
+    return len(write_layouts) + 1
 
-    response = models.CreateMediaResponse(
+def media_write_response(summary_proto) -> models.CreateMediaResponse:
+    return models.CreateMediaResponse(
         status="success",
-        unique_id=unique_id,
-        imdb_id=imdb_id,
-        torrent_hash=torrent_hash,
-        index=torrent_file_index
+        unique_id=summary_proto.unique_id,
+        imdb_id=summary_proto.imdb_id,
+        torrent_hash=summary_proto.torrent_hash,
+        index=summary_proto.torrent_file_index
     )
 
+async def queue_media_summary(pipe, pending: List[int], position: int, summary_proto) -> models.CreateMediaResponse:
+    """
+    Adds the write script for one media summary onto a pipeline.
+    Nothing is sent until the pipeline is executed, flush_media_pipeline invalidates the cache and fills in what changed.
+    pending gets the result's position once for every reply the write will have.
+    """
+
+    pending.extend([position] * await queue_media_write(pipe, summary_proto))
+    return media_write_response(summary_proto)
+
+@redischeck()
+async def write_media_summary(summary_proto) -> models.CreateMediaResponse:
+    """
+    Writes one media summary on its own, a single round trip to its shard.
+    """
+
+    pipe = get_shard(summary_proto.unique_id).pipeline(transaction=False)
+    await queue_media_write(pipe, summary_proto)
+    queue_media_invalidation(pipe, summary_proto.unique_id)
+    change, *_ = await pipe.execute()
+
+    response = media_write_response(summary_proto)
+    response.change = models.MediaChange(change.decode("utf-8"))
+
+    pipes = {}
+    await queue_torrent_releases(pipes, [response])
+    await asyncio.gather(*[pipe.execute() for pipe, _ in pipes.values()])
     return response
 
+@redischeck()
+async def create_media_summary_from_mediainfo(json_media):
+    """
+    Creates a new media summary from mediainfo json in the Redis database.
+    """
+
+    summary_proto = OmnistreamProtoSummary.FromString(
+        await run_parser(utils.parse_mediainfo_export_to_proto_bytes, json_media)
+    )
+
+    return await write_media_summary(summary_proto)
+
 # These two are the same thing just with different functions at the top
 # Can they be combined?
 # The top one doesn't really work correctly cause there is no imdb or torrent hash so when it adds to dragondb
 # The key is just "" which will confuse later on
 # so either clients need to add those and i need to update the models or it stores it without those
 # I think people should be able to do both with the uniqueid serving as the real antiduplicate
-# And i need to add antidupe checking
 
 
 @redischeck()
@@ -187,51 +734,276 @@ async def create_media_summary_from_tracker(json_media):
     """
 
     try:
-        summary_proto = utils.parse_tracker_json_to_proto(json_media)
-
-        unique_id = summary_proto.unique_id
-        imdb_id = summary_proto.imdb_id
-        torrent_hash = summary_proto.torrent_hash
-        torrent_file_index = summary_proto.torrent_file_index
-
-        serialized_data = summary_proto.SerializeToString()
+        summary_proto, = await parse_tracker_jsons([json_media])
+        if isinstance(summary_proto, Exception):
+            raise summary_proto
 
-        unique_id_key = get_unique_key(unique_id)
-        imdb_key = get_imdb_key(imdb_id)
-        thash_key = get_torrent_hash_key(torrent_hash)
-
-        #pipe = redis_client.pipeline()
-        pipe = redis_client # Dont need a pipeline for now
-        await pipe.set(unique_id_key, serialized_data)
-        await pipe.hset(thash_key, str(torrent_file_index), unique_id)#await pipe.set(thash_key, unique_id)
-        await pipe.sadd(imdb_key, unique_id) # might not be able to do always
-        #pipe.execute()
-
-        response = models.CreateMediaResponse(
-            status="success",
-            unique_id=unique_id,
-            imdb_id=imdb_id,
-            torrent_hash=torrent_hash,
-            index=torrent_file_index
-        )
+        response = await write_media_summary(summary_proto)
+    except (ParseQueueFull, ParseTimeout, RedisConnectionError, RedisTimeoutError):
+        raise # Overload and outages aren't the upload's fault, they get their 503/504/500 (and ingest jobs a retry)
     except Exception as e:
         print(e)
         response = models.CreateMediaResponse(
             status="failed",
-            unique_id=unique_id,
-            imdb_id=imdb_id,
-            torrent_hash=torrent_hash,
-            index=torrent_file_index
+            unique_id="",
+            torrent_hash=utils.tracker_torrent_hash(json_media.attributes.info_hash),
+            error=str(e)
         )
 
     return response
 
+def get_media_pipeline(pipes: dict, unique_id) -> tuple:
+    """
+    (pipeline, pending result positions) of a bulk write for the shard unique_id lives on, made on first use.
+    """
+    return get_shard_pipeline(pipes, get_shard_index(unique_id))
+
+def get_shard_pipeline(pipes: dict, shard: int) -> tuple:
+    if shard not in pipes:
+        pipes[shard] = (get_shards()[shard].pipeline(transaction=False), [])
+    return pipes[shard]
+
+async def queue_torrent_releases(pipes: dict, written: List[models.CreateMediaResponse]):
+    """
+    Queues RELEASE_TORRENT_FILE_LUA for the written medias' torrent files on every shard but their own,
+    so a file that got a media on another shard doesn't keep pointing at the old one. Nothing to do with a single shard.
+    Their pending positions are None, replies that aren't any item's.
+    """
+    shards = len(get_shards())
+    if shards < 2:
+        return
+    for shard in range(shards):
+        pipe, pending = get_shard_pipeline(pipes, shard)
+        for response in written:
+            if get_shard_index(response.unique_id) == shard:
+                continue
+            for write_layout in write_layouts:
+                await write_layout.queue_torrent_release(pipe, response.torrent_hash or "", response.index or 0, response.unique_id)
+                pending.append(None)
+
+async def flush_media_pipelines(pipes: dict, results: List[models.CreateMediaResponse]):
+    """
+    Executes every shard's bulk pipeline at once (with the torrent file releases of what they write) and starts over with none.
+    """
+    await queue_torrent_releases(pipes, [results[i] for _, pending in list(pipes.values()) for i in dict.fromkeys(pending)])
+    await asyncio.gather(*[flush_media_pipeline(pipe, results, pending) for pipe, pending in pipes.values()])
+    pipes.clear()
+
+async def flush_media_pipeline(pipe, results: List[models.CreateMediaResponse], pending: List[int]):
+    """
+    Executes a bulk pipeline of write scripts and fills in what each waiting item did.
+    Items whose script errored, or all of them if the pipeline blows up, are marked as failed.
+    With a shadow layout an item has several replies in a row, what changed comes from its first.
+    The whole pipeline's media are invalidated at once, with one publish at its end.
+    """
+    unique_ids = [results[i].unique_id for i in dict.fromkeys(pending) if i is not None]
+    pending.extend([None] * queue_media_invalidation(pipe, *unique_ids))
+    try:
+        replies = await pipe.execute(raise_on_error=False)
+    except Exception as e:
+        print(e)
+        replies = [e] * len(pending)
+
+    previous = None
+    for i, reply in zip(pending, replies):
+        if i is None:
+            if isinstance(reply, Exception):
+                print(f"Releasing a torrent file entry or publishing the invalidation failed: {reply}")
+            continue
+        if isinstance(reply, Exception):
+            results[i].status = models.JobStatus.FAILED
+            results[i].error = str(reply)
+        elif i != previous:
+            results[i].change = models.MediaChange(reply.decode("utf-8"))
+        previous = i
+
+def get_parse_cache_key(media_fingerprint: str) -> str:
+    return f"parsecache:{PARSE_CACHE_VERSION}:{media_fingerprint}"
+
+async def get_cached_media_infos(fingerprints: List[str]) -> List:
+    """
+    Parse cache entries (serialized MediaInfo halves, see utils.parse_media_info_to_proto) of the fingerprints, None for misses.
+    One MGET per shard, a cache that can't be reached is all misses.
+    """
+    if not PARSE_CACHE_TTL:
+        return [None] * len(fingerprints)
+
+    found = {}
+    async def mget(shard: int, shard_fingerprints: List[str]):
+        keys = [get_parse_cache_key(media_fingerprint) for media_fingerprint in shard_fingerprints]
+        found.update(zip(shard_fingerprints, await run_read(shard, lambda client: client.mget(keys))))
+
+    try:
+        await asyncio.gather(*[mget(shard, shard_fingerprints) for shard, shard_fingerprints in group_by_shard(set(fingerprints)).items()])
+    except Exception as e:
+        print(f"Parse cache read failed: {e}")
+    cached = [found.get(media_fingerprint) for media_fingerprint in fingerprints]
+    hits = sum(1 for data in cached if data is not None)
+    PARSE_CACHE.inc(hits, "hit")
+    PARSE_CACHE.inc(len(cached) - hits, "miss")
+    return cached
+
+async def cache_media_infos(parsed: dict):
+    """
+    Stores {fingerprint: serialized MediaInfo half} in the parse cache, a pipeline per shard.
+    """
+    if not PARSE_CACHE_TTL or not parsed:
+        return
+
+    async def store(shard: int, shard_fingerprints: List[str]):
+        pipe = get_shards()[shard].pipeline(transaction=False)
+        for media_fingerprint in shard_fingerprints:
+            pipe.set(get_parse_cache_key(media_fingerprint), parsed[media_fingerprint], ex=PARSE_CACHE_TTL)
+        await pipe.execute()
+
+    try:
+        await asyncio.gather(*[store(shard, shard_fingerprints) for shard, shard_fingerprints in group_by_shard(parsed).items()])
+    except Exception as e:
+        print(f"Parse cache write failed: {e}")
+
+async def parse_tracker_jsons(torrents: List) -> List:
+    """
+    Parses validated tracker json, gives back an OmnistreamProtoSummary or the exception for each torrent, in order.
+    Torrents that already failed are passed in as their exception.
+
+    Only the torrent's MediaInfo report takes any parsing and it's the same across re-scrapes and cross-seeds,
+    so reports are looked up in the parse cache by their fingerprint first and only the misses go to the parse executor.
+    """
+    fingerprints = [
+        None if isinstance(torrent, Exception) else utils.fingerprint_media_info(torrent.attributes.media_info)
+        for torrent in torrents
+    ]
+    cached = iter(await get_cached_media_infos([fingerprint for fingerprint, _ in filter(None, fingerprints)]))
+    cached = [None if fingerprint is None else next(cached) for fingerprint in fingerprints]
+    parsed = {}
+
+    async def parse(torrent, fingerprint, data):
+        if isinstance(torrent, Exception):
+            raise torrent
+        media_fingerprint, filename = fingerprint
+        if data is None:
+            data = await run_parser(utils.parse_media_info_to_proto_bytes, torrent.attributes.media_info, media_fingerprint)
+            parsed[media_fingerprint] = data
+        with stage("proto_build"):
+            return utils.merge_tracker_proto(torrent, OmnistreamProtoSummary.FromString(data), filename)
+
+    results = await asyncio.gather(*[parse(*item) for item in zip(torrents, fingerprints, cached)], return_exceptions=True)
+    await cache_media_infos(parsed)
+    return results
+
+async def parse_tracker_batch(documents: List[dict]) -> List:
+    """
+    Validates and parses a batch of tracker json, see parse_tracker_jsons.
+    Documents that already failed to decode are passed in as their exception.
+    """
+    torrents = []
+    for document in documents:
+        if isinstance(document, Exception):
+            torrents.append(document)
+            continue
+        try:
+            with stage("validate"):
+                torrents.append(models.Unit3dTorrent.model_validate(document))
+        except ValueError as e:
+            torrents.append(e)
+    return await parse_tracker_jsons(torrents)
+
 @redischeck()
-async def remove_media(unique_id: str, thash_key: str, index: int, imdb_key: str):
-    pipe = await redis_client.pipeline()
-    pipe.delete(get_unique_key(unique_id))
-    pipe.hdel(thash_key, index)
-    pipe.srem(imdb_key, unique_id)
+async def create_media_summaries_from_tracker(byte_stream, progress=None) -> models.BulkCreateMediaResponse:
+    """
+    Creates media summaries from a NDJSON or JSON array stream of tracker json.
+    Items are parsed on the parse executor as they come in and the writes go out in pipelines of BULK_BATCH_SIZE.
+    progress is awaited with the results so far after every batch (ingest jobs report it).
+    """
+
+    results = []
+    documents = []
+    pipes = {}
+
+    async def flush():
+        for parsed in await parse_tracker_batch(documents):
+            if isinstance(parsed, Exception):
+                results.append(models.CreateMediaResponse(
+                    status="failed",
+                    unique_id="",
+                    error=str(parsed)
+                ))
+                continue
+            pipe, pending = get_media_pipeline(pipes, parsed.unique_id)
+            results.append(await queue_media_summary(pipe, pending, len(results), parsed))
+        documents.clear()
+        await flush_media_pipelines(pipes, results)
+        if progress is not None:
+            await progress(results)
+
+    async for document, error in utils.iter_json_documents(byte_stream):
+        documents.append(document if error is None else error)
+
+        if len(documents) >= BULK_BATCH_SIZE:
+            await flush()
+
+    if documents:
+        await flush()
+
+    failed = sum(1 for result in results if result.status == models.JobStatus.FAILED)
+
+    return models.BulkCreateMediaResponse(
+        status="failed" if results and failed == len(results) else "success",
+        total=len(results),
+        failed=failed,
+        data=results
+    )
+
+@redischeck()
+async def create_media_summaries_from_protos(summaries) -> models.BulkCreateMediaResponse:
+    """
+    Stores already built summaries from an async iterable of OmnistreamProtoSummary (gRPC ingest).
+    Writes go out in pipelines of BULK_BATCH_SIZE, same as the http bulk upload.
+    """
+
+    results = []
+    pipes = {}
+    queued = 0
+
+    async for summary_proto in summaries:
+        if not summary_proto.unique_id:
+            results.append(models.CreateMediaResponse(
+                status="failed",
+                unique_id="",
+                torrent_hash=summary_proto.torrent_hash,
+                error="Summary has no unique_id."
+            ))
+            continue
+
+        pipe, pending = get_media_pipeline(pipes, summary_proto.unique_id)
+        results.append(await queue_media_summary(pipe, pending, len(results), summary_proto))
+        queued += 1
+
+        if queued >= BULK_BATCH_SIZE:
+            await flush_media_pipelines(pipes, results)
+            queued = 0
+
+    await flush_media_pipelines(pipes, results)
+
+    failed = sum(1 for result in results if result.status == models.JobStatus.FAILED)
+
+    return models.BulkCreateMediaResponse(
+        status="failed" if results and failed == len(results) else "success",
+        total=len(results),
+        failed=failed,
+        data=results
+    )
+
+async def queue_media_removal(pipe, unique_id: str, thash: str, index: int, imdb_id: str):
+    for write_layout in write_layouts:
+        await write_layout.queue_removal(pipe, unique_id, thash, index, imdb_id)
+    pipe.delete(get_media_json_key(unique_id, MEDIA_JSON_VERSION))
+
+@redischeck()
+async def remove_media(unique_id: str, thash: str, index: int, imdb_id: str):
+    pipe = get_shard(unique_id).pipeline()
+    await queue_media_removal(pipe, unique_id, thash, index, imdb_id)
+    queue_media_invalidation(pipe, unique_id)
     await pipe.execute()
 
 @redischeck()
@@ -240,12 +1012,12 @@ async def remove_media_by_uniqueid(unique_id: str):
     Removes a media summary from the Redis database by uniqueid.
     """
     
-    MediaSummary = await get_media_from_uniqueid(unique_id)
+    with primary_reads():
+        MediaSummary = await get_media_from_uniqueid(unique_id)
+    if MediaSummary is None:
+        return
 
-    thash_key = get_torrent_hash_key(MediaSummary["torrent_hash"])
-    imdb_key = get_imdb_key(MediaSummary["imdb_id"])
-
-    await remove_media(unique_id, thash_key, MediaSummary["torrent_file_index"], imdb_key)
+    await remove_media(unique_id, MediaSummary.torrent_hash or "", MediaSummary.torrent_file_index or 0, MediaSummary.imdb_id or "")
 
 @redischeck()
 async def remove_media_from_torrent_index(thash: str, index: int):
@@ -253,12 +1025,12 @@ async def remove_media_from_torrent_index(thash: str, index: int):
     Removes a media summary from the Redis database by torrent hash and index.
     """
     
-    MediaSummary = await get_media_from_torrent_index(thash, index)
-
-    thash_key = get_torrent_hash_key(thash)
-    imdb_key = get_imdb_key(MediaSummary["imdb_id"])
+    with primary_reads():
+        MediaSummary = await get_media_from_torrent_index(thash, str(index))
+    if MediaSummary is None:
+        return
 
-    await remove_media(MediaSummary["unique_id"], thash_key, index, imdb_key)
+    await remove_media(MediaSummary.unique_id, thash, index, MediaSummary.imdb_id or "")
 
 @redischeck()
 async def remove_medias_from_torrent_hash(thash: str):
@@ -266,25 +1038,28 @@ async def remove_medias_from_torrent_hash(thash: str):
     Removes an entire torrent of media summaries from the Redis database by torrent hash.
     """
 
-    unique_ids = await get_unique_ids_from_torrent_hash(thash)
-
-    MediaSummaries = await get_medias_from_uniqueids(unique_ids)
+    with primary_reads():
+        unique_ids = [get_unique_id(unique_id) for unique_id in await get_unique_ids_from_torrent_hash(thash)]
+        MediaSummaries = await get_medias_from_uniqueids(unique_ids)
 
-    imdb_keys_uniqueid = {}
+    MediaSummaries = {MediaSummary.unique_id: MediaSummary for MediaSummary in MediaSummaries}
 
-    # Batch unique ids by imdb
-    for MediaSummary in MediaSummaries:
-        if not imdb_keys_uniqueid.get(MediaSummary["imdb_id"]):
-            imdb_keys_uniqueid.update({MediaSummary["imdb_id"]:[]})
-        imdb_keys_uniqueid[MediaSummary["imdb_id"]].append(MediaSummary["unique_id"])
-
-    # W speed up by batching srem calls by imdb instead of calling it for every unique id even if they had the same imdb
-
-    pipe = await redis_client.pipeline()
-    pipe.delete(*[get_unique_key(unique_id) for unique_id in unique_ids], get_torrent_hash_key(thash))
-    for imdb_key,unique_ids in enumerate(imdb_keys_uniqueid):
-        pipe.srem(get_imdb_key(imdb_key), *unique_ids)
-    await pipe.execute()
+    # Every shard holding part of the torrent drops its own part, each media takes its search index entries with it
+    shards = get_shards()
+    pipes = []
+    for shard, shard_unique_ids in group_by_shard(unique_ids).items():
+        pipe = shards[shard].pipeline()
+        for unique_id in shard_unique_ids:
+            MediaSummary = MediaSummaries.get(unique_id)
+            if MediaSummary is None:
+                await queue_media_removal(pipe, unique_id, thash, 0, "")
+                continue
+            await queue_media_removal(pipe, unique_id, thash, MediaSummary.torrent_file_index, MediaSummary.imdb_id or "")
+        for write_layout in write_layouts:
+            write_layout.queue_torrent_removal(pipe, thash)
+        queue_media_invalidation(pipe, *shard_unique_ids)
+        pipes.append(pipe)
+    await asyncio.gather(*[pipe.execute() for pipe in pipes])
 
 @redischeck()
 async def remove_medias_from_imdb(imdb: str):
@@ -1,9 +1,12 @@
 import re
+import json
+import codecs
 from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
 from google.protobuf.json_format import MessageToDict
 from app.core.database import redis_client
+from app.core.metrics import stage
 from .models import *
-import uuid
+import hashlib
 from functools import wraps # W Wraps?
 import os
 
@@ -19,6 +22,78 @@ def omnistream_proto_summary_to_dict(media_proto: OmnistreamProtoSummary) -> Omn
         print(f"Validation Error: {e}")
         return {"errors": True}
 
+def model_field_defaults(model, skip: tuple = ()) -> tuple:
+    """
+    (field name, default) for every field of a model that mirrors a proto message one to one.
+    """
+    return tuple(
+        (name, field.get_default(call_default_factory=True))
+        for name, field in model.model_fields.items() if name not in skip
+    )
+
+OMNISTREAM_TRACK_FIELDS = ("video_tracks", "audio_tracks", "subtitle_tracks")
+OMNISTREAM_METADATA_FIELDS = model_field_defaults(OmnistreamMetadata, skip=OMNISTREAM_TRACK_FIELDS)
+OMNISTREAM_VIDEO_FIELDS = model_field_defaults(OmnistreamVideo)
+OMNISTREAM_AUDIO_FIELDS = model_field_defaults(OmnistreamAudio)
+OMNISTREAM_SUBTITLE_FIELDS = model_field_defaults(OmnistreamSubtitle)
+
+def proto_to_values(message, fields: tuple) -> dict:
+    """
+    Reads a proto message into a dict of model fields.
+    Proto3 scalars that are still at their zero value fall back to the model default, same as MessageToDict dropping them.
+    """
+    return {name: getattr(message, name) or default for name, default in fields}
+
+def omnistream_proto_summary_to_model(media_proto: OmnistreamProtoSummary) -> OmnistreamMetadata:
+    """
+    Fast version of omnistream_proto_summary_to_dict, gives the same model.
+    MessageToDict is the slow part (json style conversion of every field in python) so the dict is built straight off the proto instead.
+    model_validate stays because pydantic-core checking a flat dict is quicker than model_construct'ing every track in python.
+    """
+    values = proto_to_values(media_proto, OMNISTREAM_METADATA_FIELDS)
+    values["video_tracks"] = [proto_to_values(track, OMNISTREAM_VIDEO_FIELDS) for track in media_proto.video_tracks]
+    values["audio_tracks"] = [proto_to_values(track, OMNISTREAM_AUDIO_FIELDS) for track in media_proto.audio_tracks]
+    values["subtitle_tracks"] = [proto_to_values(track, OMNISTREAM_SUBTITLE_FIELDS) for track in media_proto.subtitle_tracks]
+    return OmnistreamMetadata.model_validate(values)
+
+def resolution_bucket(width: int, height: int) -> str:
+    """
+    Scene style resolution of a video track, width first so cropped scope releases (3840x1600) still count as 2160p.
+    """
+    if width >= 3200 or height >= 2000:
+        return "2160p"
+    if width >= 1800 or height >= 1000:
+        return "1080p"
+    if width >= 1200 or height >= 700:
+        return "720p"
+    if height >= 540:
+        return "576p"
+    if height:
+        return "480p"
+    return ""
+
+def normalize_index_value(value: str) -> str:
+    return (value or "").strip().lower()
+
+def media_index_values(media_proto: OmnistreamProtoSummary) -> dict:
+    """
+    {attribute: set of values} a summary gets filed under in the search indexes, lowercased.
+    Track attributes are merged over all the tracks, so "atmos" + "7.1" doesn't have to be the same track.
+    """
+    values = {
+        "resolution": {resolution_bucket(track.width, track.height) for track in media_proto.video_tracks},
+        "hdr": {feature for track in media_proto.video_tracks for feature in track.hdr.split(",")},
+        "audio": {track.format_tag for track in media_proto.audio_tracks},
+        "channels": {track.channels_tag for track in media_proto.audio_tracks},
+        "subtitle": {track.language for track in media_proto.subtitle_tracks},
+        "quality": {media_proto.quality},
+        "container": {media_proto.container},
+    }
+    return {
+        attribute: {normalize_index_value(value) for value in attribute_values} - {""}
+        for attribute, attribute_values in values.items()
+    }
+
 def parse_mediainfo_export_to_proto(source: dict) -> OmnistreamProtoSummary:
     summary = OmnistreamProtoSummary(
         mediainfo_version=source.creating_library.version
@@ -28,7 +103,7 @@ def parse_mediainfo_export_to_proto(source: dict) -> OmnistreamProtoSummary:
         
         # --- GENERAL TRACK ---
         if isinstance(track, GeneralTrackExport):
-            summary.unique_id = track.unique_id
+            summary.unique_id = track.unique_id or fingerprint_mediainfo_export(source)
             summary.container = track.file_extension
             summary.size = track.file_size
             
@@ -43,58 +118,64 @@ def parse_mediainfo_export_to_proto(source: dict) -> OmnistreamProtoSummary:
             if track.multiview_count and track.multiview_count != "1":
                 is_3d = True
 
-            vid_sum = OmnistreamVideo(
+            summary.video_tracks.add(
                 codec=track.format,
                 bit_depth=track.bit_depth,
                 width=track.width,
                 height=track.height,
                 hdr=parse_hdr_features(track),
                 is_3d=is_3d,
-                source=track.source or track.title
+                source=track.title or ""
             )
-            summary.video_tracks.append(vid_sum)
 
         # --- AUDIO TRACK ---
         elif isinstance(track, AudioTrackExport):
             is_commentary = False
             is_descriptive = False
             
-            combined_desc = f"{track.source or ''} {track.title or ''}".lower()
+            combined_desc = (track.title or "").lower()
             
             if "commentary" in combined_desc:
                 is_commentary = True
             if "descriptive" in combined_desc or "sdh" in combined_desc:
                 is_descriptive = True
 
-            aud_sum = OmnistreamAudio(
-                language=track.language,
+            summary.audio_tracks.add(
+                language=track.language or "",
                 format_tag=track.format,
                 channels_tag=parse_channel_layout(track.channel_layout, track.channels),
                 is_commentary=is_commentary,
                 is_descriptive=is_descriptive,
-                source=track.source or track.title
+                source=track.title or ""
             )
-            summary.audio_tracks.append(aud_sum)
 
         # --- SUBTITLE TRACK ---
         elif isinstance(track, TextTrackExport):
             is_sdh = False
-            combined_desc = f"{track.source or ''} {track.title or ''}".lower()
+            combined_desc = (track.title or "").lower()
             
             if "sdh" in combined_desc or (track.language and "sdh" in track.language.lower()):
                 is_sdh = True
 
-            sub_sum = OmnistreamSubtitle(
-                language=track.language,
+            summary.subtitle_tracks.add(
+                language=track.language or "",
                 format=track.format,
                 is_sdh=is_sdh,
-                source=track.source or track.title
+                source=track.title or ""
             )
-            summary.subtitle_tracks.append(sub_sum)
 
 
     return summary
 
+def parse_mediainfo_export_to_proto_bytes(source: MediaInfoExport) -> bytes:
+    """
+    parse_mediainfo_export_to_proto for the parse executor, hands back the serialized proto so only bytes cross back over.
+    """
+    with stage("proto_build"):
+        summary = parse_mediainfo_export_to_proto(source)
+    with stage("serialize"):
+        return summary.SerializeToString()
+
 def parse_channel_layout(layout: str, channel_count: int | str) -> str:
     """
     Calculates audio configuration from ChannelLayout string.
@@ -141,11 +222,18 @@ def parse_hdr_features(track: VideoTrackExport) -> str:
     Analyzes a VideoTrack to determine HDR capabilities.
     Checks Format, Compatibility, and Transfer Characteristics.
     """
+    return parse_hdr_strings(track.hdr_format, track.hdr_format_compatibility, track.transfer_characteristics)
+
+def parse_hdr_strings(hdr_format: str, hdr_compat: str = "", transfer: str = "") -> str:
+    """
+    Same as parse_hdr_features but from the raw strings.
+    The MediaInfo text report puts the compatibility inside "HDR format" so it can be left empty.
+    """
     features = set()
     
-    hdr_format = (track.hdr_format or "").strip()
-    hdr_compat = (track.hdr_format_compatibility or "").strip()
-    transfer = (track.transfer_characteristics or "").strip()
+    hdr_format = (hdr_format or "").strip()
+    hdr_compat = (hdr_compat or "").strip()
+    transfer = (transfer or "").strip()
     
     full_string = f"{hdr_format} {hdr_compat}"
 
@@ -185,69 +273,217 @@ def parse_hdr_features(track: VideoTrackExport) -> str:
 
     return ", ".join(sorted(list(features)))
 
-def parse_tracker_json_to_proto(tracker_json: Unit3dTorrent) -> OmnistreamProtoSummary:
-    mediainfo_dict = parse_mediainfo_text_to_dict(tracker_json.attributes.media_info)
-    if mediainfo_dict.get("errors"):
-        return {"errors":True}
-    #print(mediainfo_dict)
-    tracker_proto = tracker_dict_to_proto(tracker_json, mediainfo_dict["General"]["Complete name"])
-    mediainfo_proto = mediainfo_dict_to_proto(mediainfo_dict)
+def parse_media_info_to_proto(media_text: str, media_fingerprint: str) -> OmnistreamProtoSummary:
+    """
+    The MediaInfo half of a tracker upload, it only depends on the report so it's what the parse cache keeps.
+    merge_tracker_proto puts the torrent's half on top.
+    """
+    with stage("parse"):
+        mediainfo_dict = parse_mediainfo_text_to_dict(media_text)
+    if mediainfo_dict.get("errors") or "General" not in mediainfo_dict:
+        raise ValueError("Could not parse the media_info text of the torrent.")
+    with stage("proto_build"):
+        return mediainfo_dict_to_proto(mediainfo_dict, media_fingerprint)
+
+def parse_media_info_to_proto_bytes(media_text: str, media_fingerprint: str) -> bytes:
+    """
+    parse_media_info_to_proto for the parse executor, same deal as parse_mediainfo_export_to_proto_bytes.
+    """
+    mediainfo_proto = parse_media_info_to_proto(media_text, media_fingerprint)
+    with stage("serialize"):
+        return mediainfo_proto.SerializeToString()
+
+def merge_tracker_proto(tracker_json: Unit3dTorrent, mediainfo_proto: OmnistreamProtoSummary, filename: str = None) -> OmnistreamProtoSummary:
+    tracker_proto = tracker_dict_to_proto(tracker_json, filename)
     finalproto = OmnistreamProtoSummary()
     finalproto.MergeFrom(tracker_proto)
     finalproto.MergeFrom(mediainfo_proto)
     return finalproto
 
+def parse_tracker_json_to_proto(tracker_json: Unit3dTorrent) -> OmnistreamProtoSummary:
+    media_fingerprint, filename = fingerprint_media_info(tracker_json.attributes.media_info)
+    mediainfo_proto = parse_media_info_to_proto(tracker_json.attributes.media_info, media_fingerprint)
+    with stage("proto_build"):
+        return merge_tracker_proto(tracker_json, mediainfo_proto, filename)
+
+def parse_tracker_json_to_proto_bytes(tracker_json: Unit3dTorrent) -> bytes:
+    """
+    parse_tracker_json_to_proto for the parse executor, same deal as parse_mediainfo_export_to_proto_bytes.
+    """
+    summary = parse_tracker_json_to_proto(tracker_json)
+    with stage("serialize"):
+        return summary.SerializeToString()
+
+MEDIAINFO_COMPLETE_NAME = re.compile(r"^Complete name *: (.*)$", re.M)
+MEDIAINFO_TRAILING_SPACE = re.compile(r"[ \t]+$", re.M)
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def encode_message_fields(field_number: int, messages: list) -> bytes:
+    """
+    Serialized messages as entries of a repeated message field (tag, length, message each), what the field looks like on the wire.
+    Appending it to a serialized message is the same as adding the messages to the field, nothing gets decoded.
+    """
+    tag = encode_varint(field_number << 3 | 2)
+    return b"".join(tag + encode_varint(len(message)) + message for message in messages)
+
+def blob_digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+def lookup_etag(representation: str, next_cursor, parts: list) -> str:
+    """
+    Strong ETag of a lookup response put together out of parts (stored blob digests or media JSON, in response order).
+    Changes whenever a part, their order, the next cursor or the representation does.
+    """
+    digest = hashlib.blake2b(f"{representation}:{next_cursor or ''}".encode("utf-8"), digest_size=16)
+    for part in parts:
+        digest.update(len(part).to_bytes(4, "big"))
+        digest.update(part)
+    return f'"{digest.hexdigest()}"'
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """
+    If-None-Match check, weak comparison like RFC 9110 says so a W/ tag a proxy handed out still matches.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def model_schema_version(model) -> str:
+    """
+    Hash of a model's JSON schema, changes whenever a field is added, removed, renamed or retyped.
+    """
+    return fingerprint(json.dumps(model.model_json_schema(), sort_keys=True))[:8]
+
+def file_name(path: str) -> str:
+    """
+    Last part of a path, MediaInfo reports them with either kind of slash.
+    """
+    return re.split(r"[\\/]", path)[-1]
+
+def fingerprint_media_info(media_text: str) -> tuple:
+    """
+    (fingerprint, Complete name or None) of a MediaInfo text report.
+    The fingerprint is a hash of the report with line endings, trailing whitespace and the Complete name line left out,
+    plus the file's name out of Complete name. Re-scrapes and cross-seeds of the same file (which only differ in the
+    directories of its path) get the same one, two files whose reports match otherwise (no Unique ID, same size and
+    streams) don't, they'd end up as one record.
+    It's the unique_id of reports without a Unique ID and the parse cache's key.
+    """
+    media_text = media_text.replace("\r", "")
+    match = MEDIAINFO_COMPLETE_NAME.search(media_text)
+    name = ""
+    if match:
+        media_text = media_text[:match.start()] + media_text[match.end():]
+        name = file_name(match.group(1).strip())
+    return fingerprint(f"{name}\n{MEDIAINFO_TRAILING_SPACE.sub('', media_text).strip()}"), match.group(1) if match else None
+
+def fingerprint_mediainfo_export(source: MediaInfoExport) -> str:
+    """
+    Same idea for a MediaInfo JSON export without a UniqueID, its tracks and the file's name, minus the rest of its path.
+    """
+    return fingerprint(f"{file_name(source.media.ref or '')}\n{source.media.model_dump_json(exclude={'ref'})}")
+
+# MediaInfo text report patterns, compiled once.
+# Streams are separated by blank ("" or " ") lines, a line is "<key><dots/spaces>: <value>" with the key's leading dots/spaces dropped.
+MEDIAINFO_KEY_SPLIT = re.compile(r'(?:[\\. ]+:? |[\\. ]*: )')
+
+MEDIAINFO_KEYS = {} # Everything before a line's first ": " -> its key, reports are padded the same way so these repeat a lot
+MEDIAINFO_KEYS_MAX = 4096 # Past this new ones go through the regex every time, a report only has a few dozen
+
+def mediainfo_key(raw: str):
+    """
+    The key MEDIAINFO_KEY_SPLIT gives for "<raw>: <value>", or None when that depends on more than raw.
+
+    Once the leading dots/spaces and the padding are off, a key without a dot, backslash or space that could start
+    a separator (one followed by a space, or at the end) can only be split at the ": " after it.
+    """
+    key = raw.lstrip("\\. ").rstrip(" ")
+    if key.endswith((".", "\\")) or "  " in key or ". " in key or "\\ " in key:
+        return None
+    return key
+
+def split_mediainfo_line(line: str) -> tuple:
+    """
+    Splits one report line into (key, value), either can come back empty, and remembers the key in MEDIAINFO_KEYS
+    when it only depends on what's before the ": ".
+    Never for "" or " " or "Conformance errors" though, the scanner needs those to miss so it sees the blank lines
+    between streams and where the errors start.
+    """
+    raw, sep, value = line.partition(": ")
+    if sep and (key := mediainfo_key(raw)) is not None:
+        if len(MEDIAINFO_KEYS) < MEDIAINFO_KEYS_MAX and raw != "" and raw != " " and key != "Conformance errors":
+            MEDIAINFO_KEYS[raw] = key
+        return key, value
+    line = line.lstrip("\\. ")
+    match = MEDIAINFO_KEY_SPLIT.search(line)
+    if match is None:
+        return "", ""
+    return line[:match.start()], line[match.end():]
 
 def parse_mediainfo_text_to_dict(media_text: str) -> dict:
-    removewhitespace = re.compile(r'^[\\. ]+')
-    splitdict = re.compile(r'(?:[\\. ]+:? |[\\. ]*: )')
+    """
+    Parses a MediaInfo text report into {"General": {...}, "Video": [{...}], "Audio": [...], ...}.
+    Repeated streams ("Audio #2") are grouped into the list of their type,
+    every line after "Conformance errors" gets nested under "Errors" and lines without both a key and a value are skipped.
+
+    One pass over the lines: the outer loop takes a stream's first line as its id, the inner one fills its dict
+    until a blank line. Each line is partitioned once and its key looked up in MEDIAINFO_KEYS,
+    only lines never seen before go through split_mediainfo_line.
+    """
     try:
         torrentinfo = {}
-        for stream in re.split('\n ?\n',media_text.replace("\r", "")):
-            text = stream.split("\n")
-            id = text.pop(0)
+        known_key = MEDIAINFO_KEYS.get
+        lines = iter(media_text.replace("\r", "").split("\n"))
+        for id in lines:
+            info = section = {}
             if id[:6] == "Report":
-                torrentinfo.update({"Report":re.split(splitdict,id)[1]})
-                continue
-            ogid = id
-            if id.find(" #"):
-                id = id.split(" #")[0]
-            if not torrentinfo.get(id):
-                torrentinfo.update({id:[]})
-            info = []
-            ConformanceInfo = [False,0]
-            for value in text:
-                newvalue = re.split(removewhitespace,value,maxsplit=1).pop()
-                dictparts = re.split(splitdict,newvalue,maxsplit=1)
-                if '' in dictparts:
-                    keypart = f"key: {dictparts[0]}"
-                    if dictparts[0] == '':
-                        keypart = ''
-                    print(f"Dict is missing part! torrent:  id: {ogid}" + keypart)
-                    continue
-                if len(dictparts) != 2:
-                    print(f"Dict doesn't have exactly key and value! torrent:  id: {ogid} key: {dictparts[0]}")
-                    continue
-                if dictparts[0] == "Conformance errors":
-                    ConformanceInfo[0] = True
-                    ConformanceInfo[1] = len(info)
-                    dictparts = ['Errors', dict([dictparts])]
-                    info.append(dictparts)
-                    continue
-                if ConformanceInfo[0] == True:
-                    info[ConformanceInfo[1]][1].update(dict([dictparts]))
-                    continue
-                info.append(dictparts)
-            if id == "General":
-                torrentinfo.update({id:dict(info)})
-                continue
-            torrentinfo[id].append(dict(info))
+                # What's between the first two separators, the rest of the Report stream is parsed into info and dropped
+                key, value = split_mediainfo_line(id)
+                torrentinfo["Report"] = MEDIAINFO_KEY_SPLIT.split(value, 1)[0] if key else MEDIAINFO_KEY_SPLIT.split(id)[1]
+            else:
+                if id[:2] != " #":
+                    id = id.partition(" #")[0]
+                if id == "General":
+                    torrentinfo[id] = info
+                else:
+                    if not torrentinfo.get(id):
+                        torrentinfo[id] = []
+                    torrentinfo[id].append(info)
+
+            for line in lines:
+                raw, _, value = line.partition(": ")
+                key = known_key(raw)
+                if key is None:
+                    if line == "" or line == " ":
+                        break
+                    key, value = split_mediainfo_line(line)
+                    if key == "Conformance errors" and value:
+                        section = {key: value}
+                        info["Errors"] = section
+                        continue
+                if key and value:
+                    section[key] = value
         return torrentinfo
-        #aitherscrapped[pagenum][torrentnum]["attributes"].update({'media_info_serialized':torrentinfo})
     except Exception as e:
         return {"errors":True}
 
-def mediainfo_dict_to_proto(mediainfo: dict) -> OmnistreamProtoSummary:
+def mediainfo_dict_to_proto(mediainfo: dict, media_fingerprint: str = "") -> OmnistreamProtoSummary:
+    """
+    media_fingerprint (see fingerprint_media_info) is the unique_id when the report has no Unique ID,
+    without one it's a hash of the parsed report.
+    """
     summary = OmnistreamProtoSummary()
 
     general = mediainfo.get("General", {})
@@ -260,7 +496,8 @@ def mediainfo_dict_to_proto(mediainfo: dict) -> OmnistreamProtoSummary:
     if match:
         summary.unique_id = match.group(1).lower()
     else:
-        summary.unique_id = uuid.uuid4().hex # Need to change to sha or smth else cause this aint gonna work fam fo shizzle city boooyyyyyy
+        general = {key: value for key, value in general.items() if key != "Complete name"}
+        summary.unique_id = media_fingerprint or fingerprint(json.dumps({**mediainfo, "General": general}, sort_keys=True))
 
     # Populate Video Tracks
     for track_dict in mediainfo.get("Video", []):
@@ -278,7 +515,7 @@ def mediainfo_dict_to_proto(mediainfo: dict) -> OmnistreamProtoSummary:
         track_proto.source = track_dict.get("Source", "")
         
         hdr_format_string = track_dict.get("HDR format", "")
-        track_proto.hdr = parse_hdr_features(hdr_format_string)
+        track_proto.hdr = parse_hdr_strings(hdr_format_string, transfer=track_dict.get("Transfer characteristics", ""))
 
     # Populate Audio Tracks
     for track_dict in mediainfo.get("Audio", []):
@@ -339,6 +576,13 @@ def mediainfo_dict_to_proto(mediainfo: dict) -> OmnistreamProtoSummary:
     return summary
 
 
+def tracker_torrent_hash(info_hash: str) -> str:
+    """
+    The torrent_hash a tracker upload is stored and looked up under, the last 32 hex characters of its info_hash
+    so it's 128 bits like a unique_id whether the tracker sends a v1 (40 chars) or v2 (64 chars) hash.
+    """
+    return info_hash[-32:]
+
 def tracker_dict_to_proto(tracker_dict: Unit3dTorrent, filename = None) -> OmnistreamProtoSummary:
     summary = OmnistreamProtoSummary()
 
@@ -348,7 +592,7 @@ def tracker_dict_to_proto(tracker_dict: Unit3dTorrent, filename = None) -> Omnis
     summary.imdb_id = f"tt{str(data.imdb_id).zfill(7)}"
     summary.tmdb_id = str(data.tmdb_id)
     summary.size = data.size
-    summary.torrent_hash = data.info_hash[-32:] # just makin up shi
+    summary.torrent_hash = tracker_torrent_hash(data.info_hash)
     summary.quality = data.type
     
     if filename:
@@ -359,6 +603,74 @@ def tracker_dict_to_proto(tracker_dict: Unit3dTorrent, filename = None) -> Omnis
 
     return summary
 
+# Longest a JSON token can get cut short without being a string ("-Infinit"), a decode error closer than this to the end
+# of what has come in so far may just be the token's end still on its way
+JSON_TOKEN_TAIL = 8
+
+async def iter_json_documents(byte_stream):
+    """
+    Incrementally decodes a request body that is either NDJSON or a JSON array of objects.
+    Yields (document, error) tuples so one bad NDJSON line doesn't kill the whole upload.
+    A broken JSON array can't be resynced so it yields the error and stops, as soon as the error shows up
+    instead of buffering (and decoding again) the rest of the body.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    is_array = None
+    finished = False
+
+    async for chunk in byte_stream:
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+
+        if is_array is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            is_array = stripped[0] == "["
+            if is_array:
+                buffer = stripped[1:]
+
+        if is_array:
+            while not finished:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buffer):
+                    break
+                if buffer[pos] == "]":
+                    finished = True
+                    break
+                try:
+                    document, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError as e:
+                    if e.msg.startswith("Unterminated string") or len(buffer) - e.pos <= JSON_TOKEN_TAIL:
+                        break # Ran off the end, wait for the next chunk
+                    yield None, e
+                    return
+                yield document, None
+        else:
+            newline = buffer.find("\n", pos)
+            while newline != -1:
+                line = buffer[pos:newline].strip()
+                pos = newline + 1
+                if line:
+                    try:
+                        yield json.loads(line), None
+                    except json.JSONDecodeError as e:
+                        yield None, e
+                newline = buffer.find("\n", pos)
+
+    buffer = buffer[pos:] + text_decoder.decode(b"", final=True)
+    if is_array and not finished:
+        yield None, ValueError("JSON array is malformed or was never closed.")
+    elif not is_array and buffer.strip():
+        try:
+            yield json.loads(buffer), None
+        except json.JSONDecodeError as e:
+            yield None, e
+
 def redischeck():
     def decorator(func):
         @wraps(func)
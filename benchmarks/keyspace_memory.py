@@ -0,0 +1,109 @@
+"""
+Server memory per stored media for each keyspace layout (see app/torrents/keyspace.py).
+
+Writes the same synthetic records through each layout's write script into an empty database,
+one layout at a time, and compares used_memory (INFO memory) before and after.
+Needs a real redis/dragonfly, the database it's pointed at is flushed between layouts so it refuses one that isn't empty.
+
+    python -m benchmarks.keyspace_memory [--host localhost] [--port 6379] [--db 15] [--records 200000] [--buckets 2000]
+
+--buckets defaults to records / 64, the ratio KEYSPACE_BUCKETS should be picked with so buckets stay under 128 entries.
+A media bucket only gets the compact encoding when every blob fits the server's small hash limits
+(hash-max-listpack-value on redis), it's raised to KEYSPACE_LISTPACK_VALUE the way tools.migrate_keyspace size does
+and the encoding the media ended up with is printed too.
+"""
+import argparse
+import asyncio
+import random
+import sys
+
+import redis.asyncio as redis
+
+from app.torrents.keyspace import KeysLayout, BucketsLayout
+from tools.migrate_keyspace import raise_listpack_value
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+
+def synthetic_record(rng: random.Random, torrent_hash: str, index: int) -> OmnistreamProtoSummary:
+    """
+    A typical single video, two audio, a few subtitles record.
+    """
+    summary = OmnistreamProtoSummary(
+        title=f"Title {rng.randrange(10 ** 6)} 1080p WEB-DL DDP5.1 H.264-GROUP", imdb_id=f"tt{rng.randrange(10 ** 7):07d}",
+        unique_id=rng.randbytes(16).hex(), torrent_hash=torrent_hash, torrent_file_index=index,
+        quality="WEB-DL", container="mkv", size=rng.randrange(10 ** 9, 10 ** 10), mediainfo_version="25.07"
+    )
+    summary.video_tracks.add(codec="AVC", bit_depth=8, width=1920, height=1080, hdr="SDR")
+    summary.audio_tracks.add(language="English", format_tag="E-AC-3", channels_tag="5.1")
+    summary.audio_tracks.add(language="English", format_tag="AAC", channels_tag="2.0", is_commentary=True)
+    for language in rng.sample(["English", "Spanish", "French", "German", "Japanese"], 3):
+        summary.subtitle_tracks.add(language=language, format="SRT")
+    return summary
+
+def synthetic_records(count: int, seed: int) -> list:
+    """
+    count records, grouped into torrents of 1-10 files.
+    """
+    rng = random.Random(seed)
+    records = []
+    while len(records) < count:
+        torrent_hash = rng.randbytes(20).hex()
+        records.extend(synthetic_record(rng, torrent_hash, index) for index in range(min(rng.randint(1, 10), count - len(records))))
+    return records
+
+async def used_memory(redis_client) -> int:
+    return (await redis_client.info("memory"))["used_memory"]
+
+async def measure(redis_client, layout, records: list, batch: int) -> dict:
+    await redis_client.flushdb()
+    await raise_listpack_value(0, redis_client)
+    await layout.prepare([redis_client])
+    before = await used_memory(redis_client)
+    for start in range(0, len(records), batch):
+        pipe = redis_client.pipeline(transaction=False)
+        for record in records[start:start + batch]:
+            await layout.queue_write(pipe, record, record.SerializeToString())
+        await pipe.execute()
+    after = await used_memory(redis_client)
+
+    media_key, _ = layout.media_location(records[0].unique_id)
+    return {
+        "keys": await redis_client.dbsize(),
+        "bytes": after - before,
+        "encoding": (await redis_client.object("encoding", media_key)).decode("utf-8"),
+    }
+
+async def run(args):
+    redis_client = redis.Redis(host=args.host, port=args.port, db=args.db)
+    if await redis_client.dbsize():
+        sys.exit(f"Database {args.db} isn't empty, point --db at a scratch one.")
+
+    records = synthetic_records(args.records, args.seed)
+    blob_size = sum(len(record.SerializeToString()) for record in records) / len(records)
+    layouts = [KeysLayout(), BucketsLayout(args.buckets or max(1, args.records // 64))]
+
+    print(f"{args.records} records, {blob_size:.0f} B serialized on average, {layouts[1].buckets} buckets")
+    try:
+        for layout in layouts:
+            result = await measure(redis_client, layout, records, args.batch)
+            print(
+                f"{layout.name:<8} {result['keys']:>9} keys  {result['bytes'] / 1024 ** 2:8.1f} MiB"
+                f"  {result['bytes'] / args.records:6.0f} B/record ({result['bytes'] / args.records - blob_size:+.0f} B over the blob)"
+                f"  media {result['encoding']}"
+            )
+    finally:
+        await redis_client.flushdb()
+        await redis_client.aclose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=15, help="Scratch database, must be empty")
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--buckets", type=int, default=0, help="Buckets for the buckets layout, records / 64 if not given")
+    parser.add_argument("--batch", type=int, default=1000, help="Writes per pipeline")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Differential check + timing for utils.parse_mediainfo_text_to_dict.
+
+Runs the current parser and the old re.split based one over every report in
+fixtures/mediainfo_text plus randomly mangled copies of them, fails on the first
+output that differs and prints how much faster the new one is.
+
+    python -m benchmarks.mediainfo_text_parser [--mutations 2000] [--seed 1] [--rounds 20]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+from app.torrents.utils import parse_mediainfo_text_to_dict
+
+FIXTURES = Path(__file__).parent / "fixtures" / "mediainfo_text"
+
+def legacy_parse_mediainfo_text_to_dict(media_text: str) -> dict:
+    """
+    The original parser, kept as the reference implementation (minus the prints).
+    """
+    removewhitespace = re.compile(r'^[\\. ]+')
+    splitdict = re.compile(r'(?:[\\. ]+:? |[\\. ]*: )')
+    try:
+        torrentinfo = {}
+        for stream in re.split('\n ?\n',media_text.replace("\r", "")):
+            text = stream.split("\n")
+            id = text.pop(0)
+            if id[:6] == "Report":
+                torrentinfo.update({"Report":re.split(splitdict,id)[1]})
+                continue
+            if id.find(" #"):
+                id = id.split(" #")[0]
+            if not torrentinfo.get(id):
+                torrentinfo.update({id:[]})
+            info = []
+            ConformanceInfo = [False,0]
+            for value in text:
+                newvalue = re.split(removewhitespace,value,maxsplit=1).pop()
+                dictparts = re.split(splitdict,newvalue,maxsplit=1)
+                if '' in dictparts:
+                    continue
+                if len(dictparts) != 2:
+                    continue
+                if dictparts[0] == "Conformance errors":
+                    ConformanceInfo[0] = True
+                    ConformanceInfo[1] = len(info)
+                    dictparts = ['Errors', dict([dictparts])]
+                    info.append(dictparts)
+                    continue
+                if ConformanceInfo[0] == True:
+                    info[ConformanceInfo[1]][1].update(dict([dictparts]))
+                    continue
+                info.append(dictparts)
+            if id == "General":
+                torrentinfo.update({id:dict(info)})
+                continue
+            torrentinfo[id].append(dict(info))
+        return torrentinfo
+    except Exception as e:
+        return {"errors":True}
+
+# Bits of text that hit the awkward corners of the line format
+NOISE = [
+    "", " ", "\n", " \n", "\r\n", ".", "..", " . ", ":", ": ", " : ", " #2", "\\", "\\ ",
+    "Conformance errors                       : 1", " #", "Report", "Report created by : x",
+    "General", "Video #3", "Mr. Smith", "a  b", "key:value", "Key .: value", " Indented : value",
+    "..Dotted                               : value", "Tab\tkey    : value", "Ends with dot.      : value",
+]
+
+def mutate(text: str, rng: random.Random) -> str:
+    lines = text.split("\n")
+    for _ in range(rng.randint(1, 6)):
+        action = rng.random()
+        i = rng.randrange(len(lines) + 1)
+        if action < 0.4:
+            lines.insert(i, rng.choice(NOISE))
+        elif action < 0.7 and lines:
+            i = min(i, len(lines) - 1)
+            cut = rng.randrange(len(lines[i]) + 1)
+            lines[i] = lines[i][:cut] + rng.choice(NOISE) + lines[i][cut:]
+        elif action < 0.85 and lines:
+            del lines[min(i, len(lines) - 1)]
+        else:
+            lines = lines[:i]
+    return "\n".join(lines)
+
+def load_corpus() -> dict:
+    return {path.name: path.read_bytes().decode("utf-8") for path in sorted(FIXTURES.glob("*.txt"))}
+
+def time_parsers(parsers: list, reports: list, rounds: int, repeats: int = 15) -> list:
+    """
+    Best of `repeats` runs per parser, in seconds per report.
+    The parsers take turns so a noisy machine hits them all the same.
+    """
+    best = [float("inf")] * len(parsers)
+    for _ in range(repeats):
+        for i, parser in enumerate(parsers):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for report in reports:
+                    parser(report)
+            best[i] = min(best[i], time.perf_counter() - start)
+    return [elapsed / (rounds * len(reports)) for elapsed in best]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mutations", type=int, default=2000, help="Mangled reports to check per fixture")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=20, help="Timing rounds per run, best of 15 runs is kept")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    if not corpus:
+        sys.exit(f"No fixtures in {FIXTURES}")
+
+    rng = random.Random(args.seed)
+    checked = 0
+    for name, report in corpus.items():
+        cases = [report] + [mutate(report, rng) for _ in range(args.mutations)]
+        for case in cases:
+            expected = legacy_parse_mediainfo_text_to_dict(case)
+            got = parse_mediainfo_text_to_dict(case)
+            if got != expected:
+                print(f"MISMATCH on {name}\n--- input ---\n{case!r}\n--- legacy ---\n{expected}\n--- new ---\n{got}")
+                sys.exit(1)
+            checked += 1
+    print(f"{checked} reports identical")
+
+    print(f"{'report':<32} {'legacy us':>10} {'current us':>10} {'speedup':>8}")
+    for name, report in [*corpus.items(), ("all", None)]:
+        reports = [report] if report is not None else list(corpus.values())
+        legacy, current = time_parsers([legacy_parse_mediainfo_text_to_dict, parse_mediainfo_text_to_dict], reports, args.rounds)
+        print(f"{name:<32} {legacy * 1e6:10.1f} {current * 1e6:10.1f} {legacy / current:7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Per-record read path cost: stored proto bytes -> OmnistreamMetadata (-> response JSON).
+
+"before" is ParseFromString + MessageToDict + model_validate, then the response envelope
+being dumped and validated again the way older FastAPI versions handle response_model.
+"after" is ParseFromString + utils.omnistream_proto_summary_to_model and the envelope going straight
+to model_dump_json, which is what the lookup routes do now.
+Both have to give the same JSON for every record or it exits 1.
+
+    python -m benchmarks.proto_decode [--rounds 200]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+from app.torrents.models import JobStatus, MediaDataResponse
+from app.torrents.utils import (
+    parse_mediainfo_text_to_dict, mediainfo_dict_to_proto,
+    omnistream_proto_summary_to_dict, omnistream_proto_summary_to_model
+)
+
+FIXTURES = Path(__file__).parent / "fixtures" / "mediainfo_text"
+
+def season_pack_record() -> bytes:
+    """
+    A big multi-track record, the kind of thing anime/season remuxes end up with.
+    """
+    summary = OmnistreamProtoSummary(
+        title="Show S01E01 1080p BluRay REMUX AVC FLAC 2.0-GROUP", imdb_id="tt0000001", tmdb_id="tv/1",
+        unique_id="0123456789abcdef0123456789abcdef", torrent_hash="fedcba9876543210fedcba9876543210",
+        quality="BluRay REMUX", container="mkv", size=31_000_000_000, season_number=1, episode_number=1,
+        episode_string="S01E01", torrent_file_index=3, mediainfo_version="25.07"
+    )
+    summary.video_tracks.add(codec="AVC", bit_depth=8, width=1920, height=1080, hdr="SDR")
+    for i in range(8):
+        summary.audio_tracks.add(
+            language=["Japanese", "English"][i % 2], format_tag="FLAC", channels_tag="2.0",
+            is_commentary=i == 7, source="Commentary" if i == 7 else ""
+        )
+    for i in range(24):
+        summary.subtitle_tracks.add(language=f"Language {i}", format="ASS" if i % 3 else "PGS", is_sdh=i == 2)
+    return summary.SerializeToString()
+
+def load_records() -> dict:
+    records = {}
+    for path in sorted(FIXTURES.glob("*.txt")):
+        mediainfo = parse_mediainfo_text_to_dict(path.read_bytes().decode("utf-8"))
+        records[path.name] = mediainfo_dict_to_proto(mediainfo).SerializeToString()
+    records["season_pack_33_tracks"] = season_pack_record()
+    return records
+
+def decode_before(blob: bytes):
+    proto = OmnistreamProtoSummary()
+    proto.ParseFromString(blob)
+    return omnistream_proto_summary_to_dict(proto)
+
+def decode_after(blob: bytes):
+    proto = OmnistreamProtoSummary()
+    proto.ParseFromString(blob)
+    return omnistream_proto_summary_to_model(proto)
+
+def respond_before(blob: bytes) -> str:
+    response = MediaDataResponse(status="success", data=[decode_before(blob)])
+    return MediaDataResponse.model_validate(response.model_dump()).model_dump_json()
+
+def respond_after(blob: bytes) -> str:
+    return MediaDataResponse.model_construct(status=JobStatus.SUCCESS, data=[decode_after(blob)], error=None).model_dump_json()
+
+def best_per_call(funcs: list, blob: bytes, rounds: int, repeats: int = 15) -> list:
+    """
+    Best of `repeats` runs per function in seconds per call, taking turns so machine noise hits them all the same.
+    """
+    best = [float("inf")] * len(funcs)
+    for _ in range(repeats):
+        for i, func in enumerate(funcs):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                func(blob)
+            best[i] = min(best[i], time.perf_counter() - start)
+    return [elapsed / rounds for elapsed in best]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200, help="Calls per run, best of 15 runs is kept")
+    args = parser.parse_args()
+
+    records = load_records()
+    for name, blob in records.items():
+        if respond_before(blob) != respond_after(blob):
+            sys.exit(f"MISMATCH on {name}\n{respond_before(blob)}\n{respond_after(blob)}")
+    print(f"{len(records)} records identical")
+
+    print(f"{'record':<28} {'tracks':>6} {'decode before':>14} {'after':>8} {'speedup':>8} {'json before':>12} {'after':>8} {'speedup':>8}")
+    for name, blob in records.items():
+        proto = OmnistreamProtoSummary.FromString(blob)
+        tracks = len(proto.video_tracks) + len(proto.audio_tracks) + len(proto.subtitle_tracks)
+        decode = best_per_call([decode_before, decode_after], blob, args.rounds)
+        respond = best_per_call([respond_before, respond_after], blob, args.rounds)
+        print(
+            f"{name:<28} {tracks:>6} {decode[0] * 1e6:12.1f}us {decode[1] * 1e6:6.1f}us {decode[0] / decode[1]:7.1f}x"
+            f" {respond[0] * 1e6:10.1f}us {respond[1] * 1e6:6.1f}us {respond[0] / respond[1]:7.1f}x"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Micro-benchmark suite for the ingest parsers, proto conversion and the services.py read/write paths.
+
+Inputs come from the committed fixtures: MediaInfo JSON exports (fixtures/mediainfo_json), MediaInfo text
+reports (fixtures/mediainfo_text) and UNIT3D torrent payloads (fixtures/unit3d). The service cases run against
+an in-process fakeredis (pip install fakeredis lupa), they're skipped when it isn't installed.
+
+    python -m benchmarks.suite [--filter parse_] [--quick] [--out results.json] [--baseline baseline.json] [--threshold 0.1]
+
+Every case is timed in --samples samples of at least --min-time seconds each (gc off, calls per sample calibrated
+up front) and reported as the median per call, with the spread between the quartiles as a noise estimate.
+--out writes the results as JSON, --baseline compares against an earlier --out file and exits 1 when a case got
+slower than the threshold, or than the noise of either run if that's bigger. Only compare runs from the same machine.
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+
+# Parsing stays in process so the ingest cases don't time a process pool
+os.environ.setdefault("PARSE_EXECUTOR", "thread")
+os.environ.setdefault("PARSE_WORKERS", "1")
+
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+from app.torrents.models import MediaInfoExport, Unit3dTorrent, VideoTrackExport, AudioTrackExport
+from app.torrents.utils import (
+    parse_mediainfo_export_to_proto, parse_mediainfo_text_to_dict, mediainfo_dict_to_proto,
+    parse_hdr_features, parse_channel_layout, omnistream_proto_summary_to_dict, parse_tracker_json_to_proto
+)
+
+FIXTURES = Path(__file__).parent / "fixtures"
+RESULTS_VERSION = 1
+PACKAGES = ("pydantic", "pydantic-core", "protobuf", "fastapi", "redis", "fakeredis")
+
+class Case:
+    """
+    A named thing to time. call() does `items` units of work (a batch of lookups, every fixture track...),
+    results are per item. Async cases give a coroutine function.
+    """
+
+    def __init__(self, name: str, call, items: int = 1, is_async: bool = False):
+        self.name = name
+        self.call = call
+        self.items = items
+        self.is_async = is_async
+
+def load_fixtures() -> dict:
+    return {
+        "mediainfo_json": {path.stem: json.loads(path.read_bytes()) for path in sorted((FIXTURES / "mediainfo_json").glob("*.json"))},
+        "mediainfo_text": {path.stem: path.read_bytes().decode("utf-8") for path in sorted((FIXTURES / "mediainfo_text").glob("*.txt"))},
+        "unit3d": {path.stem: json.loads(path.read_bytes()) for path in sorted((FIXTURES / "unit3d").glob("*.json"))},
+    }
+
+def parser_cases(fixtures: dict) -> list:
+    cases = []
+    exports = {name: MediaInfoExport.model_validate(source) for name, source in fixtures["mediainfo_json"].items()}
+    for name, source in fixtures["mediainfo_json"].items():
+        cases.append(Case(f"MediaInfoExport.model_validate/{name}", lambda source=source: MediaInfoExport.model_validate(source)))
+    for name, export in exports.items():
+        cases.append(Case(f"parse_mediainfo_export_to_proto/{name}", lambda export=export: parse_mediainfo_export_to_proto(export)))
+
+    for name, text in fixtures["mediainfo_text"].items():
+        cases.append(Case(f"parse_mediainfo_text_to_dict/{name}", lambda text=text: parse_mediainfo_text_to_dict(text)))
+    for name, text in fixtures["mediainfo_text"].items():
+        mediainfo = parse_mediainfo_text_to_dict(text)
+        cases.append(Case(f"mediainfo_dict_to_proto/{name}", lambda mediainfo=mediainfo: mediainfo_dict_to_proto(mediainfo)))
+
+    tracks = [track for export in exports.values() for track in export.media.tracks]
+    video_tracks = [track for track in tracks if isinstance(track, VideoTrackExport)]
+    audio_tracks = [(track.channel_layout, track.channels) for track in tracks if isinstance(track, AudioTrackExport)]
+
+    def hdr_features():
+        for track in video_tracks:
+            parse_hdr_features(track)
+
+    def channel_layouts():
+        for layout, channels in audio_tracks:
+            parse_channel_layout(layout, channels)
+
+    cases.append(Case("parse_hdr_features/fixture_video_tracks", hdr_features, len(video_tracks)))
+    cases.append(Case("parse_channel_layout/fixture_audio_tracks", channel_layouts, len(audio_tracks)))
+
+    torrents = {name: Unit3dTorrent.model_validate(document) for name, document in fixtures["unit3d"].items()}
+    for name, torrent in torrents.items():
+        cases.append(Case(f"parse_tracker_json_to_proto/{name}", lambda torrent=torrent: parse_tracker_json_to_proto(torrent)))
+    for name, torrent in torrents.items():
+        summary = parse_tracker_json_to_proto(torrent)
+        cases.append(Case(f"omnistream_proto_summary_to_dict/{name}", lambda summary=summary: omnistream_proto_summary_to_dict(summary)))
+    return cases
+
+def stored_records(fixtures: dict, torrents: int, files: int) -> list:
+    """
+    torrents * files summaries made from the UNIT3D fixtures, each torrent gets its own hash and files their own ids,
+    every 10 torrents share an imdb id.
+    """
+    templates = [parse_tracker_json_to_proto(Unit3dTorrent.model_validate(document)) for document in fixtures["unit3d"].values()]
+    records = []
+    for torrent in range(torrents):
+        for index in range(files):
+            summary = OmnistreamProtoSummary()
+            summary.CopyFrom(templates[(torrent + index) % len(templates)])
+            summary.unique_id = f"{torrent:016x}{index:016x}"
+            summary.torrent_hash = f"{torrent:032x}"
+            summary.torrent_file_index = index
+            summary.imdb_id = f"tt{torrent // 10:07d}"
+            records.append(summary)
+    return records
+
+def service_cases(fixtures: dict, loop) -> list:
+    """
+    services.py against a fakeredis with 1000 stored media (100 torrents of 10 files, 100 media per imdb).
+    Lookups are timed with the media cache off unless the name says cached.
+    """
+    try:
+        import fakeredis
+    except ImportError:
+        print("fakeredis isn't installed, skipping the services cases (pip install fakeredis lupa)")
+        return []
+
+    from app.core import database
+    database.set_shards([fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())])
+    from app.torrents import models, services
+    from app.core.cache import media_cache
+
+    records = stored_records(fixtures, 100, 10)
+    loop.run_until_complete(services.create_media_summaries_from_protos(iterate(records)))
+
+    def uncached(func):
+        async def call():
+            media_cache.clear()
+            return await func()
+        return call
+
+    # Two versions of the same media so every write is an update
+    updates = itertools.cycle([records[0], with_title(records[0], "Updated title")])
+    bulk_updates = itertools.cycle([records[:500], [with_title(record, "Updated title") for record in records[:500]]])
+    tracker_ndjson = b"".join(json.dumps(document).encode("utf-8") + b"\n" for document in fixtures["unit3d"].values()) * 10
+    unique_ids = [record.unique_id for record in records]
+    batch = models.BatchMediaRequestParams(
+        unique_ids=unique_ids[:20],
+        torrents=[{"torrent_hash": records[i].torrent_hash} for i in range(0, 200, 10)] + [{"torrent_hash": records[5].torrent_hash, "index": 5}],
+        imdb_ids=["tt0000001", "tt0000002"]
+    )
+    search = models.MediaSearchParams(imdb_id="tt0000003", resolution="2160p")
+
+    return [
+        Case("services.write_media_summary", lambda: services.write_media_summary(next(updates)), is_async=True),
+        Case("services.create_media_summaries_from_protos/500", lambda: services.create_media_summaries_from_protos(iterate(next(bulk_updates))), 500, True),
+        Case("services.create_media_summaries_from_tracker/ndjson", lambda: services.create_media_summaries_from_tracker(chunks(tracker_ndjson)), tracker_ndjson.count(b"\n"), True),
+        Case("services.get_media_from_uniqueid", uncached(lambda: services.get_media_from_uniqueid(unique_ids[123])), is_async=True),
+        Case("services.get_media_from_uniqueid/cached", lambda: services.get_media_from_uniqueid(unique_ids[123]), is_async=True),
+        Case("services.get_medias_from_uniqueids/100", uncached(lambda: services.get_medias_from_uniqueids(unique_ids[:100])), 100, True),
+        Case("services.get_medias_from_uniqueids/100_cached", lambda: services.get_medias_from_uniqueids(unique_ids[:100]), 100, True),
+        Case("services.get_medias_from_torrent_hash/10_files", uncached(lambda: services.get_medias_from_torrent_hash(records[0].torrent_hash)), is_async=True),
+        Case("services.get_medias_from_imdb/100_media", uncached(lambda: services.get_medias_from_imdb("tt0000001")), is_async=True),
+        Case("services.get_media_page_from_imdb/50", uncached(lambda: services.get_media_page_from_imdb("tt0000002", None, 50)), is_async=True),
+        Case("services.process_batch_lookup/mixed", uncached(lambda: services.process_batch_lookup(batch)), is_async=True),
+        Case("services.process_search/imdb_resolution", uncached(lambda: services.process_search(search)), is_async=True),
+    ]
+
+def with_title(summary, title: str):
+    changed = OmnistreamProtoSummary()
+    changed.CopyFrom(summary)
+    changed.title = title
+    return changed
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+async def chunks(data: bytes, size: int = 65536):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+def run_case(case: Case, loop, number: int) -> float:
+    """
+    Seconds for `number` calls.
+    """
+    if case.is_async:
+        async def repeat():
+            start = time.perf_counter()
+            for _ in range(number):
+                await case.call()
+            return time.perf_counter() - start
+        return loop.run_until_complete(repeat())
+
+    call = case.call
+    start = time.perf_counter()
+    for _ in range(number):
+        call()
+    return time.perf_counter() - start
+
+def measure(case: Case, loop, samples: int, min_time: float) -> dict:
+    run_case(case, loop, 1) # warm up
+    number = 1
+    while run_case(case, loop, number) < min_time:
+        number *= 2
+
+    gc.collect()
+    gc.disable()
+    try:
+        times = [run_case(case, loop, number) / number / case.items for _ in range(samples)]
+    finally:
+        gc.enable()
+
+    quartiles = statistics.quantiles(times, n=4)
+    return {
+        "median_ns": statistics.median(times) * 1e9,
+        "min_ns": min(times) * 1e9,
+        "iqr_ns": (quartiles[2] - quartiles[0]) * 1e9,
+        "samples": samples,
+        "calls_per_sample": number,
+        "items_per_call": case.items,
+    }
+
+def environment() -> dict:
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=FIXTURES).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "packages": versions,
+        "commit": commit,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+def format_ns(ns: float) -> str:
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f}ms"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.2f}us"
+    return f"{ns:.0f}ns"
+
+def compare(results: dict, baseline: dict, threshold: float, partial: bool = False) -> list:
+    """
+    Prints current vs baseline for every case and gives back the names of the ones that got slower.
+    A case only counts as slower when the change is past the threshold and past the noise of both runs.
+    partial (a filtered run) leaves out the baseline cases that weren't run.
+    """
+    for key in ("python", "platform", "packages"):
+        if baseline["meta"].get(key) != results["meta"].get(key):
+            print(f"Baseline was run with a different {key}: {baseline['meta'].get(key)}")
+
+    slower = []
+    print(f"\n{'case':<62} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<62} {'-':>10} {format_ns(result['median_ns']):>10} {'new':>8}")
+            continue
+        change = result["median_ns"] / base["median_ns"] - 1
+        noise = max(result["iqr_ns"] / result["median_ns"], base["iqr_ns"] / base["median_ns"])
+        bar = max(threshold, 2 * noise)
+        mark = ""
+        if change > bar:
+            mark = "  SLOWER"
+            slower.append(name)
+        elif change < -bar:
+            mark = "  faster"
+        print(f"{name:<62} {format_ns(base['median_ns']):>10} {format_ns(result['median_ns']):>10} {change:>+7.1%}{mark}")
+    for name in [] if partial else baseline["results"].keys() - results["results"].keys():
+        print(f"{name:<62} {format_ns(baseline['results'][name]['median_ns']):>10} {'-':>10} {'gone':>8}")
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", action="append", default=[], help="Only run cases whose name contains this (repeatable)")
+    parser.add_argument("--samples", type=int, default=15, help="Timed samples per case")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum seconds per sample, calls per sample are scaled to it")
+    parser.add_argument("--quick", action="store_true", help="5 samples of 0.01s, for a smoke run")
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown (0.10 = 10%%) that counts as a regression")
+    args = parser.parse_args()
+    if args.quick:
+        args.samples, args.min_time = 5, 0.01
+
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    if baseline and baseline.get("version") != RESULTS_VERSION:
+        sys.exit(f"{args.baseline} is results version {baseline.get('version')}, this suite writes {RESULTS_VERSION}.")
+
+    fixtures = load_fixtures()
+    loop = asyncio.new_event_loop()
+    cases = parser_cases(fixtures) + service_cases(fixtures, loop)
+    if args.filter:
+        cases = [case for case in cases if any(part in case.name for part in args.filter)]
+
+    results = {"version": RESULTS_VERSION, "meta": environment(), "results": {}}
+    print(f"{'case':<62} {'median':>10} {'min':>10} {'noise':>7}")
+    try:
+        for case in cases:
+            result = measure(case, loop, args.samples, args.min_time)
+            results["results"][case.name] = result
+            print(f"{case.name:<62} {format_ns(result['median_ns']):>10} {format_ns(result['min_ns']):>10} {result['iqr_ns'] / result['median_ns']:>6.1%}")
+    finally:
+        loop.close()
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nWrote {len(results['results'])} results to {args.out}")
+
+    if baseline:
+        slower = compare(results, baseline, args.threshold, bool(args.filter))
+        if slower:
+            print(f"\n{len(slower)} case(s) slower than the baseline")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,104 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 import asyncio
-from app.core.database import redis_client
+from app.core import metrics, profiler
+from app.core.database import get_shards, get_replicas, has_replicas, check_replicas
+from app.core.cache import media_cache, listen_for_invalidations
+from app.core.blobs import MEDIA_COMPRESSION, compression_available, load_dictionaries, refresh_dictionaries
+from app.core.executor import start_parse_executor, shutdown_parse_executor, ParseQueueFull, ParseTimeout
 from contextlib import asynccontextmanager
 from app.torrents.routes import router as torrents_router
+from app.torrents.jobs import INGEST_WORKERS, run_ingest_workers
+from app.torrents.services import prepare_layouts
+from app.torrents.grpc_service import GRPC_ENABLED, start_grpc_server
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     while True:
         try:
-            await redis_client.ping()
-            print("DragonflyDB Connected!")
+            await asyncio.gather(*[client.ping() for client in get_shards()])
+            print(f"DragonflyDB Connected! ({len(get_shards())} shard{'s' if len(get_shards()) > 1 else ''})")
             break
         except Exception:
             print("DragonflyDB not ready. Retrying in 2s...")
             await asyncio.sleep(2)
+    await prepare_layouts()
+
+    if MEDIA_COMPRESSION == "zstd" and not compression_available():
+        print("MEDIA_COMPRESSION is zstd but zstd isn't available (install backports.zstd or use Python 3.14+), storing plain protos")
+    await load_dictionaries()
+    dictionary_refresher = asyncio.create_task(refresh_dictionaries()) if MEDIA_COMPRESSION == "zstd" and compression_available() else None
+
+    start_parse_executor()
+    invalidation_listener = asyncio.create_task(listen_for_invalidations())
+    replica_checker = asyncio.create_task(check_replicas()) if has_replicas() else None
+    grpc_server = await start_grpc_server() if GRPC_ENABLED else None
+    ingest_workers = asyncio.create_task(run_ingest_workers()) if INGEST_WORKERS > 0 else None
     
     yield
 
-    await redis_client.close()
+    if grpc_server is not None:
+        await grpc_server.stop(5)
+    if ingest_workers is not None:
+        ingest_workers.cancel()
+    invalidation_listener.cancel()
+    if replica_checker is not None:
+        replica_checker.cancel()
+    if dictionary_refresher is not None:
+        dictionary_refresher.cancel()
+    shutdown_parse_executor()
+    for client in get_shards() + get_replicas():
+        await client.aclose()
 
 app = FastAPI(
     title="CinephileDB",
     description="A high-speed movie media info database.",
     lifespan=lifespan
 )
+app.add_middleware(metrics.MetricsMiddleware)
+if profiler.PROFILE_ENABLED:
+    app.add_middleware(profiler.ProfilerMiddleware)
+
+@app.exception_handler(ParseQueueFull)
+async def parse_queue_full_handler(request: Request, exc: ParseQueueFull):
+    return JSONResponse(status_code=503, content={"status": "failed", "error": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(ParseTimeout)
+async def parse_timeout_handler(request: Request, exc: ParseTimeout):
+    return JSONResponse(status_code=504, content={"status": "failed", "error": str(exc)})
 
 app.include_router(torrents_router, prefix="/api/v1", tags=["Torrents"])
 
 @app.get("/api/v1/health", tags=["Health"])
-def read_root():
-    """A simple health check endpoint."""
-    return {"status": "ok"}
\ No newline at end of file
+async def read_root():
+    """A simple health check endpoint, async so the cache stats are read on the loop that changes them."""
+    return {"status": "ok", "media_cache": media_cache.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    """
+    Prometheus metrics, everything that isn't a histogram or counter is only read when this is scraped.
+    Async so rendering happens on the event loop that records them, not on a threadpool thread mid update.
+    """
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def check_profile_token(request: Request):
+    if not profiler.PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiler.token_matches(request.headers.get(profiler.PROFILE_HEADER, "")):
+        raise HTTPException(status_code=403, detail="Wrong or missing X-Profile-Token.")
+
+@app.get("/admin/profiles", include_in_schema=False)
+async def list_profiles(request: Request):
+    """Profiles this worker kept, newest first. Async so profiles is read on the loop that appends to it."""
+    check_profile_token(request)
+    return [profile.summary() for profile in reversed(profiler.profiles)]
+
+@app.get("/admin/profiles/{profile_id}", include_in_schema=False)
+async def read_profile(request: Request, profile_id: str):
+    """Collapsed stacks of a profile, feed it to flamegraph.pl or speedscope."""
+    check_profile_token(request)
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No such profile (only the last PROFILE_KEEP are kept).")
+    return Response(profile.collapsed(), media_type="text/plain; charset=utf-8")
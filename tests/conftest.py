@@ -0,0 +1,40 @@
+"""
+The tests run against in-process fakeredis servers, one per shard (pip install pytest fakeredis lupa).
+
+    python -m pytest tests
+"""
+import os
+
+# Parsing stays in process, before anything reads the setting
+os.environ.setdefault("PARSE_EXECUTOR", "thread")
+os.environ.setdefault("PARSE_WORKERS", "1")
+
+import fakeredis
+import pytest
+from app.core import database
+
+# The app registers its lua scripts on the first shard when it's imported, so there has to be one by then
+database.set_shards([fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())])
+
+from app.core.cache import media_cache
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def shards():
+    """
+    A fresh fakeredis shard for the test, call it with a count to swap in that many instead.
+    replicas=n gives every shard n replica clients of its own server (they always see every write).
+    """
+    def use(count: int = 1, replicas: int = 0) -> list:
+        servers = [fakeredis.FakeServer() for _ in range(count)]
+        clients = [fakeredis.FakeAsyncRedis(server=server) for server in servers]
+        database.set_shards(clients, replicas=[[fakeredis.FakeAsyncRedis(server=server) for _ in range(replicas)] for server in servers])
+        media_cache.clear()
+        return clients
+
+    use()
+    yield use
+    media_cache.clear()
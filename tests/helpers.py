@@ -0,0 +1,26 @@
+"""
+Things the tests build their data with.
+"""
+from app.core import database
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+
+def make_summary(unique_id: str, torrent_hash: str = "", index: int = 0, imdb_id: str = "tt0000001", title: str = "Title"):
+    summary = OmnistreamProtoSummary()
+    summary.unique_id = unique_id
+    summary.torrent_hash = torrent_hash
+    summary.torrent_file_index = index
+    summary.imdb_id = imdb_id
+    summary.title = title
+    return summary
+
+def ids_on_shards(count: int, start: int = 0) -> list:
+    """
+    One unique id living on each of the count shards, in shard order.
+    """
+    found = {}
+    i = start
+    while len(found) < count:
+        unique_id = f"{i:032x}"
+        found.setdefault(database.get_shard_index(unique_id), unique_id)
+        i += 1
+    return [found[shard] for shard in range(count)]
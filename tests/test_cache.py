@@ -0,0 +1,141 @@
+import asyncio
+import pytest
+from app.core.cache import LRUCache, SingleFlight, media_cache, MEDIA_CACHE_CHANNEL
+from app.torrents import services
+from .helpers import make_summary
+
+def test_invalidating_another_key_doesnt_refuse_the_fill():
+    cache = LRUCache(10)
+    version = cache.version
+    cache.invalidate("other")
+    cache.set("key", "value", version)
+    assert cache.get("key") == "value"
+
+def test_invalidating_the_key_refuses_the_fill():
+    cache = LRUCache(10)
+    version = cache.version
+    cache.invalidate("key")
+    cache.set("key", "stale", version)
+    assert cache.get("key") is None
+    cache.set("key", "fresh", cache.version)
+    assert cache.get("key") == "fresh"
+
+def test_forgotten_invalidations_refuse_older_fills():
+    cache = LRUCache(2)
+    version = cache.version
+    cache.invalidate("a")
+    cache.invalidate("b")
+    cache.invalidate("c") # Forgets "a"
+    cache.set("a", "stale", version)
+    cache.set("d", "maybe stale", version)
+    assert cache.get("a") is None and cache.get("d") is None
+    assert len(cache.invalidated) == 2
+
+def test_clear_refuses_older_fills():
+    cache = LRUCache(10)
+    version = cache.version
+    cache.clear()
+    cache.set("key", "stale", version)
+    assert cache.get("key") is None
+
+@pytest.mark.anyio
+async def test_bulk_write_invalidates_once(shards):
+    client, = shards()
+    pubsub = client.pubsub()
+    await pubsub.subscribe(MEDIA_CACHE_CHANNEL)
+    await pubsub.get_message(timeout=1) # subscribe confirmation
+
+    async def summaries():
+        for i in range(5):
+            yield make_summary(f"{i:032x}", "cc" * 16, index=i)
+
+    version = media_cache.version
+    response = await services.create_media_summaries_from_protos(summaries())
+    assert response.failed == 0
+    assert media_cache.version == version + 1
+
+    messages = []
+    while (message := await pubsub.get_message(timeout=0.2)) is not None:
+        messages.append(message["data"].decode("utf-8").split(" "))
+    await pubsub.aclose()
+    assert messages == [[f"{i:032x}" for i in range(5)]]
+
+class Fetch:
+    """
+    A call for SingleFlight that runs until release() and counts how often it was started.
+    """
+
+    def __init__(self, result="result"):
+        self.result = result
+        self.started = 0
+        self.cancelled = False
+        self.released = asyncio.Event()
+
+    def release(self):
+        self.released.set()
+
+    async def __call__(self):
+        self.started += 1
+        try:
+            await self.released.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+async def waiters(flights: SingleFlight, fetch: Fetch, count: int) -> list:
+    tasks = [asyncio.create_task(flights.do("key", fetch)) for _ in range(count)]
+    await asyncio.sleep(0)
+    return tasks
+
+@pytest.mark.anyio
+async def test_single_flight_keeps_running_for_the_callers_still_waiting():
+    flights, fetch = SingleFlight(), Fetch()
+    cancelled, *others = await waiters(flights, fetch, 3)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    assert cancelled.cancelled() and "key" in flights.flights
+
+    fetch.release()
+    assert await asyncio.gather(*others) == ["result", "result"]
+    assert fetch.started == 1 and not fetch.cancelled and not flights.flights
+
+@pytest.mark.anyio
+async def test_single_flight_cancels_the_call_once_nobody_waits():
+    flights, fetch = SingleFlight(), Fetch()
+    tasks = await waiters(flights, fetch, 2)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert fetch.cancelled and not flights.flights
+
+    # The next call starts over instead of waiting on the cancelled one
+    fetch = Fetch("again")
+    fetch.release()
+    assert await flights.do("key", fetch) == "again"
+
+@pytest.mark.anyio
+async def test_single_flight_raises_for_every_caller():
+    flights, fetch = SingleFlight(), Fetch(ValueError("broken"))
+    tasks = await waiters(flights, fetch, 3)
+    fetch.release()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert fetch.started == 1 and all(isinstance(result, ValueError) and str(result) == "broken" for result in results)
+    assert not flights.flights
+
+@pytest.mark.anyio
+async def test_single_flight_counts():
+    flights, fetch = SingleFlight(), Fetch()
+    tasks = await waiters(flights, fetch, 3)
+    assert flights.stats() == {"calls": 1, "coalesced": 2, "in_flight": 1}
+    fetch.release()
+    await asyncio.gather(*tasks)
+    assert flights.stats() == {"calls": 1, "coalesced": 2, "in_flight": 0}
+
+    # Calls after it landed run again
+    assert await flights.do("key", fetch) == "result"
+    assert await flights.do("other", fetch) == "result"
+    assert fetch.started == 3 and flights.stats() == {"calls": 3, "coalesced": 2, "in_flight": 0}
@@ -0,0 +1,28 @@
+import asyncio
+import threading
+import pytest
+from app.core import executor
+
+pytestmark = pytest.mark.anyio
+
+def in_use_sample() -> str:
+    return next(line for line in executor.executor_metrics() if line.startswith("omnistream_parse_slots_in_use "))
+
+async def test_slots_in_use_gauge():
+    started, finish = threading.Event(), threading.Event()
+    def parse(value):
+        started.set()
+        finish.wait(5)
+        return value
+
+    executor.shutdown_parse_executor()
+    task = asyncio.create_task(executor.run_parser(parse, "done"))
+    while not started.is_set():
+        await asyncio.sleep(0.01)
+    assert in_use_sample() == "omnistream_parse_slots_in_use 1"
+
+    finish.set()
+    assert await task == "done"
+    while executor.parse_slots_in_use:
+        await asyncio.sleep(0.01)
+    assert in_use_sample() == "omnistream_parse_slots_in_use 0"
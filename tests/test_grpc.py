@@ -0,0 +1,85 @@
+import grpc
+import pytest
+from app.core.proto import media_info_pb2_grpc # type: ignore
+from app.core.proto.media_info_pb2 import UniqueIdRequest, TorrentHashRequest, ImdbRequest # type: ignore
+from app.torrents.grpc_service import OmnistreamServicer
+from .helpers import make_summary, ids_on_shards
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def stub(shards):
+    shards(2)
+    server = grpc.aio.server()
+    media_info_pb2_grpc.add_OmnistreamServicer_to_server(OmnistreamServicer(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+        yield media_info_pb2_grpc.OmnistreamStub(channel)
+    await server.stop(None)
+
+async def ingest(stub, summaries: list):
+    async def send():
+        for summary in summaries:
+            yield summary
+    return await stub.Ingest(send())
+
+async def test_ingest_then_every_lookup(stub):
+    first, second = ids_on_shards(2)
+    response = await ingest(stub, [
+        make_summary(first, "aa" * 16, index=0, imdb_id="tt0000001"),
+        make_summary(second, "aa" * 16, index=1, imdb_id="tt0000001"),
+        make_summary(""),
+    ])
+    assert (response.total, response.failed) == (3, 1)
+    assert [(result.success, result.unique_id, result.change) for result in response.results[:2]] == [(True, first, "created"), (True, second, "created")]
+
+    summary = await stub.GetByUniqueId(UniqueIdRequest(unique_id=second))
+    assert summary.unique_id == second and summary.torrent_file_index == 1
+
+    torrent = await stub.GetByTorrentHash(TorrentHashRequest(torrent_hash="aa" * 16))
+    assert sorted(summary.unique_id for summary in torrent.summaries) == sorted([first, second])
+    one_file = await stub.GetByTorrentHash(TorrentHashRequest(torrent_hash="aa" * 16, index=1))
+    assert [summary.unique_id for summary in one_file.summaries] == [second]
+
+    imdb = await stub.GetByImdb(ImdbRequest(imdb_id="tt0000001"))
+    assert sorted(summary.unique_id for summary in imdb.summaries) == sorted([first, second])
+
+    streamed = [summary.unique_id async for summary in stub.StreamByImdb(ImdbRequest(imdb_id="tt0000001"))]
+    assert sorted(streamed) == sorted([first, second])
+
+    unchanged = await ingest(stub, [make_summary(first, "aa" * 16, index=0, imdb_id="tt0000001")])
+    assert unchanged.results[0].change == "unchanged"
+
+async def test_errors(stub):
+    with pytest.raises(grpc.aio.AioRpcError) as error:
+        await stub.GetByUniqueId(UniqueIdRequest(unique_id="ff" * 16))
+    assert error.value.code() == grpc.StatusCode.NOT_FOUND
+
+    with pytest.raises(grpc.aio.AioRpcError) as error:
+        await stub.GetByImdb(ImdbRequest())
+    assert error.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+    with pytest.raises(grpc.aio.AioRpcError) as error:
+        [summary async for summary in stub.StreamByImdb(ImdbRequest())]
+    assert error.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+    empty = await stub.GetByTorrentHash(TorrentHashRequest(torrent_hash="bb" * 16))
+    assert not empty.summaries
+
+async def test_stream_skips_members_sscan_repeats(stub, monkeypatch):
+    unique_ids = ids_on_shards(2)
+    await ingest(stub, [make_summary(unique_id, imdb_id="tt0000002") for unique_id in unique_ids])
+
+    # SSCAN may return a member again if the set is rehashed mid scan, have it return everything twice
+    from app.core import database
+    for client in database.get_shards():
+        sscan_iter = client.sscan_iter
+        async def twice(*args, sscan_iter=sscan_iter, **kwargs):
+            async for member in sscan_iter(*args, **kwargs):
+                yield member
+                yield member
+        monkeypatch.setattr(client, "sscan_iter", twice)
+
+    streamed = [summary.unique_id async for summary in stub.StreamByImdb(ImdbRequest(imdb_id="tt0000002"))]
+    assert sorted(streamed) == sorted(unique_ids)
@@ -0,0 +1,90 @@
+import json
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.core import database
+from app.torrents import services
+from app.torrents.models.http import encode_media_cursor, decode_media_cursor
+from app.torrents.routes import router
+from .helpers import make_summary
+
+pytestmark = pytest.mark.anyio
+
+async def write_imdb(count: int, imdb_id: str = "tt0000003") -> set:
+    unique_ids = {f"{i:032x}" for i in range(count)}
+    for unique_id in unique_ids:
+        await services.write_media_summary(make_summary(unique_id, imdb_id=imdb_id))
+    return unique_ids
+
+def spy_sscans(monkeypatch) -> list:
+    """
+    (shard, client) of every SSCAN from here on.
+    """
+    calls = []
+    for shard, primary in enumerate(database.get_shards()):
+        for client in [primary, *database.shard_replicas[shard]]:
+            sscan = client.sscan
+            async def spy(*args, client=client, shard=shard, sscan=sscan, **kwargs):
+                calls.append((shard, client))
+                return await sscan(*args, **kwargs)
+            monkeypatch.setattr(client, "sscan", spy)
+    return calls
+
+async def read_pages(cursor=None, page_size: int = 3, pages: int = None) -> tuple:
+    unique_ids = []
+    while pages is None or pages > 0:
+        page, cursor = await services.get_unique_id_page_from_imdb("tt0000003", cursor, page_size)
+        unique_ids += page
+        if cursor is None:
+            break
+        pages = pages - 1 if pages is not None else None
+    return unique_ids, cursor
+
+async def test_a_shard_is_scanned_on_one_node(shards, monkeypatch):
+    shards(2, replicas=2)
+    expected = await write_imdb(40)
+    calls = spy_sscans(monkeypatch)
+
+    unique_ids, _ = await read_pages(page_size=1)
+    assert sorted(unique_ids) == sorted(expected)
+    for shard in range(2):
+        nodes = {client for called_shard, client in calls if called_shard == shard}
+        assert len(nodes) == 1 and nodes <= set(database.shard_replicas[shard])
+
+async def test_down_replica_rescans_the_shard_on_the_primary(shards, monkeypatch):
+    shards(2, replicas=1)
+    expected = await write_imdb(40)
+
+    first, cursor = await read_pages(page_size=2, pages=2)
+    shard, scan_cursor, node = decode_media_cursor(cursor)
+    assert node == 1
+    database.down_replicas.add(database.shard_replicas[shard][0])
+    calls = spy_sscans(monkeypatch)
+
+    rest, _ = await read_pages(cursor)
+    assert set(first + rest) == expected
+    assert calls[0] == (shard, database.get_shards()[shard])
+
+async def test_cursors_without_a_node(shards):
+    shards(2)
+    expected = await write_imdb(10)
+    unique_ids, _ = await read_pages(encode_media_cursor(0, 0))
+    assert sorted(unique_ids) == sorted(expected)
+    assert decode_media_cursor(encode_media_cursor(1, 7, 2)) == (1, 7, 2)
+    with pytest.raises(ValueError):
+        decode_media_cursor(encode_media_cursor(1, 7, 2) + "LjM")
+
+async def test_ndjson_refuses_a_cursor(shards):
+    shards(2)
+    expected = await write_imdb(5)
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    headers = {"accept": "application/x-ndjson"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        streamed = await client.get("/api/v1/torrents/media", params={"imdb_id": "tt0000003"}, headers=headers)
+        assert {json.loads(line)["unique_id"] for line in streamed.text.splitlines()} == expected
+        for params in [{"cursor": encode_media_cursor(1, 0)}, {"page_size": 2}]:
+            response = await client.get("/api/v1/torrents/media", params={"imdb_id": "tt0000003", **params}, headers=headers)
+            assert response.status_code == 400
+            response = await client.post("/api/v1/torrents/media", json={"imdb_id": "tt0000003", **params}, headers=headers)
+            assert response.status_code == 400
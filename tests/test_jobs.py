@@ -0,0 +1,95 @@
+import asyncio
+import json
+from pathlib import Path
+import httpx
+import pytest
+from app.torrents import jobs
+
+pytestmark = pytest.mark.anyio
+
+FIXTURES = Path(__file__).parent.parent / "benchmarks" / "fixtures" / "unit3d"
+
+@pytest.fixture
+async def client(shards):
+    from main import app
+    await jobs.create_ingest_group()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+def bulk_upload() -> bytes:
+    return b"\n".join(json.dumps(json.loads(path.read_bytes())).encode("utf-8") for path in sorted(FIXTURES.glob("*.json")))
+
+async def run_queued_job():
+    reply = await jobs.get_queue_client().xreadgroup(jobs.INGEST_GROUP, "test", {jobs.INGEST_STREAM: ">"}, count=1)
+    (message_id, fields), = reply[0][1]
+    await jobs.process_message("test", message_id, fields)
+
+async def test_bulk_upload_is_queued_in_chunks(client, monkeypatch):
+    monkeypatch.setattr(jobs, "INGEST_CHUNK_SIZE", 4096)
+    body = bulk_upload()
+    response = await client.post("/api/v1/torrents/upload/tracker/bulk", content=body,
+                                 headers={"prefer": "respond-async", "content-type": "application/x-ndjson"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    redis_client = jobs.get_queue_client()
+    chunks = await redis_client.lrange(jobs.get_payload_key(job_id), 0, -1)
+    assert len(chunks) == -(-len(body) // 4096) and b"".join(chunks) == body
+    (_, fields), = await redis_client.xrange(jobs.INGEST_STREAM)
+    assert b"payload" not in fields and int(fields[b"chunks"]) == len(chunks)
+
+    await run_queued_job()
+    job = (await client.get(f"/api/v1/torrents/jobs/{job_id}")).json()
+    assert job["status"] == "success" and (job["total"], job["failed"]) == (3, 0)
+    assert not await redis_client.exists(jobs.get_payload_key(job_id))
+
+async def test_single_upload_is_queued(client):
+    upload = json.loads((FIXTURES / "movie_bluray_crlf.json").read_bytes())
+    response = await client.post("/api/v1/torrents/upload/tracker", json=upload, headers={"prefer": "respond-async"})
+    assert response.status_code == 202
+
+    await run_queued_job()
+    job = (await client.get(f"/api/v1/torrents/jobs/{response.json()['job_id']}")).json()
+    assert job["status"] == "success" and job["result"]["change"] == "created"
+
+async def test_too_large_upload_is_refused(client, monkeypatch):
+    monkeypatch.setattr(jobs, "INGEST_CHUNK_SIZE", 1024)
+    monkeypatch.setattr(jobs, "INGEST_MAX_PAYLOAD", 4096)
+    response = await client.post("/api/v1/torrents/upload/tracker/bulk", content=bulk_upload(), headers={"prefer": "respond-async"})
+    assert response.status_code == 413
+
+    redis_client = jobs.get_queue_client()
+    assert await redis_client.xlen(jobs.INGEST_STREAM) == 0
+    assert not await redis_client.keys("ingestjob:*")
+
+async def test_abandoned_jobs_are_claimed_while_the_stream_is_busy(client, monkeypatch):
+    monkeypatch.setattr(jobs, "INGEST_CLAIM_IDLE", 0)
+    monkeypatch.setattr(jobs, "INGEST_BLOCK", 10)
+    redis_client = jobs.get_queue_client()
+    abandoned = await redis_client.xadd(jobs.INGEST_STREAM, {"job": "abandoned", "kind": "tracker", "chunks": 1})
+    await redis_client.xreadgroup(jobs.INGEST_GROUP, "died", {jobs.INGEST_STREAM: ">"}, count=1)
+    for i in range(3):
+        await redis_client.xadd(jobs.INGEST_STREAM, {"job": f"new-{i}", "kind": "tracker", "chunks": 1})
+
+    processed = []
+    async def process_message(consumer, message_id, fields):
+        processed.append(message_id)
+        await redis_client.xack(jobs.INGEST_STREAM, jobs.INGEST_GROUP, message_id)
+    monkeypatch.setattr(jobs, "process_message", process_message)
+
+    # fakeredis answers a blocking XREADGROUP right away, wait out the block like a server would
+    xreadgroup = redis_client.xreadgroup
+    async def blocking_xreadgroup(*args, block=None, **kwargs):
+        reply = await xreadgroup(*args, **kwargs)
+        if not reply and block:
+            await asyncio.sleep(block / 1000)
+        return reply
+    monkeypatch.setattr(redis_client, "xreadgroup", blocking_xreadgroup)
+
+    worker = asyncio.create_task(jobs.ingest_worker("live"))
+    while len(processed) < 4:
+        await asyncio.sleep(0.01)
+    worker.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(worker, 5)
+    assert processed[0] == abandoned
@@ -0,0 +1,39 @@
+import json
+import pytest
+from app.torrents.utils import iter_json_documents
+
+pytestmark = pytest.mark.anyio
+
+ARRAY = '[{"a": true, "b": false, "c": null, "d": -12.5e3, "e": "x\\u00e9\\"y\\\\", "f": [1, {"g": "h"}], "n": -Infinity}, {"z": "é ü"}]'
+
+async def chunked(chunks: list, read: list = None):
+    for chunk in chunks:
+        if read is not None:
+            read.append(chunk)
+        yield chunk
+
+async def decode(chunks: list, read: list = None) -> list:
+    return [(document, error) async for document, error in iter_json_documents(chunked(chunks, read))]
+
+async def test_array_split_anywhere():
+    body = ARRAY.encode("utf-8")
+    expected = [(document, None) for document in json.loads(ARRAY)]
+    for cut in range(len(body) + 1):
+        assert await decode([body[:cut], body[cut:]]) == expected, cut
+    assert await decode([body[i:i + 1] for i in range(len(body))]) == expected
+
+async def test_broken_array_stops_at_the_error():
+    read = []
+    results = await decode([b'[{"a": 1}, {"b": 2 "c": 3}, ', *[b'{"d": 4}, ' * 100] * 50, b"]"], read)
+    assert results[0] == ({"a": 1}, None)
+    assert len(results) == 2 and isinstance(results[1][1], json.JSONDecodeError)
+    assert len(read) == 1
+
+async def test_ndjson_keeps_going_past_a_bad_line():
+    results = await decode([b'{"a": 1}\n{"b": \n', b'{"c": 3}'])
+    assert results[0] == ({"a": 1}, None) and results[2] == ({"c": 3}, None)
+    assert isinstance(results[1][1], json.JSONDecodeError)
+
+async def test_unclosed_array():
+    results = await decode([b'[{"a": 1}, {"b": '])
+    assert results[0] == ({"a": 1}, None) and isinstance(results[1][1], ValueError)
@@ -0,0 +1,137 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.core import database
+from app.core.cache import media_cache
+from app.core.proto.media_info_pb2 import BatchMediaLookupResponse # type: ignore
+from app.torrents import routes, services, utils
+from app.torrents.models import MediaDataResponse, OmnistreamMetadata
+from app.torrents.routes import PROTOBUF_MEDIA_TYPE
+from app.torrents.routes import router
+from .helpers import make_summary, ids_on_shards
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def client(shards):
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+async def test_etag_lookups_use_the_media_cache(client):
+    unique_id, = ids_on_shards(1)
+    await services.write_media_summary(make_summary(unique_id, "aa" * 16))
+
+    first = await client.get("/api/v1/torrents/media", params={"unique_id": unique_id})
+    hits = media_cache.hits
+    second = await client.get("/api/v1/torrents/media", params={"unique_id": unique_id})
+    assert media_cache.hits == hits + 1
+    assert second.content == first.content and second.headers["etag"] == first.headers["etag"]
+
+    await services.write_media_summary(make_summary(unique_id, "aa" * 16, title="Changed"))
+    changed = await client.get("/api/v1/torrents/media", params={"unique_id": unique_id}, headers={"if-none-match": first.headers["etag"]})
+    assert changed.status_code == 200 and changed.json()["data"][0]["title"] == "Changed"
+
+async def test_not_modified(client):
+    unique_id, = ids_on_shards(1)
+    await services.write_media_summary(make_summary(unique_id, "bb" * 16))
+    response = await client.get("/api/v1/torrents/media", params={"torrent_hash": "bb" * 16})
+    again = await client.get("/api/v1/torrents/media", params={"torrent_hash": "bb" * 16}, headers={"if-none-match": response.headers["etag"]})
+    assert again.status_code == 304 and again.headers["etag"] == response.headers["etag"] and not again.content
+
+async def test_missing_media_is_an_empty_list(client):
+    for response in [
+        await client.get("/api/v1/torrents/media", params={"unique_id": "missing"}),
+        await client.post("/api/v1/torrents/media", json={"unique_id": "missing"}),
+        await client.post("/api/v1/torrents/media", json={"torrent_hash": "cc" * 16, "index": 3}),
+    ]:
+        assert response.status_code == 200
+        assert response.json()["data"] == []
+
+BATCH = {
+    "torrents": [{"torrent_hash": "dd" * 16}, {"torrent_hash": "aa" * 16, "index": 1}, {"torrent_hash": "aa" * 16}],
+    "imdb_ids": ["tt0000009", "tt0000001"],
+}
+
+async def write_batch_medias() -> list:
+    first, second = ids_on_shards(2)
+    await services.write_media_summary(make_summary(first, "aa" * 16, index=0, title="First"))
+    await services.write_media_summary(make_summary(second, "aa" * 16, index=1, title="Second"))
+    return [first, second]
+
+async def test_batch_lookup_in_request_order(shards, client):
+    shards(2)
+    first, second = await write_batch_medias()
+    response = await client.post("/api/v1/torrents/media/batch", json={**BATCH, "unique_ids": [second, "missing", first]})
+    assert response.status_code == 200
+    body = response.json()
+
+    def titles(result: dict) -> list:
+        return sorted(media["title"] for media in result["data"])
+
+    assert [(result["unique_id"], result["found"], titles(result)) for result in body["unique_ids"]] == [
+        (second, True, ["Second"]), ("missing", False, []), (first, True, ["First"])]
+    assert [(result["torrent_hash"], result["index"], result["found"], titles(result)) for result in body["torrents"]] == [
+        ("dd" * 16, None, False, []), ("aa" * 16, 1, True, ["Second"]), ("aa" * 16, None, True, ["First", "Second"])]
+    assert [(result["imdb_id"], result["found"], titles(result)) for result in body["imdb_ids"]] == [
+        ("tt0000009", False, []), ("tt0000001", True, ["First", "Second"])]
+
+async def test_batch_lookup_protobuf_matches_json(shards, client):
+    shards(2)
+    first, second = await write_batch_medias()
+    request = {**BATCH, "unique_ids": [second, "missing", first]}
+    body = (await client.post("/api/v1/torrents/media/batch", json=request)).json()
+    response = await client.post("/api/v1/torrents/media/batch", json=request, headers={"accept": PROTOBUF_MEDIA_TYPE})
+    assert response.status_code == 200 and response.headers["content-type"] == PROTOBUF_MEDIA_TYPE
+    message = BatchMediaLookupResponse.FromString(response.content)
+
+    for field in ("unique_ids", "torrents", "imdb_ids"):
+        results = getattr(message, field)
+        assert len(results) == len(body[field])
+        for result, expected in zip(results, body[field]):
+            assert result.found == expected["found"]
+            assert result.unique_id == (expected["unique_id"] or "") and result.imdb_id == (expected["imdb_id"] or "")
+            assert result.torrent_hash == (expected["torrent_hash"] or "")
+            assert (result.index if result.HasField("index") else None) == expected["index"]
+            data = [utils.omnistream_proto_summary_to_model(summary) for summary in result.data]
+            assert sorted(data, key=lambda media: media.unique_id) == sorted(
+                (OmnistreamMetadata.model_validate(media) for media in expected["data"]), key=lambda media: media.unique_id)
+
+async def test_media_json_splices_what_model_dump_json_gives(shards, client, monkeypatch):
+    shards(2)
+    monkeypatch.setattr(services, "MEDIA_JSON", "write")
+    monkeypatch.setattr(routes, "MEDIA_JSON", "write")
+    first, second = ids_on_shards(2)
+    summaries = {first: make_summary(first, "ee" * 16, index=0, title="Amélie \"Director's Cut\" 2001"), second: make_summary(second, "ee" * 16, index=1)}
+    summaries[first].video_tracks.add(codec="HEVC", width=3840, height=1600, hdr="DV, HDR10")
+    summaries[second].audio_tracks.add(language="Français", format_tag="E-AC-3", channels_tag="5.1", is_commentary=True)
+    await services.write_media_summary(summaries[first])
+    # Written with MEDIA_JSON lazy so it has no stored JSON, the lookup renders it
+    monkeypatch.setattr(services, "MEDIA_JSON", "lazy")
+    await services.write_media_summary(summaries[second])
+
+    def expected(unique_ids: list, next_cursor=None) -> bytes:
+        data = [utils.omnistream_proto_summary_to_model(summaries[unique_id]) for unique_id in unique_ids]
+        return MediaDataResponse(status="success", data=data, next_cursor=next_cursor).model_dump_json().encode("utf-8")
+
+    json_keys = [services.get_media_json_key(unique_id, services.MEDIA_JSON_VERSION) for unique_id in (first, second)]
+    assert [await database.get_shard(unique_id).exists(key) for unique_id, key in zip((first, second), json_keys)] == [1, 0]
+
+    # First round: one media's stored JSON and one rendered on the spot (then out of the model cache), second round: both stored
+    for _ in range(2):
+        response = await client.get("/api/v1/torrents/media", params={"torrent_hash": "ee" * 16})
+        ids = [media["unique_id"] for media in response.json()["data"]]
+        assert sorted(ids) == sorted(summaries) and response.content == expected(ids)
+
+        response = await client.post("/api/v1/torrents/media", json={"imdb_id": "tt0000001"})
+        ids = [media["unique_id"] for media in response.json()["data"]]
+        assert sorted(ids) == sorted(summaries) and response.content == expected(ids)
+
+        response = await client.post("/api/v1/torrents/media", json={"torrent_hash": "ee" * 16, "index": 1})
+        assert response.content == expected([second])
+        media_cache.clear()
+
+    response = await client.post("/api/v1/torrents/media", json={"imdb_id": "tt0000001", "page_size": 1})
+    body = response.json()
+    assert body["next_cursor"] and response.content == expected([body["data"][0]["unique_id"]], body["next_cursor"])
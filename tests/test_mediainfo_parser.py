@@ -0,0 +1,30 @@
+import random
+import pytest
+from app.torrents import utils
+from app.torrents.utils import parse_mediainfo_text_to_dict
+from benchmarks.mediainfo_text_parser import legacy_parse_mediainfo_text_to_dict, load_corpus, mutate
+
+CORPUS = load_corpus()
+
+@pytest.mark.parametrize("name", CORPUS)
+def test_matches_the_old_parser(name):
+    report = CORPUS[name]
+    assert parse_mediainfo_text_to_dict(report) == legacy_parse_mediainfo_text_to_dict(report)
+
+@pytest.mark.parametrize("name", CORPUS)
+def test_matches_the_old_parser_on_mangled_reports(name):
+    rng = random.Random(name)
+    for _ in range(500):
+        report = mutate(CORPUS[name], rng)
+        assert parse_mediainfo_text_to_dict(report) == legacy_parse_mediainfo_text_to_dict(report), report
+
+def test_known_keys_dont_change_the_result(monkeypatch):
+    report = ("General\n: orphan\n : value\n..Format    : Matroska\nConformance errors : 1\n Matroska : Yes\n \n"
+              "Audio #2\nMr. Smith : x\n\nAudio\nFormat    : AAC\n")
+    monkeypatch.setattr(utils, "MEDIAINFO_KEYS", {})
+    cold = parse_mediainfo_text_to_dict(report)
+    assert "" not in utils.MEDIAINFO_KEYS and " " not in utils.MEDIAINFO_KEYS
+    assert "Conformance errors" not in utils.MEDIAINFO_KEYS.values()
+    assert parse_mediainfo_text_to_dict(report) == cold == legacy_parse_mediainfo_text_to_dict(report)
+    assert cold["General"]["Errors"] == {"Conformance errors": "1", "Matroska": "Yes"}
+    assert cold["Audio"] == [{"Mr": "Smith : x"}, {"Format": "AAC"}]
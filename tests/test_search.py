@@ -0,0 +1,70 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.core import database
+from app.torrents import services
+from app.torrents.keyspace import get_unique_id
+from app.torrents.routes import router
+from .helpers import make_summary, ids_on_shards
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def client(shards):
+    shards(2)
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+def make_media(unique_id: str, imdb_id: str, width: int, height: int, hdr: str, audio: list, subtitles: list):
+    summary = make_summary(unique_id, imdb_id=imdb_id, title=unique_id)
+    summary.video_tracks.add(width=width, height=height, hdr=hdr)
+    for format_tag, channels_tag in audio:
+        summary.audio_tracks.add(format_tag=format_tag, channels_tag=channels_tag)
+    for language in subtitles:
+        summary.subtitle_tracks.add(language=language)
+    return summary
+
+async def search(client, **filters) -> list:
+    response = await client.post("/api/v1/torrents/search", json=filters)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["total"] == len(body["data"]) or "limit" in filters
+    return [media["unique_id"] for media in body["data"]]
+
+async def test_filters_are_intersected(client):
+    uhd, hd, other_title = sorted(ids_on_shards(2) + ids_on_shards(2, start=100)[:1])
+    await services.write_media_summary(make_media(uhd, "tt0000001", 3840, 1600, "DV, HDR10", [("Atmos", "7.1"), ("AC-3", "2.0")], ["English", "French"]))
+    await services.write_media_summary(make_media(hd, "tt0000001", 1920, 1080, "SDR", [("DTS-HD MA", "5.1")], ["English"]))
+    await services.write_media_summary(make_media(other_title, "tt0000002", 3840, 2160, "HDR10", [("Atmos", "5.1")], []))
+
+    assert await search(client, resolution="2160p") == sorted([uhd, other_title])
+    assert await search(client, resolution="2160p", imdb_id="tt0000001") == [uhd]
+    assert await search(client, hdr=["dv", "HDR10"]) == [uhd]
+    assert await search(client, hdr=["HDR10"]) == sorted([uhd, other_title])
+    # Track values don't have to come from the same track
+    assert await search(client, audio_formats=["Atmos"], audio_channels=["2.0"]) == [uhd]
+    assert await search(client, audio_formats=["Atmos"], audio_channels=["5.1"]) == [other_title]
+    assert await search(client, subtitle_languages=["english"]) == sorted([uhd, hd])
+    assert await search(client, subtitle_languages=["English", "French"], resolution="1080p") == []
+    assert await search(client, resolution="720p") == []
+    assert await search(client, audio_formats=["Atmos"], limit=1) == [min(uhd, other_title)]
+    response = await client.post("/api/v1/torrents/search", json={"audio_formats": ["Atmos"], "limit": 1})
+    assert response.json()["total"] == 2
+
+async def test_changed_media_leaves_its_old_index_entries(client):
+    unique_id = ids_on_shards(2)[1]
+    await services.write_media_summary(make_media(unique_id, "tt0000001", 3840, 2160, "DV", [("Atmos", "7.1")], ["English"]))
+    await services.write_media_summary(make_media(unique_id, "tt0000001", 1920, 1080, "SDR", [("AAC", "2.0")], ["German"]))
+
+    assert await search(client, resolution="2160p") == []
+    assert await search(client, hdr=["DV"]) == []
+    assert await search(client, audio_formats=["Atmos"]) == []
+    assert await search(client, subtitle_languages=["English"]) == []
+    assert await search(client, resolution="1080p", audio_formats=["aac"], audio_channels=["2.0"], subtitle_languages=["German"]) == [unique_id]
+
+    client = database.get_shards()[database.get_shard_index(unique_id)]
+    for attribute, value in [("resolution", "2160p"), ("hdr", "dv"), ("audio", "atmos"), ("channels", "7.1"), ("subtitle", "english")]:
+        members = await client.smembers(services.layout.search_key(attribute, value))
+        assert unique_id not in {get_unique_id(member) for member in members}, (attribute, value)
@@ -0,0 +1,104 @@
+import argparse
+import pytest
+from app.torrents import keyspace, services
+from app.torrents.keyspace import get_layout
+from tools import migrate_keyspace
+from .helpers import make_summary, ids_on_shards
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture(params=["keys", "buckets"])
+def layout(request, monkeypatch):
+    layout = get_layout(request.param)
+    monkeypatch.setattr(services, "layout", layout)
+    monkeypatch.setattr(services, "write_layouts", [layout])
+    return layout
+
+async def write_bulk(*summaries):
+    async def iterate():
+        for summary in summaries:
+            yield summary
+    return await services.create_media_summaries_from_protos(iterate())
+
+async def torrent_lookups(thash: str):
+    return await services.get_unique_id_from_torrent_index(thash, "0"), await services.get_unique_ids_from_torrent_hash(thash)
+
+@pytest.mark.parametrize("bulk", [False, True])
+async def test_torrent_file_moves_between_shards(shards, layout, bulk):
+    shards(2)
+    first, second = ids_on_shards(2)
+    write = write_bulk if bulk else services.write_media_summary
+
+    for owner, other in [(first, second), (second, first), (first, second)]:
+        await write(make_summary(owner, "aa" * 16, 0))
+        assert await torrent_lookups("aa" * 16) == (owner, [owner])
+
+async def test_rewriting_a_file_takes_it_back(shards, layout):
+    shards(3)
+    first, second, _ = ids_on_shards(3)
+    await services.write_media_summary(make_summary(first, "bb" * 16, 0))
+    await services.write_media_summary(make_summary(second, "bb" * 16, 0))
+    # Same blob and entries as before, only the file moved away in between
+    response = await services.write_media_summary(make_summary(first, "bb" * 16, 0))
+    assert response.change == "updated"
+    assert await torrent_lookups("bb" * 16) == (first, [first])
+
+async def test_other_files_of_the_torrent_stay(shards, layout):
+    shards(2)
+    first, second = ids_on_shards(2)
+    await write_bulk(make_summary(first, "cc" * 16, 0), make_summary(second, "cc" * 16, 1))
+    assert sorted(await services.get_unique_ids_from_torrent_hash("cc" * 16)) == sorted([first, second])
+    assert await services.get_unique_id_from_torrent_index("cc" * 16, "1") == second
+
+async def test_single_shard_writes_stay_on_it(shards, layout):
+    client, = shards(1)
+    unique_id, = ids_on_shards(1)
+    await services.write_media_summary(make_summary(unique_id, "dd" * 16, 0))
+    assert await torrent_lookups("dd" * 16) == (unique_id, [unique_id])
+
+async def test_buckets_layout_keeps_the_count_it_was_filled_with(shards):
+    clients = shards(2)
+    first = get_layout("buckets")
+    await first.prepare(clients)
+    assert [int(await client.get(keyspace.KEYSPACE_BUCKETS_KEY)) for client in clients] == [first.buckets] * 2
+
+    await clients[0].set(keyspace.KEYSPACE_BUCKETS_KEY, 2048)
+    await clients[1].set(keyspace.KEYSPACE_BUCKETS_KEY, 2048)
+    second = get_layout("buckets")
+    await second.prepare(clients)
+    assert second.buckets == 2048
+
+    await clients[1].set(keyspace.KEYSPACE_BUCKETS_KEY, 4096)
+    with pytest.raises(RuntimeError):
+        await get_layout("buckets").prepare(clients)
+
+async def test_overflowing_buckets_are_reported(shards, capsys, monkeypatch):
+    client, = shards()
+    monkeypatch.setattr(keyspace, "KEYSPACE_BUCKET_ENTRIES", 2)
+    layout = keyspace.BucketsLayout(buckets=1)
+    await layout.prepare([client])
+    assert "too few" not in capsys.readouterr().out
+    for unique_id in [f"{i:032x}" for i in range(3)]:
+        await layout.queue_write(client, make_summary(unique_id), b"blob")
+    await layout.prepare([client])
+    assert "1 buckets are too few" in capsys.readouterr().out
+
+async def test_size_picks_the_bucket_count_from_the_records(shards, monkeypatch):
+    clients = shards(2)
+    keys_layout = get_layout("keys")
+    monkeypatch.setattr(services, "layout", keys_layout)
+    monkeypatch.setattr(services, "write_layouts", [keys_layout])
+    for unique_id in ids_on_shards(2):
+        await services.write_media_summary(make_summary(unique_id))
+
+    await migrate_keyspace.size(argparse.Namespace(records=0))
+    assert [int(await client.get(keyspace.KEYSPACE_BUCKETS_KEY)) for client in clients] == [1024, 1024]
+    await migrate_keyspace.size(argparse.Namespace(records=2 * 64 * 5000))
+    assert int(await clients[0].get(keyspace.KEYSPACE_BUCKETS_KEY)) == 8192
+
+    buckets_layout = get_layout("buckets")
+    await buckets_layout.prepare(clients)
+    assert buckets_layout.buckets == 8192
+    await buckets_layout.queue_write(clients[0], make_summary(ids_on_shards(2)[0]), b"blob")
+    with pytest.raises(SystemExit):
+        await migrate_keyspace.size(argparse.Namespace(records=0))
@@ -0,0 +1,48 @@
+import argparse
+import fakeredis
+import pyarrow.parquet as pq
+import pytest
+from app.core import database
+from app.torrents import services
+from tools import snapshot
+from .helpers import make_summary, ids_on_shards
+
+pytestmark = pytest.mark.anyio
+
+def stale_replicas(shards) -> list:
+    """
+    One shard whose replica is its own (empty) server, like one that fell behind.
+    """
+    primary, = shards(1)
+    replica = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+    database.set_shards([primary], replicas=[[replica]])
+    return [primary, replica]
+
+def export_args(directory, replicas: bool = False) -> argparse.Namespace:
+    return argparse.Namespace(directory=str(directory), batch=100, row_group=100, compression="zstd", replicas=replicas, max_lag=5)
+
+def exported_ids(directory) -> list:
+    return pq.read_table(directory / "media.parquet").column("unique_id").to_pylist()
+
+async def test_export_reads_the_primaries(shards, tmp_path):
+    stale_replicas(shards)
+    unique_id, = ids_on_shards(1)
+    await services.write_media_summary(make_summary(unique_id, "aa" * 16))
+
+    await snapshot.export(export_args(tmp_path))
+    assert exported_ids(tmp_path) == [unique_id]
+
+async def test_export_skips_replicas_that_are_behind(shards, tmp_path, monkeypatch):
+    primary, replica = stale_replicas(shards)
+    unique_id, = ids_on_shards(1)
+    await services.write_media_summary(make_summary(unique_id, "aa" * 16))
+
+    # fakeredis doesn't report a link to a primary, so it counts as still syncing
+    assert await snapshot.export_client(0, True, 5) is primary
+    await snapshot.export(export_args(tmp_path, replicas=True))
+    assert exported_ids(tmp_path) == [unique_id]
+
+    async def caught_up(client):
+        return 0.0
+    monkeypatch.setattr(snapshot, "replica_lag", caught_up)
+    assert await snapshot.export_client(0, True, 5) is replica
@@ -0,0 +1,89 @@
+import json
+from collections import deque
+from pathlib import Path
+import threading
+import httpx
+import pytest
+from app.core.executor import ParseQueueFull, ParseTimeout
+from app.torrents import services
+from app.torrents.utils import tracker_torrent_hash
+
+pytestmark = pytest.mark.anyio
+
+FIXTURES = Path(__file__).parent.parent / "benchmarks" / "fixtures"
+
+@pytest.fixture
+async def client(shards):
+    from main import app
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+def tracker_upload(name: str = "movie_uhd_remux_dv") -> dict:
+    return json.loads((FIXTURES / "unit3d" / f"{name}.json").read_bytes())
+
+async def test_tracker_upload(client):
+    response = await client.post("/api/v1/torrents/upload/tracker", json=tracker_upload())
+    assert response.status_code == 200
+    assert response.json()["status"] == "success" and response.json()["change"] == "created"
+
+@pytest.mark.parametrize("error, status", [(ParseQueueFull("full"), 503), (ParseTimeout("slow"), 504)])
+async def test_tracker_upload_overload(client, monkeypatch, error, status):
+    async def run_parser(*args):
+        raise error
+    monkeypatch.setattr(services, "run_parser", run_parser)
+
+    response = await client.post("/api/v1/torrents/upload/tracker", json=tracker_upload())
+    assert response.status_code == status
+    if status == 503:
+        assert response.headers["retry-after"]
+
+async def test_bad_tracker_upload_still_fails_softly(client):
+    upload = tracker_upload()
+    upload["attributes"]["media_info"] = "not a report"
+    response = await client.post("/api/v1/torrents/upload/tracker", json=upload)
+    assert response.status_code == 200 and response.json()["status"] == "failed"
+
+def without_unique_id(info_hash: str, complete_name: str) -> dict:
+    upload = tracker_upload()
+    lines = upload["attributes"]["media_info"].splitlines()
+    lines = [line for line in lines if not line.startswith("Unique ID")]
+    lines = [f"Complete name : {complete_name}" if line.startswith("Complete name") else line for line in lines]
+    upload["attributes"]["media_info"] = "\n".join(lines)
+    upload["attributes"]["info_hash"] = info_hash
+    return upload
+
+async def test_reports_without_unique_id_only_share_a_record_when_the_file_does(client):
+    first = await client.post("/api/v1/torrents/upload/tracker", json=without_unique_id("aa" * 20, "Movie.2024.mkv"))
+    other = await client.post("/api/v1/torrents/upload/tracker", json=without_unique_id("bb" * 20, "Other.Movie.2024.mkv"))
+    cross_seed = await client.post("/api/v1/torrents/upload/tracker", json=without_unique_id("cc" * 20, "Some.Dir/Movie.2024.mkv"))
+    assert other.json()["unique_id"] != first.json()["unique_id"]
+    assert cross_seed.json()["unique_id"] == first.json()["unique_id"]
+
+    # The second upload was a parse cache hit of the first report, it mustn't take over the first torrent's entry
+    response = await client.get("/api/v1/torrents/media", params={"torrent_hash": tracker_torrent_hash("bb" * 20)})
+    assert [media["unique_id"] for media in response.json()["data"]] == [other.json()["unique_id"]]
+    response = await client.get("/api/v1/torrents/media", params={"torrent_hash": tracker_torrent_hash("cc" * 20)})
+    assert [media["unique_id"] for media in response.json()["data"]] == [first.json()["unique_id"]]
+
+async def test_metrics_are_read_on_the_event_loop(client, monkeypatch):
+    from app.core import cache, metrics, profiler
+    threads = []
+    monkeypatch.setattr(metrics, "collectors", [*metrics.collectors, lambda: threads.append(threading.get_ident()) or []])
+    stats = cache.media_cache.stats
+    monkeypatch.setattr(cache.media_cache, "stats", lambda: threads.append(threading.get_ident()) or stats())
+
+    class Profiles(deque):
+        def __iter__(self):
+            threads.append(threading.get_ident())
+            return super().__iter__()
+        def __reversed__(self):
+            threads.append(threading.get_ident())
+            return super().__reversed__()
+    monkeypatch.setattr(profiler, "profiles", Profiles())
+    monkeypatch.setattr(profiler, "PROFILE_TOKEN", "token")
+
+    assert (await client.get("/metrics")).status_code == 200
+    assert (await client.get("/api/v1/health")).json()["status"] == "ok"
+    assert (await client.get("/admin/profiles", headers={profiler.PROFILE_HEADER: "token"})).json() == []
+    assert (await client.get("/admin/profiles/missing", headers={profiler.PROFILE_HEADER: "token"})).status_code == 404
+    assert len(threads) >= 4 and set(threads) == {threading.get_ident()}
@@ -0,0 +1,309 @@
+"""
+Imports archives of MediaInfo JSON exports and UNIT3D torrent JSON straight into the database, skipping the HTTP API.
+
+    python -m tools.import_archive PATH [PATH ...] [--kind auto] [--workers 8] [--batch 2000] [--chunk 100]
+        [--checkpoint import.checkpoint.json] [--errors import.errors.ndjson] [--restart]
+
+PATH is a file or a directory, directories are walked (in name order) for *.json, *.ndjson and *.jsonl,
+optionally compressed as .gz, .bz2, .xz or .zst. A .json file is one record holding a document, an array of them
+or a UNIT3D API page ({"data": [...]}), .ndjson/.jsonl files have a record per line.
+--kind auto tells MediaInfo exports ("media") and UNIT3D torrents ("attributes") apart by their keys.
+
+Records are validated and parsed on --workers processes with the same functions the API uses, and written
+in pipelines of --batch media per shard. Progress is saved to --checkpoint after every batch, running the same
+command again skips what's already been written (a file that changed since starts over, --restart ignores it all).
+Whatever got written after the last checkpoint before being killed is written again on resume.
+Every record that failed to parse or write goes to --errors with its file and record number.
+Connects with the same REDIS_*, KEYSPACE_* and MEDIA_COMPRESSION settings as the app.
+"""
+import argparse
+import asyncio
+import bz2
+import gzip
+import json
+import lzma
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from app.core import blobs
+from app.core.executor import PARSE_START_METHOD
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+from app.torrents import models, utils
+from app.torrents.services import get_media_pipeline, queue_media_summary, flush_media_pipelines
+
+OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+if blobs.zstd is not None:
+    OPENERS[".zst"] = blobs.zstd.open
+DOCUMENT_SUFFIXES = (".json", ".ndjson", ".jsonl")
+
+def document_suffix(path: str) -> tuple:
+    """
+    (".json"/".ndjson"/".jsonl", compression suffix or "") of an importable file, None for anything else.
+    """
+    stem, compression = os.path.splitext(path)
+    if compression.lower() not in OPENERS:
+        stem, compression = path, ""
+    suffix = os.path.splitext(stem)[1].lower()
+    return (suffix, compression.lower()) if suffix in DOCUMENT_SUFFIXES else None
+
+def find_files(paths: list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names) if document_suffix(name))
+        elif document_suffix(path):
+            files.append(path)
+        else:
+            print(f"Skipping {path}, not a .json/.ndjson/.jsonl file (or one of those compressed)")
+    return [os.path.abspath(path) for path in files]
+
+def read_records(path: str):
+    """
+    Yields the raw records of a file, the whole file for .json and every non blank line otherwise.
+    """
+    suffix, compression = document_suffix(path)
+    with OPENERS.get(compression, open)(path, "rb") as f:
+        if suffix == ".json":
+            yield f.read()
+            return
+        for line in f:
+            if line.strip():
+                yield line
+
+def parse_document(kind: str, document: dict) -> bytes:
+    if kind == "auto":
+        kind = "tracker" if "attributes" in document else "mediainfo"
+    if kind == "tracker":
+        return utils.parse_tracker_json_to_proto_bytes(models.Unit3dTorrent.model_validate(document))
+    return utils.parse_mediainfo_export_to_proto_bytes(models.MediaInfoExport.model_validate(document))
+
+def parse_records(kind: str, records: list) -> list:
+    """
+    Runs on the worker processes, gives back a list of (serialized proto, None) or (None, error) for each record.
+    A record holding several documents gets a result for each of them.
+    """
+    results = []
+    for record in records:
+        try:
+            documents = json.loads(record)
+        except ValueError as e:
+            results.append([(None, f"Invalid JSON: {e}")])
+            continue
+        if isinstance(documents, dict) and isinstance(documents.get("data"), list):
+            documents = documents["data"]
+        if not isinstance(documents, list):
+            documents = [documents]
+
+        parsed = []
+        for document in documents:
+            try:
+                parsed.append((parse_document(kind, document), None))
+            except Exception as e:
+                parsed.append((None, f"{type(e).__name__}: {e}"))
+        results.append(parsed)
+    return results
+
+class Checkpoint:
+    """
+    Records written so far of each file, plain JSON so it can be looked at or edited by hand.
+    A file is keyed by its path and only trusted while its size and mtime are the same.
+    """
+
+    def __init__(self, path: str, restart: bool = False):
+        self.path = path
+        self.files = {}
+        if path and os.path.exists(path) and not restart:
+            with open(path) as f:
+                self.files = json.load(f)["files"]
+
+    def signature(self, path: str) -> dict:
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def resume_from(self, path: str) -> tuple:
+        """
+        (records already written, whether the whole file is done).
+        """
+        entry = self.files.get(path)
+        if entry is None:
+            return 0, False
+        if {"size": entry["size"], "mtime": entry["mtime"]} != self.signature(path):
+            print(f"{path} changed since the last run, importing it again from the start")
+            return 0, False
+        return entry["records"], entry["done"]
+
+    def update(self, path: str, records: int, done: bool):
+        self.files[path] = {**self.signature(path), "records": records, "done": done}
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"files": self.files}, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+class Importer:
+    """
+    Reads records in order, parses them chunk by chunk on the worker pool (up to two chunks per worker in flight)
+    and writes the results in the same order, so everything before the last flushed batch is safely in.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.checkpoint = Checkpoint(args.checkpoint, args.restart)
+        self.errors = open(args.errors, "a") if args.errors else None
+        self.stats = Counter()
+        self.file_errors = Counter()
+        self.pipes = {}
+        self.results = []
+        self.labels = [] # (path, record) of each queued result
+        self.progress = {} # path -> [records consumed, whether that's all of them]
+        self.started = self.last_report = time.perf_counter()
+
+    def error(self, path: str, record: str, message: str):
+        self.stats["failed"] += 1
+        self.file_errors[path] += 1
+        if self.errors:
+            self.errors.write(json.dumps({"file": path, "record": record, "error": message}) + "\n")
+
+    def iter_chunks(self, files: list):
+        """
+        Yields (path, index of the first record, records, whether it's the end of the file) chunks,
+        skipping what the checkpoint says is written. A file that can't be read to the end never gets its end.
+        """
+        for path in files:
+            skip, done = self.checkpoint.resume_from(path)
+            if done:
+                self.stats["skipped files"] += 1
+                continue
+            self.progress[path] = [skip, False]
+            chunk = []
+            start = skip
+            try:
+                for index, record in enumerate(read_records(path)):
+                    if index < skip:
+                        continue
+                    chunk.append(record)
+                    if len(chunk) >= self.args.chunk:
+                        yield path, start, chunk, False
+                        start += len(chunk)
+                        chunk = []
+            except (OSError, EOFError, lzma.LZMAError) as e:
+                self.error(path, "", f"Could not read the file: {e}")
+                yield path, start, chunk, False
+                continue
+            yield path, start, chunk, True
+
+    async def handle(self, path: str, start: int, results: list):
+        for offset, parsed in enumerate(results):
+            record = start + offset
+            for position, (data, error) in enumerate(parsed):
+                label = str(record) if len(parsed) == 1 else f"{record}[{position}]"
+                self.stats["documents"] += 1
+                if error is not None:
+                    self.error(path, label, error)
+                    continue
+                summary_proto = OmnistreamProtoSummary.FromString(data)
+                pipe, pending = get_media_pipeline(self.pipes, summary_proto.unique_id)
+                self.labels.append((path, label))
+                self.results.append(await queue_media_summary(pipe, pending, len(self.results), summary_proto))
+        self.stats["records"] += len(results)
+        self.progress[path][0] = start + len(results)
+
+        if len(self.results) >= self.args.batch:
+            await self.flush()
+
+    async def flush(self):
+        await flush_media_pipelines(self.pipes, self.results)
+        for (path, label), result in zip(self.labels, self.results):
+            if result.status == models.JobStatus.FAILED:
+                self.error(path, label, f"Write failed: {result.error}")
+            else:
+                self.stats["written"] += 1
+                self.stats[f"change {result.change.value}" if result.change else "change unknown"] += 1
+        self.results, self.labels = [], []
+
+        for path, (records, done) in self.progress.items():
+            self.checkpoint.update(path, records, done)
+        self.progress = {path: progress for path, progress in self.progress.items() if not progress[1]}
+        self.checkpoint.save()
+        if self.errors:
+            self.errors.flush()
+
+    async def run(self, files: list):
+        loop = asyncio.get_running_loop()
+        in_flight = []
+        with ProcessPoolExecutor(max_workers=self.args.workers, mp_context=multiprocessing.get_context(PARSE_START_METHOD)) as executor:
+            for path, start, chunk, last in self.iter_chunks(files):
+                future = loop.run_in_executor(executor, parse_records, self.args.kind, chunk) if chunk else None
+                in_flight.append((path, start, future, last))
+                while len(in_flight) > self.args.workers * 2:
+                    await self.next_result(in_flight)
+            while in_flight:
+                await self.next_result(in_flight)
+        await self.flush()
+
+    async def next_result(self, in_flight: list):
+        path, start, future, last = in_flight.pop(0)
+        if future is not None:
+            await self.handle(path, start, await future)
+        if last:
+            self.progress[path][1] = True
+        self.report_progress()
+
+    def report_progress(self):
+        now = time.perf_counter()
+        if now - self.last_report < 10:
+            return
+        self.last_report = now
+        print(f"{self.stats['documents']} documents, {self.stats['written']} written, {self.stats['failed']} failed ({self.stats['documents'] / (now - self.started):.0f}/s)")
+
+async def run(args):
+    files = find_files(args.paths)
+    if not files:
+        sys.exit("Nothing to import.")
+    await blobs.load_dictionaries()
+
+    importer = Importer(args)
+    try:
+        await importer.run(files)
+    finally:
+        if importer.errors:
+            importer.errors.close()
+    elapsed = time.perf_counter() - importer.started
+
+    stats = importer.stats
+    print(f"\n{len(files)} files ({stats['skipped files']} already done), {stats['records']} records, {stats['documents']} documents in {elapsed:.1f}s")
+    print(f"{stats['written']} written, {stats['failed']} failed, {stats['documents'] / elapsed:.0f} documents/s")
+    changes = ", ".join(f"{count} {what.split(' ', 1)[1]}" for what, count in sorted(stats.items()) if what.startswith("change "))
+    if changes:
+        print(f"Changes: {changes}")
+    if importer.file_errors:
+        print("Errors per file:")
+        for path, count in importer.file_errors.most_common(20):
+            print(f"  {count:>8}  {path}")
+        if len(importer.file_errors) > 20:
+            print(f"  ... and {len(importer.file_errors) - 20} more files")
+        if args.errors:
+            print(f"Every error is in {args.errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Files or directories to import")
+    parser.add_argument("--kind", choices=("auto", "mediainfo", "tracker"), default="auto", help="What the documents are")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parsing processes")
+    parser.add_argument("--batch", type=int, default=2000, help="Media written per pipeline flush (and checkpoint)")
+    parser.add_argument("--chunk", type=int, default=100, help="Records handed to a worker at once")
+    parser.add_argument("--checkpoint", default="import.checkpoint.json", help="Progress file, empty to not keep one")
+    parser.add_argument("--errors", default="import.errors.ndjson", help="NDJSON file failed records are appended to, empty for none")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and import everything again")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Runs ingest workers outside the API, taking the uploads queued with Prefer: respond-async (or INGEST_ASYNC) off the stream.
+
+    python -m tools.ingest_worker [--workers 4]
+
+Lets the parsing and writing of queued uploads scale apart from the API, run the API with INGEST_WORKERS=0
+so it only queues them. Any number of these can run at once, every worker is its own consumer of the group
+and a job a worker died on goes to another one after INGEST_CLAIM_IDLE.
+Connects with the same REDIS_*, KEYSPACE_*, MEDIA_COMPRESSION and PARSE_* settings as the app.
+"""
+import argparse
+import asyncio
+
+from app.core import blobs
+from app.core.database import get_shards
+from app.core.executor import start_parse_executor, shutdown_parse_executor
+from app.torrents.jobs import INGEST_WORKERS, run_ingest_workers
+
+async def run(args):
+    await asyncio.gather(*[client.ping() for client in get_shards()])
+    await blobs.load_dictionaries()
+    start_parse_executor()
+    print(f"Running {args.workers} ingest workers")
+    try:
+        await run_ingest_workers(args.workers)
+    finally:
+        shutdown_parse_executor()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=max(INGEST_WORKERS, 1), help="Jobs run at once")
+    try:
+        asyncio.run(run(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
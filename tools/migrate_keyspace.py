@@ -0,0 +1,147 @@
+"""
+Moves stored media from one keyspace layout (see app/torrents/keyspace.py) to another while the app keeps running.
+
+    python -m tools.migrate_keyspace size [--records N]
+    python -m tools.migrate_keyspace copy --from keys --to buckets [--batch 500]
+    python -m tools.migrate_keyspace cleanup --from keys [--batch 500]
+
+0. Going to buckets, size picks the bucket count from the media in the keys layout (or --records, to leave room for growth)
+   and saves it on the shards, where the app reads it from. It also raises hash-max-listpack-value where it's too low
+   (better set in the server config too so a restart keeps it). Once the buckets layout holds media its count is fixed.
+1. Run the app with KEYSPACE_SHADOW=buckets, every write and removal now goes to both layouts.
+2. copy writes every media of the old layout into the new one with the new layout's write script,
+   then reads the batch back from the old layout and copies again (or removes) whatever changed underneath,
+   so a write that lands mid copy is never undone. Media the shadow already wrote come out unchanged.
+3. Switch to KEYSPACE_LAYOUT=buckets (keep KEYSPACE_SHADOW=keys for a while to be able to switch back).
+4. Drop KEYSPACE_SHADOW and run cleanup, which removes every media of the old layout and its index entries.
+
+Both layouts live side by side on the same shards, so there has to be room for both until cleanup.
+Connects with the same REDIS_* settings as the app.
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+
+from app.core import blobs
+from app.core.database import get_shards
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+from app.torrents.keyspace import LAYOUTS, KEYSPACE_BUCKETS_KEY, KEYSPACE_LISTPACK_VALUE, buckets_for, get_layout
+from app.torrents.services import KEYSPACE_LAYOUT, KEYSPACE_SHADOW
+
+async def read_protos(batch: list) -> list:
+    return [OmnistreamProtoSummary.FromString(data) for data in await blobs.unpack_media_blobs([blob for _, blob in batch])]
+
+async def copy_batch(redis_client, source, target, batch: list, stats: Counter):
+    """
+    Copies a batch of (unique id, blob) into target until what was copied is still what source has.
+    """
+    protos = {}
+    while batch:
+        pipe = redis_client.pipeline(transaction=False)
+        stored = [(unique_id, blob) for unique_id, blob in batch if blob]
+        for (unique_id, _), proto in zip(stored, await read_protos(stored)):
+            protos[unique_id] = proto
+        for unique_id, blob in batch:
+            proto = protos[unique_id]
+            if blob:
+                await target.queue_write(pipe, proto, blob)
+            else:
+                await target.queue_removal(pipe, unique_id, proto.torrent_hash, proto.torrent_file_index, proto.imdb_id)
+
+        for (_, blob), reply in zip(batch, await pipe.execute()):
+            stats[reply.decode("utf-8") if blob else "removed"] += 1
+
+        current = await source.read_media(redis_client, [unique_id for unique_id, _ in batch])
+        batch = [(unique_id, blob) for (unique_id, copied), blob in zip(batch, current) if blob != copied]
+        if batch:
+            stats["changed underneath"] += len(batch)
+
+async def raise_listpack_value(shard: int, redis_client):
+    """
+    Raises the shard's hash-max-listpack-value to KEYSPACE_LISTPACK_VALUE if it's lower so media and ref buckets
+    keep the small hash encoding, only prints if the server won't say or won't take it (managed servers often block CONFIG).
+    """
+    try:
+        config = await redis_client.config_get("hash-max-listpack-value")
+        if not config:
+            print(f"Shard {shard} has no hash-max-listpack-value, check media buckets with blobs over 64 bytes still get a small encoding")
+        elif int(next(iter(config.values()))) < KEYSPACE_LISTPACK_VALUE:
+            await redis_client.config_set("hash-max-listpack-value", KEYSPACE_LISTPACK_VALUE)
+            print(f"Shard {shard}: raised hash-max-listpack-value to {KEYSPACE_LISTPACK_VALUE}, put it in the server config too")
+    except Exception as e:
+        print(f"Couldn't raise hash-max-listpack-value of shard {shard} to {KEYSPACE_LISTPACK_VALUE}, media buckets will use the hashtable encoding: {e}")
+
+async def size(args):
+    shards = get_shards()
+    buckets_layout = get_layout("buckets")
+    if any(await asyncio.gather(*[buckets_layout.count_media(redis_client) for redis_client in shards])):
+        sys.exit("The buckets layout already holds media, its bucket count can't change anymore (migrate off it and clean it up first).")
+
+    if args.records:
+        records = -(-args.records // len(shards))
+    else:
+        records = max(await asyncio.gather(*[get_layout("keys").count_media(redis_client) for redis_client in shards]))
+    buckets = buckets_for(records)
+    for redis_client in shards:
+        await redis_client.set(KEYSPACE_BUCKETS_KEY, buckets)
+    print(f"About {records} media per shard, the buckets layout gets {buckets} buckets")
+
+    if KEYSPACE_LISTPACK_VALUE:
+        for shard, redis_client in enumerate(shards):
+            await raise_listpack_value(shard, redis_client)
+
+async def copy(args):
+    source, target = get_layout(args.source), get_layout(args.target)
+    if KEYSPACE_SHADOW != args.target and KEYSPACE_LAYOUT != args.target:
+        print(f"KEYSPACE_SHADOW isn't {args.target}, writes made after a media is copied won't reach it")
+    await source.prepare(get_shards())
+    await target.prepare(get_shards())
+
+    for shard, redis_client in enumerate(get_shards()):
+        stats = Counter()
+        async for batch in source.scan_media(redis_client, args.batch):
+            await copy_batch(redis_client, source, target, [(unique_id, blob) for unique_id, blob in batch if blob], stats)
+        print(f"Shard {shard}: {', '.join(f'{count} {what}' for what, count in sorted(stats.items())) or 'nothing to copy'}")
+
+async def cleanup(args):
+    source = get_layout(args.source)
+    if args.source in (KEYSPACE_LAYOUT, KEYSPACE_SHADOW) and not args.force:
+        sys.exit(f"{args.source} is still being written to (KEYSPACE_LAYOUT/KEYSPACE_SHADOW), pass --force to remove it anyway.")
+    await source.prepare(get_shards())
+
+    for shard, redis_client in enumerate(get_shards()):
+        removed = 0
+        async for batch in source.scan_media(redis_client, args.batch):
+            batch = [(unique_id, blob) for unique_id, blob in batch if blob]
+            pipe = redis_client.pipeline(transaction=False)
+            for (unique_id, _), proto in zip(batch, await read_protos(batch)):
+                await source.queue_removal(pipe, unique_id, proto.torrent_hash, proto.torrent_file_index, proto.imdb_id)
+            if batch:
+                removed += sum(1 for deleted in await pipe.execute() if deleted)
+        print(f"Shard {shard}: removed {removed} media")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    size_parser = commands.add_parser("size", help="Pick and save the buckets layout's bucket count before it gets any media")
+    size_parser.add_argument("--records", type=int, default=0, help="Media to size for over all shards, what the keys layout holds if not given")
+
+    copy_parser = commands.add_parser("copy", help="Copy every media into another layout")
+    copy_parser.add_argument("--from", dest="source", choices=LAYOUTS, required=True)
+    copy_parser.add_argument("--to", dest="target", choices=LAYOUTS, required=True)
+    copy_parser.add_argument("--batch", type=int, default=500, help="Media per read/pipeline")
+
+    cleanup_parser = commands.add_parser("cleanup", help="Remove every media of a layout that's no longer used")
+    cleanup_parser.add_argument("--from", dest="source", choices=LAYOUTS, required=True)
+    cleanup_parser.add_argument("--batch", type=int, default=500, help="Media per read/pipeline")
+    cleanup_parser.add_argument("--force", action="store_true", help="Remove it even if this config still writes to it")
+
+    args = parser.parse_args()
+    if args.command == "copy" and args.source == args.target:
+        sys.exit("--from and --to are the same layout.")
+    asyncio.run({"size": size, "copy": copy, "cleanup": cleanup}[args.command](args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Exports every stored media to a columnar snapshot (Parquet) and restores a database from one.
+
+    python -m tools.snapshot export SNAPSHOT_DIR [--batch 1000] [--row-group 50000] [--compression zstd] [--replicas [--max-lag 5]]
+    python -m tools.snapshot restore SNAPSHOT_DIR [--batch 2000] [--force]
+
+A snapshot is a directory with media.parquet (one row per media, one column per scalar field of the proto)
+and a table per track list (video_tracks.parquet, audio_tracks.parquet, subtitle_tracks.parquet) with a row
+per track, tied to its media by media_row (the media's row number) and ordered like the media.
+Columns follow the proto, a field added there shows up in the next export without touching this.
+manifest.json is written last, so a snapshot without one didn't finish and restore refuses it.
+
+export walks every shard's keyspace with SCAN cursors on its primary and reads --batch media per round trip,
+rows go out in row groups of --row-group so memory stays flat whatever the size.
+With --replicas a shard is read from one of its replicas instead, if one is up, done syncing and heard from its
+primary within --max-lag seconds, the primary otherwise. A replica that drops mid export fails it (no manifest),
+a SCAN cursor only means something on the node it came from.
+restore rebuilds the protos batch by batch and writes them with the app's write scripts (indexes included),
+pipelined per shard. It expects an empty database, --force writes over whatever is there.
+Needs pyarrow (pip install pyarrow). Connects with the same REDIS_*, KEYSPACE_* and MEDIA_COMPRESSION settings as the app.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from app.core import blobs, database
+from app.core.database import get_shards, check_replica, get_address
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+from app.torrents import models
+from app.torrents.services import layout, get_media_pipeline, queue_media_summary, flush_media_pipelines
+
+SNAPSHOT_VERSION = 1
+MANIFEST = "manifest.json"
+MEDIA_TABLE = "media"
+MEDIA_ROW = "media_row" # Column of the track tables pointing at the media's row
+
+def arrow_type(field):
+    # Proto scalar types used by the summary, a new type needs adding here
+    return {
+        field.TYPE_STRING: pa.string(),
+        field.TYPE_BOOL: pa.bool_(),
+        field.TYPE_INT32: pa.int32(),
+        field.TYPE_INT64: pa.int64(),
+        field.TYPE_UINT32: pa.uint32(),
+        field.TYPE_UINT64: pa.uint64(),
+        field.TYPE_FLOAT: pa.float32(),
+        field.TYPE_DOUBLE: pa.float64(),
+    }[field.type]
+
+def scalar_fields(descriptor) -> list:
+    return [field for field in descriptor.fields if field.message_type is None]
+
+def track_fields(descriptor) -> list:
+    """
+    The repeated message fields (video_tracks...), each one gets its own table.
+    """
+    return [field for field in descriptor.fields if field.message_type is not None]
+
+def table_schemas() -> dict:
+    """
+    {table name: arrow schema} of a snapshot, from the proto.
+    """
+    descriptor = OmnistreamProtoSummary.DESCRIPTOR
+    schemas = {MEDIA_TABLE: pa.schema([(field.name, arrow_type(field)) for field in scalar_fields(descriptor)])}
+    for track in track_fields(descriptor):
+        columns = [(MEDIA_ROW, pa.int64())] + [(field.name, arrow_type(field)) for field in scalar_fields(track.message_type)]
+        schemas[track.name] = pa.schema(columns)
+    return schemas
+
+class SnapshotWriter:
+    """
+    Buffers rows of every table column by column and writes them out as a row group every row_group media.
+    """
+
+    def __init__(self, directory: str, row_group: int, compression: str):
+        self.directory = directory
+        self.row_group = row_group
+        self.schemas = table_schemas()
+        self.writers = {
+            name: pq.ParquetWriter(os.path.join(directory, f"{name}.parquet"), schema, compression=compression)
+            for name, schema in self.schemas.items()
+        }
+        self.columns = {name: {column: [] for column in schema.names} for name, schema in self.schemas.items()}
+        self.media_fields = scalar_fields(OmnistreamProtoSummary.DESCRIPTOR)
+        self.tracks = [(track.name, scalar_fields(track.message_type)) for track in track_fields(OmnistreamProtoSummary.DESCRIPTOR)]
+        self.rows = {name: 0 for name in self.schemas}
+        self.buffered = 0
+
+    def add(self, summary: OmnistreamProtoSummary):
+        media_row = self.rows[MEDIA_TABLE] + self.buffered
+        columns = self.columns[MEDIA_TABLE]
+        for field in self.media_fields:
+            columns[field.name].append(getattr(summary, field.name))
+        for name, fields in self.tracks:
+            columns = self.columns[name]
+            for track in getattr(summary, name):
+                columns[MEDIA_ROW].append(media_row)
+                for field in fields:
+                    columns[field.name].append(getattr(track, field.name))
+        self.buffered += 1
+        if self.buffered >= self.row_group:
+            self.flush()
+
+    def flush(self):
+        for name, columns in self.columns.items():
+            if not columns[next(iter(columns))]:
+                continue
+            batch = pa.record_batch([columns[column] for column in columns], schema=self.schemas[name])
+            self.writers[name].write_batch(batch)
+            self.rows[name] += batch.num_rows
+            for values in columns.values():
+                values.clear()
+        self.buffered = 0
+
+    def close(self) -> dict:
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+        return dict(self.rows)
+
+class TrackReader:
+    """
+    Hands out the rows of a track table one media row at a time, reading it in batches.
+    """
+
+    def __init__(self, parquet_file, batch_size: int):
+        self.batches = parquet_file.iter_batches(batch_size=batch_size)
+        self.rows = []
+        self.position = 0
+
+    def take(self, media_row: int) -> list:
+        tracks = []
+        while True:
+            if self.position >= len(self.rows):
+                batch = next(self.batches, None)
+                if batch is None:
+                    return tracks
+                self.rows = batch.to_pylist()
+                self.position = 0
+            row = self.rows[self.position]
+            if row[MEDIA_ROW] != media_row:
+                return tracks
+            del row[MEDIA_ROW]
+            tracks.append(row)
+            self.position += 1
+
+def read_tables(directory: str, batch_size: int):
+    """
+    Yields lists of OmnistreamProtoSummary rebuilt from a snapshot, batch_size media at a time.
+    Track tables are read alongside the media table, both are ordered by media row so it's a single pass over each.
+    """
+    media_file = pq.ParquetFile(os.path.join(directory, f"{MEDIA_TABLE}.parquet"))
+    tracks = {}
+    for track in track_fields(OmnistreamProtoSummary.DESCRIPTOR):
+        track_file = pq.ParquetFile(os.path.join(directory, f"{track.name}.parquet"))
+        tracks[track.name] = TrackReader(track_file, batch_size)
+
+    media_row = 0
+    for batch in media_file.iter_batches(batch_size=batch_size):
+        summaries = []
+        for values in batch.to_pylist():
+            summary = OmnistreamProtoSummary(**values)
+            for name, reader in tracks.items():
+                repeated = getattr(summary, name)
+                for track in reader.take(media_row):
+                    repeated.add(**track)
+            summaries.append(summary)
+            media_row += 1
+        yield summaries
+
+async def replica_lag(replica) -> float | None:
+    """
+    Seconds since the replica last heard from its primary, None if it's still syncing or doesn't say.
+    """
+    info = await replica.info("replication")
+    if str(info.get("master_sync_in_progress", 0)) != "0":
+        return None
+    lag = info.get("master_last_io_seconds_ago")
+    return None if lag is None or int(lag) < 0 else float(lag)
+
+async def export_client(shard: int, use_replicas: bool, max_lag: float):
+    """
+    Client to export a shard from, the primary unless use_replicas and one of its replicas is healthy and caught up.
+    """
+    primary = get_shards()[shard]
+    if not use_replicas:
+        return primary
+    for replica in database.shard_replicas[shard]:
+        if not await check_replica(replica):
+            print(f"Shard {shard}: replica {get_address(replica)} is down, skipping it")
+            continue
+        try:
+            lag = await replica_lag(replica)
+        except Exception as e:
+            print(f"Shard {shard}: replica {get_address(replica)} didn't answer INFO replication ({e}), skipping it")
+            continue
+        if lag is None or lag > max_lag:
+            print(f"Shard {shard}: replica {get_address(replica)} is syncing or {lag}s behind, skipping it")
+            continue
+        return replica
+    print(f"Shard {shard}: no usable replica, exporting from the primary")
+    return primary
+
+async def export(args):
+    os.makedirs(args.directory, exist_ok=True)
+    if os.path.exists(os.path.join(args.directory, MANIFEST)):
+        sys.exit(f"{args.directory} already has a snapshot, pick an empty directory.")
+
+    started = time.perf_counter()
+    writer = SnapshotWriter(args.directory, args.row_group, args.compression)
+    try:
+        for shard in range(len(get_shards())):
+            redis_client = await export_client(shard, args.replicas, args.max_lag)
+            exported = 0
+            async for batch in layout.scan_media(redis_client, args.batch):
+                for data in await blobs.unpack_media_blobs([blob for _, blob in batch]):
+                    if data:
+                        writer.add(OmnistreamProtoSummary.FromString(data))
+                        exported += 1
+            print(f"Shard {shard}: {exported} media")
+    finally:
+        rows = writer.close()
+
+    with open(os.path.join(args.directory, MANIFEST), "w") as f:
+        json.dump({"version": SNAPSHOT_VERSION, "created": time.time(), "layout": layout.name, "rows": rows}, f, indent=1)
+    elapsed = time.perf_counter() - started
+    print(f"Exported {rows[MEDIA_TABLE]} media ({', '.join(f'{count} {name}' for name, count in rows.items() if name != MEDIA_TABLE)}) in {elapsed:.1f}s")
+
+async def restore(args):
+    manifest_path = os.path.join(args.directory, MANIFEST)
+    if not os.path.exists(manifest_path):
+        sys.exit(f"No {MANIFEST} in {args.directory}, it isn't a snapshot or its export didn't finish.")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest["version"] != SNAPSHOT_VERSION:
+        sys.exit(f"Snapshot version {manifest['version']} isn't supported (expected {SNAPSHOT_VERSION}).")
+
+    if not args.force:
+        sizes = await asyncio.gather(*[redis_client.dbsize() for redis_client in get_shards()])
+        if any(sizes):
+            sys.exit("The database isn't empty, pass --force to write the snapshot over what's there.")
+    await blobs.load_dictionaries()
+
+    started = time.perf_counter()
+    written = failed = 0
+    for summaries in read_tables(args.directory, args.batch):
+        results = []
+        pipes = {}
+        for summary_proto in summaries:
+            pipe, pending = get_media_pipeline(pipes, summary_proto.unique_id)
+            results.append(await queue_media_summary(pipe, pending, len(results), summary_proto))
+        await flush_media_pipelines(pipes, results)
+        for result in results:
+            if result.status == models.JobStatus.FAILED:
+                failed += 1
+                print(f"Could not write {result.unique_id}: {result.error}")
+            else:
+                written += 1
+
+    elapsed = time.perf_counter() - started
+    print(f"Restored {written} of {manifest['rows'][MEDIA_TABLE]} media in {elapsed:.1f}s ({written / elapsed:.0f}/s), {failed} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Write every stored media to a snapshot directory")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--batch", type=int, default=1000, help="Media per SCAN page/read")
+    export_parser.add_argument("--row-group", type=int, default=50_000, help="Media per Parquet row group")
+    export_parser.add_argument("--compression", default="zstd", help="Parquet compression codec")
+    export_parser.add_argument("--replicas", action="store_true", help="Read from a healthy, caught up replica of each shard instead of its primary")
+    export_parser.add_argument("--max-lag", type=float, default=5, help="Seconds a replica may be behind its primary to be read with --replicas")
+
+    restore_parser = commands.add_parser("restore", help="Write a snapshot's media into the database")
+    restore_parser.add_argument("directory")
+    restore_parser.add_argument("--batch", type=int, default=2000, help="Media per pipeline flush")
+    restore_parser.add_argument("--force", action="store_true", help="Restore into a database that isn't empty")
+
+    args = parser.parse_args()
+    if pa is None:
+        sys.exit("pyarrow isn't installed (pip install pyarrow).")
+    asyncio.run({"export": export, "restore": restore}[args.command](args))
+
+if __name__ == "__main__":
+    main()
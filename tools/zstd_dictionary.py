@@ -0,0 +1,191 @@
+"""
+Trains, rolls out and reports on the zstd dictionaries stored media are compressed with.
+
+    python -m tools.zstd_dictionary train [--samples 10000] [--size 65536] [--out media.zdict]
+    python -m tools.zstd_dictionary rollout media.zdict [--rewrite] [--batch 500]
+    python -m tools.zstd_dictionary report [--samples 2000] [--dict media.zdict]
+
+train samples stored media from every shard and writes the trained dictionary to a file.
+rollout stores it on every shard and makes it the active one, workers running with MEDIA_COMPRESSION=zstd
+switch to it within ZSTD_DICT_REFRESH seconds. --rewrite also recompresses what's already stored,
+values that change while it runs are left to the write that changed them.
+report compares stored size and decode cost of plain protos against the dictionary (the active one without --dict).
+Connects with the same REDIS_* and KEYSPACE_LAYOUT settings as the app.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+from app.core import blobs
+from app.core.database import get_shards
+from app.core.proto.media_info_pb2 import OmnistreamProtoSummary # type: ignore
+from app.torrents.services import layout
+
+# Only swaps the value when it's still what was read, so a write landing mid rewrite isn't undone.
+# ARGV[3] is the media's field when the layout keeps media in hashes.
+REWRITE_BLOB_LUA = """
+local field = ARGV[3]
+local current
+if field then
+    current = redis.call('HGET', KEYS[1], field)
+else
+    current = redis.call('GET', KEYS[1])
+end
+if current ~= ARGV[1] then
+    return 0
+end
+if field then
+    redis.call('HSET', KEYS[1], field, ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+async def sample_media(count: int, seed: int) -> tuple:
+    """
+    (serialized protos of up to count media picked at random over every shard, number of media stored).
+    Walks the whole keyspace once, only the picked media are kept.
+    """
+    rng = random.Random(seed)
+    picked = []
+    total = 0
+    for redis_client in get_shards():
+        async for batch in layout.scan_media(redis_client, 1000):
+            for _, blob in batch:
+                if not blob:
+                    continue
+                total += 1
+                if len(picked) < count:
+                    picked.append(blob)
+                else:
+                    slot = rng.randrange(total)
+                    if slot < count:
+                        picked[slot] = blob
+
+    return await blobs.unpack_media_blobs(picked), total
+
+def best_per_call(func, items: list, repeats: int = 5) -> float:
+    """
+    Best of `repeats` passes over items, in seconds per item.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items)
+
+async def train(args):
+    samples, total = await sample_media(args.samples, args.seed)
+    if len(samples) < 100:
+        sys.exit(f"Only {len(samples)} media stored, need at least 100 to train on.")
+
+    holdout = samples[:len(samples) // 10]
+    zstd_dict = blobs.zstd.train_dict(samples[len(holdout):], args.size)
+    Path(args.out).write_bytes(zstd_dict.dict_content)
+
+    compressor = blobs.MediaCompressor(zstd_dict, args.level)
+    plain = sum(len(sample) for sample in holdout)
+    packed = sum(len(blobs.pack_media_blob(sample, compressor)) for sample in holdout)
+    print(f"Trained dictionary {zstd_dict.dict_id} ({len(zstd_dict.dict_content)} bytes) on {len(samples) - len(holdout)} of {total} media -> {args.out}")
+    print(f"Held out {len(holdout)} media: {plain / len(holdout):.0f} -> {packed / len(holdout):.0f} bytes each ({plain / packed:.2f}x)")
+
+async def rollout(args):
+    zstd_dict = blobs.zstd.ZstdDict(Path(args.dictionary).read_bytes())
+    for redis_client in get_shards():
+        pipe = redis_client.pipeline()
+        pipe.hset(blobs.ZSTD_DICTS_KEY, str(zstd_dict.dict_id), zstd_dict.dict_content)
+        pipe.set(blobs.ZSTD_ACTIVE_DICT_KEY, str(zstd_dict.dict_id))
+        await pipe.execute()
+    await blobs.load_dictionaries()
+    print(f"Dictionary {zstd_dict.dict_id} is active on {len(get_shards())} shard(s)")
+
+    if not args.rewrite:
+        return
+
+    compressor = blobs.MediaCompressor(zstd_dict, args.level)
+    rewritten = skipped = 0
+    for shard, redis_client in enumerate(get_shards()):
+        rewrite_script = redis_client.register_script(REWRITE_BLOB_LUA)
+
+        async for batch in layout.scan_media(redis_client, args.batch):
+            stored = [blob for _, blob in batch]
+            pipe = redis_client.pipeline(transaction=False)
+            queued = 0
+            for (unique_id, blob), data in zip(batch, await blobs.unpack_media_blobs(stored)):
+                if not blob:
+                    continue
+                packed = blobs.pack_media_blob(data, compressor)
+                if packed != blob:
+                    key, field = layout.media_location(unique_id)
+                    await rewrite_script(keys=[key], args=[blob, packed] + ([field] if field else []), client=pipe)
+                    queued += 1
+            if queued:
+                for swapped in await pipe.execute():
+                    rewritten += swapped
+                    skipped += 1 - swapped
+        print(f"Shard {shard}: {rewritten} rewritten so far, {skipped} changed underneath and skipped")
+
+async def report(args):
+    await blobs.load_dictionaries()
+    if args.dictionary:
+        zstd_dict = blobs.zstd.ZstdDict(Path(args.dictionary).read_bytes())
+        blobs.dictionaries[zstd_dict.dict_id] = zstd_dict
+    else:
+        zstd_dict = blobs.active_dictionary
+    if zstd_dict is None:
+        sys.exit("No active dictionary, pass one with --dict.")
+
+    samples, total = await sample_media(args.samples, args.seed)
+    if not samples:
+        sys.exit("No media stored.")
+
+    compressor = blobs.MediaCompressor(zstd_dict, args.level)
+    packed = [blobs.pack_media_blob(sample, compressor) for sample in samples]
+    plain_size = sum(len(sample) for sample in samples) / len(samples)
+    packed_size = sum(len(blob) for blob in packed) / len(samples)
+
+    plain_decode = best_per_call(OmnistreamProtoSummary.FromString, samples)
+    packed_decode = best_per_call(lambda blob: OmnistreamProtoSummary.FromString(blobs.unpack_media_blob(blob)), packed)
+
+    print(f"dictionary          {zstd_dict.dict_id}, level {args.level}")
+    print(f"media sampled       {len(samples)} of {total}")
+    print(f"avg value size      plain {plain_size:.0f} B, zstd {packed_size:.0f} B ({plain_size / packed_size:.2f}x)")
+    print(f"projected saving    {(plain_size - packed_size) * total / 1024 ** 2:.1f} MiB over all media (values only, key overhead is the same)")
+    print(
+        f"decode per media    plain {plain_decode * 1e6:.1f}us, zstd {packed_decode * 1e6:.1f}us"
+        f" (+{(packed_decode - plain_decode) * 1e6:.1f}us, {(packed_decode - plain_decode) * 1e6:.1f}ms of cpu per 1000 reads)"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--level", type=int, default=blobs.MEDIA_COMPRESSION_LEVEL, help="zstd level to compress with")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for picking the sampled media")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = commands.add_parser("train", help="Train a dictionary on a sample of stored media")
+    train_parser.add_argument("--samples", type=int, default=10000, help="Media to train on (10%% held out to check it)")
+    train_parser.add_argument("--size", type=int, default=64 * 1024, help="Dictionary size in bytes")
+    train_parser.add_argument("--out", default="media.zdict", help="File to write the dictionary to")
+
+    rollout_parser = commands.add_parser("rollout", help="Make a trained dictionary the active one on every shard")
+    rollout_parser.add_argument("dictionary", help="File written by train")
+    rollout_parser.add_argument("--rewrite", action="store_true", help="Recompress the media already stored")
+    rollout_parser.add_argument("--batch", type=int, default=500, help="Media per read/pipeline when rewriting")
+
+    report_parser = commands.add_parser("report", help="Memory saved vs decode cost on a sample of stored media")
+    report_parser.add_argument("--samples", type=int, default=2000, help="Media to measure")
+    report_parser.add_argument("--dict", dest="dictionary", help="Dictionary file, the active one if not given")
+
+    args = parser.parse_args()
+    if not blobs.compression_available():
+        sys.exit("zstd isn't available, install backports.zstd or use Python 3.14+.")
+    asyncio.run({"train": train, "rollout": rollout, "report": report}[args.command](args))
+
+if __name__ == "__main__":
+    main()